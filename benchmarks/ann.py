@@ -0,0 +1,107 @@
+# benchmarks/ann.py
+"""
+Recall-vs-latency benchmark for the FAISS index types in index/faiss_index.py.
+
+    python -m benchmarks.ann --n 1000000 --types ivf_flat,ivf_pq,hnsw --nprobe 8,16,64 --ef 32,64,128
+
+Vectors come from the current index (--from-index) or a synthetic clustered corpus
+shaped like MiniLM embeddings. Recall@k is measured against the exact flat index;
+latency is per single-row query, the way /query searches.
+"""
+import json, time
+import numpy as np
+import faiss
+import typer
+
+from config import FAISS_INDEX_PATH, META_PATH
+from index.faiss_index import make_index, search_vectors, get_index_manager, compact_index
+
+app = typer.Typer()
+
+def synthetic_corpus(n, dim, n_clusters=256, seed=0):
+    # clustered gaussians: uniform random vectors make every ANN index look bad
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+    assign = rng.integers(0, n_clusters, size=n)
+    vecs = centers[assign] + 0.35 * rng.standard_normal((n, dim)).astype("float32")
+    faiss.normalize_L2(vecs)
+    return vecs
+
+def vectors_from_index(index_path=FAISS_INDEX_PATH, meta_path=META_PATH):
+    compact_index(index_path, meta_path, full=True)  # every vector in the base segment
+    index, _ = get_index_manager(index_path, meta_path).get()
+    index = index.base
+    inner = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    return inner.reconstruct_n(0, inner.ntotal)
+
+def _percentile_ms(samples, p):
+    return float(np.percentile(samples, p) * 1000.0)
+
+def run_one(index, queries, gt, k, nprobe=None, ef_search=None):
+    lat = []
+    hits = 0
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        _, I = search_vectors(index, queries[i:i + 1], k, nprobe=nprobe, ef_search=ef_search)
+        lat.append(time.perf_counter() - t0)
+        hits += len(np.intersect1d(I[0], gt[i]))
+    return {
+        "recall_at_k": hits / float(len(queries) * k),
+        "p50_ms": _percentile_ms(lat, 50),
+        "p99_ms": _percentile_ms(lat, 99),
+        "qps_single": len(queries) / sum(lat),
+    }
+
+@app.command()
+def main(
+    n: int = typer.Option(100000, help="Synthetic corpus size"),
+    dim: int = typer.Option(384, help="Synthetic vector dimension"),
+    queries: int = typer.Option(500, help="Number of queries"),
+    k: int = typer.Option(20, help="Recall@k / top_k"),
+    types: str = typer.Option("ivf_flat,ivf_pq,hnsw", help="Comma-separated index types"),
+    nprobe: str = typer.Option("4,16,64", help="nprobe values for IVF types"),
+    ef: str = typer.Option("32,64,128", help="efSearch values for HNSW"),
+    from_index: bool = typer.Option(False, help="Use vectors from the current index instead of synthetic data"),
+    out: str = typer.Option("", help="Write results as JSON to this path"),
+):
+    vecs = vectors_from_index() if from_index else synthetic_corpus(n, dim)
+    n, dim = vecs.shape
+    rng = np.random.default_rng(1)
+    # queries: perturbed corpus points, normalized like real query embeddings
+    q = vecs[rng.integers(0, n, size=queries)] + 0.05 * rng.standard_normal((queries, dim)).astype("float32")
+    q = np.ascontiguousarray(q, dtype="float32")
+    faiss.normalize_L2(q)
+    ids = np.arange(n, dtype="int64")
+
+    flat, _ = make_index(dim, None, "flat")
+    flat.add_with_ids(vecs, ids)
+    _, gt = flat.search(q, k)
+    results = [{"type": "flat", "build_s": 0.0, **run_one(flat, q, gt, k)}]
+
+    for t in [x.strip() for x in types.split(",") if x.strip()]:
+        t0 = time.perf_counter()
+        index, actual = make_index(dim, vecs, t)
+        index.add_with_ids(vecs, ids)
+        build_s = time.perf_counter() - t0
+        if actual == "hnsw":
+            sweeps = [("ef_search", int(v)) for v in ef.split(",")]
+        elif actual in ("ivf_flat", "ivf_pq"):
+            sweeps = [("nprobe", int(v)) for v in nprobe.split(",")]
+        else:
+            sweeps = [(None, None)]
+        for param, value in sweeps:
+            kw = {param: value} if param else {}
+            row = {"type": actual, "build_s": build_s, **({param: value} if param else {}), **run_one(index, q, gt, k, **kw)}
+            results.append(row)
+
+    typer.echo(f"n={n} dim={dim} queries={queries} k={k}")
+    typer.echo(f"{'type':<10}{'param':<16}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'build s':>10}")
+    for r in results:
+        param = f"nprobe={r['nprobe']}" if "nprobe" in r else (f"ef={r['ef_search']}" if "ef_search" in r else "-")
+        typer.echo(f"{r['type']:<10}{param:<16}{r['recall_at_k']:>10.3f}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['build_s']:>10.1f}")
+    if out:
+        with open(out, "w") as f:
+            json.dump({"n": n, "dim": dim, "queries": queries, "k": k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    app()
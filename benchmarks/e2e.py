@@ -0,0 +1,268 @@
+# benchmarks/e2e.py
+"""
+End-to-end performance benchmark on synthetic 10-Q-style PDFs.
+
+    python -m benchmarks.e2e --text-pages 50 --table-pages 20 --scan-pages 5 --clients 1,4,16
+
+Generates three PDFs with pymupdf in a scratch data dir (MMR_DATA_DIR is pointed
+there, the real corpus is never touched):
+
+    text.pdf    prose pages with figures in the sentences
+    tables.pdf  ruled statement tables (pdfplumber finds them as tables)
+    scans.pdf   pages that are a single image of text: no text layer, so OCR runs
+
+and times each stage on its own:
+
+    ingest  pages/s per PDF (parse + OCR + chunk + store, ingest_to_store)
+    embed   chunks/s of the text embedder over every stored text chunk (cache off)
+    build   sync_index(rebuild=True) with a warm embedding cache, i.e. index build only
+    query   POST /query against web/app.py (a uvicorn subprocess, or --url) at each
+            client concurrency: p50/p95/p99 latency and throughput
+
+Results go to --out as JSON (commit, config and machine info included), so runs
+can be compared across commits to catch regressions.
+"""
+import json, os, platform, random, shutil, subprocess, sys, tempfile, threading, time
+import urllib.parse, urllib.request, urllib.error
+from typing import Optional
+import numpy as np
+import typer
+
+app = typer.Typer()
+
+LABELS = ["Total revenue", "Cost of revenue", "Gross profit", "Research and development",
+          "Operating income", "Net income", "Cash and cash equivalents", "Total assets",
+          "Total liabilities", "Diluted net income per share"]
+SEGMENTS = ["Data Center", "Gaming", "Professional Visualization", "Automotive", "OEM and Other"]
+
+def _fitz():
+    try:
+        import pymupdf
+    except ImportError:  # older PyMuPDF only ships the fitz name
+        import fitz as pymupdf
+    return pymupdf
+
+def _money(rng):
+    return f"${rng.randint(100, 99999):,}"
+
+def _prose(rng, n_sentences):
+    out = []
+    for _ in range(n_sentences):
+        seg, lab = rng.choice(SEGMENTS), rng.choice(LABELS).lower()
+        out.append(rng.choice([
+            f"{seg} revenue was {_money(rng)} million, up {rng.randint(1, 300)}% from a year ago.",
+            f"For the quarter, {lab} was {_money(rng)} million compared to {_money(rng)} million.",
+            f"We repurchased {rng.randint(1, 99)} million shares of common stock for {_money(rng)} million.",
+            f"Gross margin was {rng.randint(50, 80)}.{rng.randint(0, 9)}% driven by {seg} demand.",
+        ]))
+    return " ".join(out)
+
+def _text_page(doc, rng):
+    page = doc.new_page()
+    page.insert_textbox(page.rect + (50, 50, -50, -50), _prose(rng, 30), fontsize=10)
+
+def _table_page(doc, rng, rows=12):
+    pymupdf = _fitz()
+    page = doc.new_page()
+    page.insert_text((50, 60), "CONDENSED CONSOLIDATED STATEMENTS OF INCOME (in millions, except per share data)", fontsize=9)
+    x = [50, 300, 420, 540]
+    top, h = 80, 18
+    cells = [["", "Three Months Ended Apr 28, 2024", "Three Months Ended Apr 30, 2023"]]
+    cells += [[rng.choice(LABELS), _money(rng), _money(rng)] for _ in range(rows)]
+    for r, row in enumerate(cells):
+        y = top + r * h
+        for c, val in enumerate(row):
+            rect = pymupdf.Rect(x[c], y, x[c + 1], y + h)
+            page.draw_rect(rect, color=(0, 0, 0), width=0.5)
+            page.insert_textbox(rect + (3, 3, -3, 0), val, fontsize=7 if r == 0 else 8)
+
+def _scan_page(doc, rng):
+    # render a prose page to pixels and place it as the only content of a new page
+    pymupdf = _fitz()
+    tmp = pymupdf.open()
+    src = tmp.new_page()
+    src.insert_textbox(src.rect + (50, 50, -50, -50), _prose(rng, 12), fontsize=12)
+    pix = src.get_pixmap(dpi=100)
+    page = doc.new_page()
+    page.insert_image(page.rect, pixmap=pix)
+    tmp.close()
+
+def make_pdf(path, kind, pages, seed=0):
+    pymupdf = _fitz()
+    rng = random.Random(f"{kind}-{seed}")
+    doc = pymupdf.open()
+    make = {"text": _text_page, "tables": _table_page, "scans": _scan_page}[kind]
+    for _ in range(pages):
+        make(doc, rng)
+    doc.save(path)
+    doc.close()
+    return path
+
+def make_queries(n, seed=0):
+    rng = random.Random(seed)
+    templates = ["What was {lab} for the quarter?", "How did {lab} compare to the prior year?",
+                 "What was {seg} revenue?", "How many shares were repurchased?",
+                 "What was {lab} for {seg} in quarter {q}?"]
+    return [rng.choice(templates).format(lab=rng.choice(LABELS).lower(), seg=rng.choice(SEGMENTS), q=rng.randint(1, 4))
+            for _ in range(n)]
+
+def _pct(lat, p):
+    return float(np.percentile(lat, p) * 1000.0) if len(lat) else None
+
+def _post_query(url, q, timeout):
+    data = urllib.parse.urlencode({"q": q}).encode()
+    with urllib.request.urlopen(urllib.request.Request(url + "/query", data=data), timeout=timeout) as r:
+        body = json.loads(r.read())
+    return body.get("status") != "error"
+
+def run_clients(url, queries, clients, per_client, timeout=120.0):
+    """clients threads, each sending per_client queries back to back."""
+    lat, errors = [], [0]
+    lock = threading.Lock()
+    def client(i):
+        rng = random.Random(i)
+        for _ in range(per_client):
+            t0 = time.perf_counter()
+            try:
+                ok = _post_query(url, rng.choice(queries), timeout)
+            except (urllib.error.URLError, OSError, ValueError):
+                ok = False
+            dt = time.perf_counter() - t0
+            with lock:
+                lat.append(dt)
+                errors[0] += not ok
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    return {"clients": clients, "requests": len(lat), "errors": errors[0], "qps": len(lat) / wall,
+            "p50_ms": _pct(lat, 50), "p95_ms": _pct(lat, 95), "p99_ms": _pct(lat, 99)}
+
+def _get_json(url, timeout=5.0):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as r:
+            return r.status, json.loads(r.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"{}")
+
+def start_server(port, data_dir, ready_timeout):
+    env = dict(os.environ, MMR_DATA_DIR=data_dir)
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "web.app:app", "--host", "127.0.0.1", "--port", str(port)],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < ready_timeout:
+        if proc.poll() is not None:
+            raise RuntimeError("uvicorn exited during start-up")
+        try:
+            status, _ = _get_json(url + "/ready")
+            if status == 200:
+                return proc, url, time.perf_counter() - t0
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.25)
+    proc.terminate()
+    raise RuntimeError(f"server not ready after {ready_timeout}s")
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+@app.command()
+def main(
+    text_pages: int = typer.Option(50, help="Pages of prose"),
+    table_pages: int = typer.Option(20, help="Pages with a ruled statement table"),
+    scan_pages: int = typer.Option(5, help="Image-only pages (OCR)"),
+    workers: Optional[int] = typer.Option(None, help="Ingest processes (default: MMR_INGEST_WORKERS)"),
+    clients: str = typer.Option("1,4,16", help="Concurrent client counts for the query stage"),
+    requests_per_client: int = typer.Option(20, help="Queries each client sends"),
+    n_queries: int = typer.Option(200, help="Distinct questions sampled by the clients"),
+    url: str = typer.Option("", help="Query a running server instead of starting one (its corpus is used as is)"),
+    port: int = typer.Option(8765, help="Port for the benchmark server"),
+    ready_timeout: float = typer.Option(600.0, help="Seconds to wait for /ready"),
+    workdir: str = typer.Option("", help="Scratch data dir (default: a temp dir, removed afterwards)"),
+    out: str = typer.Option("e2e_results.json", help="Where to write the JSON results"),
+):
+    scratch = workdir or tempfile.mkdtemp(prefix="mmr-e2e-")
+    # config is read at import: point it at the scratch dir before importing the pipeline
+    os.environ["MMR_DATA_DIR"] = os.path.join(scratch, "data")
+    from config import RAW_DIR, FAISS_INDEX_TYPE, EMBED_BACKEND, INGEST_WORKERS
+    from pipeline.ingest import ingest_to_store
+    from chunking.store import list_documents, load_document_chunks
+    from embeddings.embedder import embed_texts
+    from index.builder import sync_index
+    from index.image_index import split_chunks
+
+    results = {
+        "commit": _git_commit(), "python": platform.python_version(), "machine": platform.machine(),
+        "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"index_type": FAISS_INDEX_TYPE, "embed_backend": EMBED_BACKEND,
+                   "ingest_workers": workers if workers is not None else INGEST_WORKERS},
+        "corpus": {"text_pages": text_pages, "table_pages": table_pages, "scan_pages": scan_pages},
+    }
+    proc = None
+    try:
+        os.makedirs(RAW_DIR, exist_ok=True)
+        pdfs = [(kind, n) for kind, n in (("text", text_pages), ("tables", table_pages), ("scans", scan_pages)) if n]
+        ingest = []
+        for kind, n in pdfs:
+            path = make_pdf(os.path.join(RAW_DIR, f"{kind}.pdf"), kind, n)
+            t0 = time.perf_counter()
+            res = ingest_to_store(path, workers=workers)
+            dt = time.perf_counter() - t0
+            ingest.append({"pdf": kind, "pages": res["pages"], "chunks": res["chunks"], "seconds": dt,
+                           "pages_per_s": res["pages"] / dt})
+            typer.echo(f"ingest {kind:<7}{res['pages']:>6} pages {dt:>8.2f}s {res['pages'] / dt:>8.1f} pages/s")
+        results["ingest"] = ingest
+
+        texts = []
+        for doc_id in list_documents():
+            chunks, _ = load_document_chunks(doc_id)
+            texts.extend(c.get("text", "") for c in split_chunks(chunks)[0])
+        embed_texts(texts[:8], use_cache=False)  # model load is not part of the throughput
+        t0 = time.perf_counter()
+        embed_texts(texts, use_cache=False)
+        dt = time.perf_counter() - t0
+        results["embed"] = {"chunks": len(texts), "seconds": dt, "chunks_per_s": len(texts) / dt}
+        typer.echo(f"embed  {len(texts):>6} chunks {dt:>8.2f}s {len(texts) / dt:>8.1f} chunks/s")
+
+        sync_index()  # fills the embedding cache
+        t0 = time.perf_counter()
+        sync_index(rebuild=True)
+        dt = time.perf_counter() - t0
+        results["build"] = {"chunks": len(texts), "seconds": dt}
+        typer.echo(f"build  {len(texts):>6} chunks {dt:>8.2f}s")
+
+        if url:
+            base, ready_s = url.rstrip("/"), None
+        else:
+            proc, base, ready_s = start_server(port, os.environ["MMR_DATA_DIR"], ready_timeout)
+        results["server"] = {"url": base, "ready_s": ready_s}
+        queries = make_queries(n_queries)
+        rows = []
+        for n in [int(c) for c in clients.split(",") if c.strip()]:
+            row = run_clients(base, queries, n, requests_per_client)
+            rows.append(row)
+            typer.echo(f"query  {n:>3} clients {row['requests']:>6} req  p50 {row['p50_ms']:.1f}  p95 {row['p95_ms']:.1f}  "
+                       f"p99 {row['p99_ms']:.1f} ms  {row['qps']:.1f} q/s  errors {row['errors']}")
+        results["query"] = rows
+        _, status = _get_json(base + "/status")
+        results["server"]["query_cache"] = status.get("query_cache")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+        if not workdir:
+            shutil.rmtree(scratch, ignore_errors=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    typer.echo(f"results written to {out}")
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,136 @@
+# benchmarks/extractors.py
+"""
+Microbenchmark for the extraction paths of qa/generator.answer_query.
+
+    python -m benchmarks.extractors --queries 2000 --top-k 20
+
+Chunks come from the chunk store (data/chunks, i.e. the 10-Qs you ingested); with an
+empty store or --synthetic, 10-Q-shaped chunks (statement table rows, OCR'd pages with
+repeated blocks, exhibit text) are generated. Each query runs the comparison, numeric,
+repurchase and certification extractors over top_k sampled chunks, like one /query.
+
+"cold" clears the per-chunk token cache before every query (cost of the single-pass
+tokeniser alone), "warm" keeps it (chunks retrieved again are not re-tokenised). Only
+the public extractor functions are called, so the same command run at an earlier
+commit gives the baseline.
+"""
+import json, random, time
+import numpy as np
+import typer
+
+from chunking.store import list_documents, load_document_chunks
+from qa import extractors
+
+app = typer.Typer()
+
+NUMERIC_LABELS = [
+    "total revenue", "revenue", "cost of revenue", "net income",
+    "cash and cash equivalents", "basic net income per share",
+    "diluted net income per share", "earnings per share", "eps", "total assets",
+    "total liabilities",
+]
+
+def stored_chunks():
+    chunks = []
+    for doc_id in list_documents():
+        doc_chunks, _ = load_document_chunks(doc_id)
+        chunks.extend(doc_chunks or [])
+    return chunks
+
+def synthetic_chunks(n, seed=0):
+    rng = random.Random(seed)
+    labels = NUMERIC_LABELS + ["research and development", "operating income", "income tax expense"]
+    def money():
+        return f"${rng.randint(100, 99999):,}" if rng.random() < 0.5 else f"{rng.randint(100, 99999):,}"
+    out = []
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.5:
+            rows = [f"{rng.choice(labels).title()} {money()} {money()}" for _ in range(rng.randint(3, 12))]
+            text = "(in millions, except per share data)\n" + "\n".join(rows)
+            ctype = "table"
+        elif kind < 0.8:
+            para = " ".join(rng.choice([
+                "Revenue for the quarter was", money(), "compared to", money(), "a change of",
+                f"{rng.randint(1, 99)}%", "driven by Data Center.", "We repurchased", f"{rng.randint(1, 99)},000 shares",
+                "of common stock.", "Gross margin was", f"{rng.randint(50, 80)}.{rng.randint(0, 9)}%",
+            ]) for _ in range(rng.randint(20, 80)))
+            # OCR output often repeats its leading block
+            block = para[:rng.choice([20, 40, 60])]
+            text = block * rng.randint(1, 6) + para
+            ctype = "text"
+        else:
+            text = ("Exhibit 32.1 Certification of Chief Executive Officer pursuant to 18 U.S.C. Section 1350, "
+                    "furnished herewith. ") * rng.randint(1, 4)
+            ctype = "text"
+        out.append({"doc_id": "synthetic", "page": i // 4 + 1, "chunk_id": f"c{i}", "type": ctype, "text": text})
+    return out
+
+def run_query(chunks):
+    for lab in ["revenue", "total revenue", "net revenue"]:
+        extractors.extract_comparison_from_chunks(chunks, lab)
+    extractors.extract_repurchases(chunks)
+    extractors.extract_certification_text(chunks)
+    extractors.extract_numeric_candidates_from_chunks(chunks, NUMERIC_LABELS)
+
+def _clear():
+    clear = getattr(extractors, "clear_token_cache", None)
+    if clear:
+        clear()
+
+def bench(corpus, queries, top_k, cold, seed=1):
+    rng = random.Random(seed)
+    # retrieval is skewed: popular chunks come back for many queries
+    weights = [1.0 / (i + 1) for i in range(len(corpus))]
+    lat = []
+    _clear()
+    for _ in range(queries):
+        sample = rng.choices(corpus, weights=weights, k=top_k)
+        if cold:
+            _clear()
+        t0 = time.perf_counter()
+        run_query(sample)
+        lat.append(time.perf_counter() - t0)
+    lat = np.array(lat)
+    return {
+        "mode": "cold" if cold else "warm",
+        "p50_ms": float(np.percentile(lat, 50) * 1000.0),
+        "p99_ms": float(np.percentile(lat, 99) * 1000.0),
+        "qps": queries / float(lat.sum()),
+    }
+
+def bench_dedupe(size):
+    text = ("Item 2. Management's Discussion and Analysis " * 3)[:60] * (size // 60) + " tail"
+    t0 = time.perf_counter()
+    extractors._clean_text_dedupe(text, max_repeat_seq_len=80)
+    return {"dedupe_chars": len(text), "dedupe_ms": (time.perf_counter() - t0) * 1000.0}
+
+@app.command()
+def main(
+    queries: int = typer.Option(2000, help="Number of simulated queries"),
+    top_k: int = typer.Option(20, help="Chunks per query"),
+    synthetic: int = typer.Option(0, help="Use N synthetic 10-Q chunks instead of the chunk store"),
+    dedupe_chars: int = typer.Option(200000, help="Length of the repeated OCR block for the dedupe timing"),
+    out: str = typer.Option("", help="Write results as JSON to this path"),
+):
+    corpus = [] if synthetic else stored_chunks()
+    source = "chunk store"
+    if not corpus:
+        corpus = synthetic_chunks(synthetic or 2000)
+        source = "synthetic"
+    random.Random(0).shuffle(corpus)
+    results = [bench(corpus, queries, top_k, cold=True), bench(corpus, queries, top_k, cold=False)]
+    dedupe = bench_dedupe(dedupe_chars)
+
+    typer.echo(f"corpus={len(corpus)} chunks ({source}) queries={queries} top_k={top_k}")
+    typer.echo(f"{'mode':<8}{'p50 ms':>10}{'p99 ms':>10}{'qps':>10}")
+    for r in results:
+        typer.echo(f"{r['mode']:<8}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['qps']:>10.1f}")
+    typer.echo(f"_clean_text_dedupe on {dedupe['dedupe_chars']} chars: {dedupe['dedupe_ms']:.2f} ms")
+    if out:
+        with open(out, "w") as f:
+            json.dump({"corpus": len(corpus), "source": source, "queries": queries, "top_k": top_k,
+                       "results": results, **dedupe}, f, indent=2)
+
+if __name__ == "__main__":
+    app()
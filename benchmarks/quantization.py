@@ -0,0 +1,160 @@
+# benchmarks/quantization.py
+"""
+Compare the CPU inference backends of embeddings/backends.py (fp32, int8, onnx).
+
+    python -m benchmarks.quantization --backends fp32,int8,onnx --texts 2000 --queries 200
+
+Embedder, per backend: load time, resident-memory growth, corpus throughput, single
+query latency, mean cosine to the fp32 vectors, and recall@k of the top-k chunks
+against fp32 retrieval, both with the corpus re-embedded by the backend ("reindexed")
+and with backend queries against the existing fp32 vectors ("fp32 index").
+Generator (--gen-prompts): load time, memory, decode tokens/s and the share of
+answers identical to fp32.
+
+Texts are the chunk store's (or 10-Q-shaped synthetic chunks when it is empty).
+Memory is the RSS delta of this process, so run one backend at a time for clean
+numbers; fp32 is always run first as the reference.
+"""
+import gc, json, random, resource, time
+import numpy as np
+import typer
+
+from config import TEXT_EMBED_MODEL, GEN_MODEL
+from embeddings.backends import load_sentence_transformer, load_seq2seq
+from benchmarks.extractors import stored_chunks, synthetic_chunks, NUMERIC_LABELS
+
+app = typer.Typer()
+
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    # peak, not current: only meaningful for the first backend loaded
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def _normalize(x):
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+def _topk(q, corpus, k):
+    return np.argsort(-(q @ corpus.T), axis=1, kind="stable")[:, :k]
+
+def _recall(found, ref):
+    k = ref.shape[1]
+    return float(np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(found, ref)]))
+
+def corpus_and_queries(n_texts, n_queries, seed=0):
+    chunks = stored_chunks() or synthetic_chunks(n_texts)
+    rng = random.Random(seed)
+    rng.shuffle(chunks)
+    texts = [c.get("text", "") or "" for c in chunks[:n_texts]]
+    queries = []
+    for i in range(n_queries):
+        if i % 2:
+            queries.append(f"What was {rng.choice(NUMERIC_LABELS)} for the quarter?")
+        else:
+            words = rng.choice(texts).split()
+            start = rng.randint(0, max(0, len(words) - 12))
+            queries.append(" ".join(words[start:start + 12]))
+    return texts, queries
+
+def bench_embedder(backend, texts, queries, batch_size):
+    gc.collect()
+    rss0, t0 = _rss_mb(), time.perf_counter()
+    model, used = load_sentence_transformer(TEXT_EMBED_MODEL, backend)
+    load_s, rss = time.perf_counter() - t0, _rss_mb() - rss0
+    encode = lambda xs, bs: _normalize(model.encode(xs, batch_size=bs, show_progress_bar=False,
+                                                    convert_to_numpy=True).astype("float32"))
+    encode(texts[:batch_size], batch_size)  # warm-up
+    t0 = time.perf_counter()
+    corpus = encode(texts, batch_size)
+    enc_s = time.perf_counter() - t0
+    lat = []
+    for q in queries:
+        t0 = time.perf_counter()
+        encode([q], 1)
+        lat.append(time.perf_counter() - t0)
+    q_emb = encode(queries, batch_size)
+    del model
+    return {"backend": used, "load_s": load_s, "rss_mb": rss, "texts_per_s": len(texts) / enc_s,
+            "query_p50_ms": float(np.percentile(lat, 50) * 1000.0)}, corpus, q_emb
+
+def bench_generator(backend, prompts, max_new_tokens):
+    import torch
+    gc.collect()
+    rss0, t0 = _rss_mb(), time.perf_counter()
+    tok, model, used = load_seq2seq(GEN_MODEL, backend)
+    load_s, rss = time.perf_counter() - t0, _rss_mb() - rss0
+    outs, n_tokens, gen_s = [], 0, 0.0
+    for p in prompts:
+        enc = tok(p, return_tensors="pt", truncation=True, max_length=512)
+        t0 = time.perf_counter()
+        with torch.inference_mode():
+            ids = model.generate(**enc, max_new_tokens=max_new_tokens, do_sample=False, num_beams=1)
+        gen_s += time.perf_counter() - t0
+        n_tokens += int(ids.shape[1]) - 1  # minus the decoder start token
+        outs.append(tok.decode(ids[0], skip_special_tokens=True).strip())
+    del model
+    return {"backend": used, "load_s": load_s, "rss_mb": rss, "tokens_per_s": n_tokens / max(gen_s, 1e-9)}, outs
+
+@app.command()
+def main(
+    backends: str = typer.Option("fp32,int8,onnx", help="Comma-separated backends (fp32 is always the reference)"),
+    texts: int = typer.Option(2000, help="Corpus chunks to embed"),
+    queries: int = typer.Option(200, help="Queries for latency / recall"),
+    k: int = typer.Option(10, help="Recall@k"),
+    batch_size: int = typer.Option(32, help="Embedding batch size"),
+    gen_prompts: int = typer.Option(8, help="Prompts for the generator comparison (0 skips it)"),
+    max_new_tokens: int = typer.Option(64, help="Generated tokens per prompt"),
+    out: str = typer.Option("", help="Write results as JSON to this path"),
+):
+    names = [b.strip() for b in backends.split(",") if b.strip()]
+    names = ["fp32"] + [b for b in names if b != "fp32"]
+    corpus_texts, qs = corpus_and_queries(texts, queries)
+
+    emb_rows, ref = [], None
+    for b in names:
+        row, corpus, q_emb = bench_embedder(b, corpus_texts, qs, batch_size)
+        if ref is None:
+            ref = (corpus, q_emb, _topk(q_emb, corpus, k))
+        row["requested"] = b
+        row["cosine_vs_fp32"] = float(np.mean(np.sum(corpus * ref[0], axis=1)))
+        row["recall_reindexed"] = _recall(_topk(q_emb, corpus, k), ref[2])
+        row["recall_fp32_index"] = _recall(_topk(q_emb, ref[0], k), ref[2])
+        emb_rows.append(row)
+
+    gen_rows = []
+    if gen_prompts:
+        prompts = [f"Answer using only the context.\n\nCONTEXT:\n{t[:1500]}\n\nQUESTION: {q}\n\nAnswer:"
+                   for t, q in zip(corpus_texts, qs[1::2])][:gen_prompts]
+        ref_out = None
+        for b in names:
+            row, outs = bench_generator(b, prompts, max_new_tokens)
+            if ref_out is None:
+                ref_out = outs
+            row["requested"] = b
+            row["same_as_fp32"] = float(np.mean([a == r for a, r in zip(outs, ref_out)]))
+            gen_rows.append(row)
+
+    typer.echo(f"embedder {TEXT_EMBED_MODEL}: texts={len(corpus_texts)} queries={len(qs)} k={k}")
+    typer.echo(f"{'backend':<14}{'load s':>8}{'rss MB':>9}{'texts/s':>10}{'q p50 ms':>10}{'cosine':>9}{'R@k re':>9}{'R@k fp32':>10}")
+    for r in emb_rows:
+        name = r["backend"] if r["backend"] == r["requested"] else f"{r['requested']}->{r['backend']}"
+        typer.echo(f"{name:<14}{r['load_s']:>8.1f}{r['rss_mb']:>9.0f}{r['texts_per_s']:>10.1f}{r['query_p50_ms']:>10.2f}"
+                   f"{r['cosine_vs_fp32']:>9.4f}{r['recall_reindexed']:>9.3f}{r['recall_fp32_index']:>10.3f}")
+    if gen_rows:
+        typer.echo(f"generator {GEN_MODEL}: prompts={len(prompts)} max_new_tokens={max_new_tokens}")
+        typer.echo(f"{'backend':<14}{'load s':>8}{'rss MB':>9}{'tok/s':>10}{'same':>9}")
+        for r in gen_rows:
+            name = r["backend"] if r["backend"] == r["requested"] else f"{r['requested']}->{r['backend']}"
+            typer.echo(f"{name:<14}{r['load_s']:>8.1f}{r['rss_mb']:>9.0f}{r['tokens_per_s']:>10.1f}{r['same_as_fp32']:>9.2f}")
+    if out:
+        with open(out, "w") as f:
+            json.dump({"texts": len(corpus_texts), "queries": len(qs), "k": k,
+                       "embedder": emb_rows, "generator": gen_rows}, f, indent=2)
+
+if __name__ == "__main__":
+    app()
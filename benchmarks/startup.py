@@ -0,0 +1,66 @@
+# benchmarks/startup.py
+"""
+Server start-up cost: import time of the web app and time to warm.
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --module web.app --warmup
+
+Each run imports --module in a fresh interpreter and reports the wall time and which
+heavy libraries ended up loaded. Only the import statement is timed, so running the
+same command at an earlier commit gives the "before" numbers. --warmup then runs the
+web warm-up stages (index, embedder, generator) in this process and times each one,
+i.e. roughly how long after boot /ready turns 200.
+"""
+import json, subprocess, sys
+import numpy as np
+import typer
+
+app = typer.Typer()
+
+HEAVY = ("torch", "transformers", "sentence_transformers", "clip", "easyocr", "cv2", "faiss", "pdfplumber")
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t0
+print(json.dumps({{"seconds": dt, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def time_import(module, runs):
+    code = _PROBE.format(module=module, heavy=HEAVY)
+    samples, loaded = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if out.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{out.stderr.strip()}")
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(r["seconds"])
+        loaded = r["loaded"]
+    return {"module": module, "runs": runs, "median_s": float(np.median(samples)),
+            "min_s": float(np.min(samples)), "heavy_loaded": loaded}
+
+@app.command()
+def main(
+    module: str = typer.Option("web.app", help="Module to import"),
+    runs: int = typer.Option(5, help="Fresh-interpreter imports"),
+    warmup: bool = typer.Option(False, help="Also time the warm-up stages"),
+    out: str = typer.Option("", help="Write results as JSON to this path"),
+):
+    res = time_import(module, runs)
+    typer.echo(f"import {module}: median {res['median_s']:.3f}s, min {res['min_s']:.3f}s over {runs} runs")
+    typer.echo(f"heavy modules loaded at import: {', '.join(res['heavy_loaded']) or 'none'}")
+    if warmup:
+        from web.warmup import Warmup
+        w = Warmup()
+        w.run()
+        res["warmup"] = w.to_dict()
+        for name, st in res["warmup"]["stages"].items():
+            extra = st.get("detail") or st.get("error") or ""
+            typer.echo(f"warm-up {name:<10}{st['status']:<8}{st.get('seconds', 0.0):>8.2f}s  {extra}")
+    if out:
+        with open(out, "w") as f:
+            json.dump(res, f, indent=2)
+
+if __name__ == "__main__":
+    app()
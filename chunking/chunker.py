@@ -1,53 +1,251 @@
 # chunking/chunker.py
 import re
+from collections import deque
+from config import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from embeddings.embedder import text_token_spans
+from metrics import span
 
-def chunk_text(page_text, page_num, doc_id, chunk_size_chars=2000):
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+class PageChunker:
+    """
+    Chunks the page dicts of ingest_pdf / iter_pdf_pages as they arrive: add(page)
+    returns the chunks completed so far, close() the rest of the document.
+
+    Text chunks are sized in embedder tokens: sentences are packed up to max_tokens,
+    and the trailing sentences of a chunk (up to overlap_tokens) start the next one.
+    Text flows across page breaks: a chunk takes the page it starts on and lists every
+    page it covers under "pages" when there are several. A sentence longer than
+    max_tokens is cut into token windows. Every sentence is tokenized once and every
+    chunk joined once, so the work is linear in the text.
+    """
+
+    def __init__(self, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError(f"overlap_tokens ({overlap_tokens}) must be below max_tokens ({max_tokens})")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.doc_id = None
+        self._units = deque()  # (text, tokens, page) of the chunk being filled
+        self._tokens = 0
+        self._fresh = 0  # units not yet part of an emitted chunk
+        self._per_page = {}  # page -> text chunks starting on it (chunk_id numbering)
+
+    def add(self, p):
+        out = []
+        if p['doc_id'] != self.doc_id:
+            out.extend(self.close())
+            self.doc_id = p['doc_id']
+        out.extend(self.add_text(p['text'], p['page']))
+        for t_i, t in enumerate(p['tables'], start=1):
+            out.extend(chunk_table(t, p['page'], p['doc_id'], table_idx=t_i))
+        # images: chunk with the image path as attribute; these go to the CLIP image index,
+        # not the text index (see index/image_index.py)
+        for j, img in enumerate(p['images'], start=1):
+            out.append({"doc_id": p['doc_id'], "page": p['page'], "chunk_id": f"p{p['page']}_img{j}", "type": "image", "text": f"[Image: {img}]", "image_path": img})
+        # rasterised low-text page (scans, full-page figures)
+        if p.get('page_image'):
+            out.append({"doc_id": p['doc_id'], "page": p['page'], "chunk_id": f"p{p['page']}_page", "type": "page_image", "text": f"[Page image: {p['page_image']}]", "image_path": p['page_image']})
+        return out
+
+    def add_text(self, text, page):
+        """Feed one page's text; returns the text chunks it completed."""
+        sentences = [s for s in (x.strip() for x in _SENTENCE_END.split(text or "")) if s]
+        if not sentences:
+            return []
+        out = []
+        with span("ingest.chunk"):
+            for s, spans in zip(sentences, text_token_spans(sentences)):
+                n = len(spans)
+                if n > self.max_tokens:
+                    out.extend(self._split_long(s, spans, page))
+                    continue
+                if self._tokens + n > self.max_tokens:
+                    if self._fresh:
+                        out.append(self._emit())
+                    # drop carried overlap that no longer leaves room
+                    while self._units and self._tokens + n > self.max_tokens:
+                        self._tokens -= self._units.popleft()[1]
+                self._units.append((s, n, page))
+                self._tokens += n
+                self._fresh += 1
+        return out
+
+    def _split_long(self, s, spans, page):
+        out = [self._emit()] if self._fresh else []
+        self._units.clear()
+        self._tokens = 0
+        step = self.max_tokens - self.overlap_tokens
+        i = 0
+        while True:
+            j = min(i + self.max_tokens, len(spans))
+            self._units.append((s[spans[i][0]:spans[j - 1][1]], j - i, page))
+            self._tokens = j - i
+            self._fresh = 1
+            if j == len(spans):
+                return out  # the last window stays open for the sentences that follow
+            out.append(self._emit())
+            self._units.clear()
+            i += step
+
+    def _emit(self):
+        units = self._units
+        page = units[0][2]
+        self._per_page[page] = n = self._per_page.get(page, 0) + 1
+        chunk = {
+            "doc_id": self.doc_id,
+            "page": page,
+            "chunk_id": f"p{page}_c{n}",
+            "type": "text",
+            "text": " ".join(u[0] for u in units),
+            "tokens": self._tokens,
+        }
+        if units[-1][2] != page:
+            chunk["pages"] = sorted({u[2] for u in units})
+        # carry the trailing sentences (up to overlap_tokens) into the next chunk
+        carry, carried = [], 0
+        for u in reversed(units):
+            if carried + u[1] > self.overlap_tokens:
+                break
+            carry.append(u)
+            carried += u[1]
+        self._units = deque(reversed(carry))
+        self._tokens = carried
+        self._fresh = 0
+        return chunk
+
+    def close(self):
+        """Chunks still open for the current document; the chunker can then take another."""
+        out = [self._emit()] if self._fresh else []
+        self._units.clear()
+        self._tokens = 0
+        self._fresh = 0
+        self._per_page = {}
+        self.doc_id = None
+        return out
+
+
+def chunk_text(page_text, page_num, doc_id, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Splits one page's text into chunks of at most max_tokens embedder tokens on
+    sentence boundaries (see PageChunker). Returns list of chunk dicts with metadata.
     """
-    Splits text into chunks (~chunk_size_chars) on sentence boundaries.
-    Returns list of chunk dicts with metadata.
+    chunker = PageChunker(max_tokens, overlap_tokens)
+    chunker.doc_id = doc_id
+    return chunker.add_text(page_text, page_num) + chunker.close()
+
+# period labels of header cells: years, fiscal years / quarters and dates
+_PERIOD = re.compile(
+    r"\b(?:FY\s?'?\d{2,4}|Q[1-4]|[1-4]Q\s?'?\d{2,4}|(?:19|20)\d{2}|\d{1,2}/\d{1,2}/\d{2,4}|\d{4}-\d{2}-\d{2}"
+    r"|(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.?\s+\d{1,2})\b", re.IGNORECASE)
+_MAX_HEADER_ROWS = 3
+
+# a value cell holding a figure: "512", "$26,044", "(1,205)", "3.05", "12%"
+_FIGURE = re.compile(r"[-(]?\$?\s*\d[\d,]*(?:\.\d+)?\)?%?")
+
+def _header_like(cells):
+    """True when the value cells hold no digits besides years, fiscal periods and dates."""
+    return not any(re.search(r"\d", _PERIOD.sub("", c)) for c in cells[1:])
+
+def _has_figures(cells):
+    return any(_FIGURE.fullmatch(c) and not _PERIOD.fullmatch(c) for c in cells[1:])
+
+def _cells(row):
+    """Cleaned cell texts; lone "$" cells are merged into the figure that follows them."""
+    cells = [re.sub(r"\s+", " ", str(x)).strip() if x is not None else "" for x in row]
+    for i in range(len(cells) - 1):
+        if cells[i] == "$" and cells[i + 1]:
+            cells[i], cells[i + 1] = "", "$" + cells[i + 1]
+    return cells
+
+def _header_line(header_rows):
     """
-    if not page_text:
+    One line naming the columns: spanning cells ("Three Months Ended") are carried to the
+    right and stacked with the period below them, e.g.
+    "(in millions) | Three Months Ended April 28, 2024 | Three Months Ended April 30, 2023".
+    """
+    width = max(len(r) for r in header_rows)
+    labels = [[] for _ in range(width)]
+    for row in header_rows:
+        last = ""
+        for i in range(width):
+            cell = row[i] if i < len(row) else ""
+            if i > 0:
+                # pdfplumber leaves the columns a merged cell spans empty
+                cell = last = cell or last
+            if cell:
+                labels[i].append(cell)
+    columns = [" ".join(parts) for parts in labels]
+    out = [columns[0]] if columns[0] else []
+    for c in columns[1:]:
+        if c and (not out or out[-1] != c):
+            out.append(c)
+    return " | ".join(out)
+
+def _count_header_rows(rows):
+    """Number of leading rows that form the header (see chunk_table)."""
+    titled = False  # a header row naming columns has been seen
+    for n, cells in enumerate(rows[:min(_MAX_HEADER_ROWS, len(rows) - 1) + 1]):
+        if _has_figures(cells):
+            return n  # the first data row
+        if not _header_like(cells):
+            break
+        if titled and not any(cells[1:]):
+            return n  # a label alone under the column titles opens the first row group
+        titled = titled or any(cells[1:])
+    # no figures near the top, or digits outside any figure: the first row is the header
+    return min(1, len(rows) - 1)
+
+def chunk_table(table, page_num, doc_id, table_idx=1):
+    """
+    One "table_row" chunk per data row (chunk_id p{page}_t{table}_r{row}). The row itself
+    comes first, so the extractors find its label and figures on one line, followed by
+    the column headers and period labels. The header is the leading rows (at most three)
+    whose value cells hold no digits besides years, fiscal periods and dates; the first
+    row with a figure in a value cell starts the data (tables without one: the first
+    row). A row holding only a label (e.g. "Operating expenses") is not emitted but
+    prefixed to the rows under it, up to a blank row or its "Total ..." row.
+    """
+    rows = [_cells(r) for r in table or []]
+    # blank rows are kept until the header is found: they end a row group below it
+    while rows and not any(rows[0]):
+        rows.pop(0)
+    if not rows:
         return []
-    sentences = re.split(r'(?<=[.!?])\s+', page_text)
-    chunks = []
-    cur = ""
-    for s in sentences:
-        if len(cur) + len(s) > chunk_size_chars:
-            chunks.append(cur.strip())
-            cur = s
-        else:
-            cur += " " + s
-    if cur.strip():
-        chunks.append(cur.strip())
+    n_header = _count_header_rows(rows)
+    header = _header_line(rows[:n_header]) if n_header else ""
     out = []
-    for i, c in enumerate(chunks):
+    section = ""
+    for r, cells in enumerate(rows[n_header:], start=1):
+        values = [c for c in cells[1:] if c]
+        if not values:
+            # a label alone opens a row group, a blank row closes it
+            section = cells[0]
+            continue
+        label = f"{section}: {cells[0]}" if section and cells[0] else cells[0]
+        if cells[0].lower().startswith("total"):
+            section = ""
+        line = " | ".join(([label] if label else []) + values)
         out.append({
             "doc_id": doc_id,
             "page": page_num,
-            "chunk_id": f"p{page_num}_c{i+1}",
-            "type": "text",
-            "text": c
+            "chunk_id": f"p{page_num}_t{table_idx}_r{r}",
+            "type": "table_row",
+            "table": table_idx,
+            "row": r,
+            "text": f"{line}\n{header}" if header else line,
         })
     return out
 
-def chunk_table(table, page_num, doc_id):
+def chunk_pages(docs):
     """
-    Convert a table (list-of-rows) to flattened text.
+    Chunk the page dicts returned by ingest_pdf: text, tables, figures and page images.
+    chunk_ids are unique within a document.
     """
-    if not table:
-        return []
-    # header detection: first row
-    header = table[0]
-    rows = table[1:] if len(table) > 1 else []
-    lines = []
-    lines.append(" | ".join([str(h) for h in header]))
-    for r in rows:
-        lines.append(" | ".join([str(x) for x in r]))
-    text = "\n".join(lines)
-    return [{
-        "doc_id": doc_id,
-        "page": page_num,
-        "chunk_id": f"p{page_num}_table",
-        "type": "table",
-        "text": text
-    }]
+    chunker = PageChunker()
+    chunks = []
+    for p in docs:
+        chunks.extend(chunker.add(p))
+    chunks.extend(chunker.close())
+    return chunks
@@ -0,0 +1,129 @@
+# chunking/store.py
+import os, pickle, hashlib, re, shutil
+from config import CHUNKS_DIR, CHUNKS_PATH
+
+def _doc_path(doc_id, chunks_dir=CHUNKS_DIR):
+    safe = re.sub(r"[^A-Za-z0-9._-]", "_", str(doc_id))
+    h = hashlib.sha1(str(doc_id).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(chunks_dir, f"{safe}-{h}.pkl")
+
+def _fingerprint_update(h, chunks):
+    for c in chunks:
+        h.update(str(c.get("chunk_id")).encode("utf-8"))
+        h.update(b"\x00")
+        h.update((c.get("text") or "").encode("utf-8"))
+        h.update(b"\x00")
+
+def document_fingerprint(chunks):
+    """Content hash of a document's chunks; changes whenever any chunk id or text changes."""
+    h = hashlib.sha1()
+    _fingerprint_update(h, chunks)
+    return h.hexdigest()
+
+def _migrate_legacy(chunks_dir=CHUNKS_DIR, legacy_path=CHUNKS_PATH):
+    # older versions kept a single chunks.pkl holding only the last upload
+    if not legacy_path or not os.path.exists(legacy_path):
+        return
+    with open(legacy_path, "rb") as f:
+        chunks = pickle.load(f)
+    by_doc = {}
+    for c in chunks:
+        by_doc.setdefault(c.get("doc_id"), []).append(c)
+    for doc_id, doc_chunks in by_doc.items():
+        if not os.path.exists(_doc_path(doc_id, chunks_dir)):
+            save_document_chunks(doc_id, doc_chunks, chunks_dir)
+    os.replace(legacy_path, legacy_path + ".migrated")
+
+def save_document_chunks(doc_id, chunks, chunks_dir=CHUNKS_DIR):
+    """Store (or replace) the chunks of one document. Other documents are untouched."""
+    os.makedirs(chunks_dir, exist_ok=True)
+    path = _doc_path(doc_id, chunks_dir)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        # header first so list_documents can read it without unpickling the chunks
+        pickle.dump({"doc_id": doc_id, "fingerprint": document_fingerprint(chunks)}, f)
+        pickle.dump(chunks, f)
+    os.replace(tmp, path)
+    return path
+
+class DocumentChunkWriter:
+    """
+    Store a document's chunks batch by batch (streaming ingest) without holding them
+    all in memory. Batches go to a temp file; close() prepends the header with the
+    final fingerprint and moves the record into place.
+    """
+
+    def __init__(self, doc_id, chunks_dir=CHUNKS_DIR):
+        os.makedirs(chunks_dir, exist_ok=True)
+        self.doc_id = doc_id
+        self.path = _doc_path(doc_id, chunks_dir)
+        self._body_path = f"{self.path}.body.{os.getpid()}"
+        self._body = open(self._body_path, "wb")
+        self._hash = hashlib.sha1()
+        self.n_chunks = 0
+
+    def write(self, chunks):
+        if not chunks:
+            return
+        pickle.dump(chunks, self._body)
+        _fingerprint_update(self._hash, chunks)
+        self.n_chunks += len(chunks)
+
+    @property
+    def fingerprint(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        self._body.close()
+        tmp = f"{self.path}.tmp.{os.getpid()}"
+        with open(tmp, "wb") as out, open(self._body_path, "rb") as body:
+            pickle.dump({"doc_id": self.doc_id, "fingerprint": self.fingerprint}, out)
+            shutil.copyfileobj(body, out)
+        os.replace(tmp, self.path)
+        os.remove(self._body_path)
+        return self.fingerprint
+
+    def abort(self):
+        self._body.close()
+        if os.path.exists(self._body_path):
+            os.remove(self._body_path)
+
+def load_document_chunks(doc_id, chunks_dir=CHUNKS_DIR):
+    """Returns (chunks, fingerprint), or (None, None) if the document is not stored."""
+    path = _doc_path(doc_id, chunks_dir)
+    if not os.path.exists(path):
+        return None, None
+    chunks = []
+    with open(path, "rb") as f:
+        header = pickle.load(f)
+        # the chunk list may be split into several pickled batches (DocumentChunkWriter)
+        while True:
+            try:
+                chunks.extend(pickle.load(f))
+            except EOFError:
+                break
+    return chunks, header["fingerprint"]
+
+def remove_document_chunks(doc_id, chunks_dir=CHUNKS_DIR):
+    path = _doc_path(doc_id, chunks_dir)
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+    return False
+
+def list_documents(chunks_dir=CHUNKS_DIR, legacy_path=CHUNKS_PATH):
+    """
+    {doc_id: fingerprint} for every stored document (reads only the record headers).
+    A legacy chunks.pkl at legacy_path is migrated first; legacy_path=None only reads.
+    """
+    _migrate_legacy(chunks_dir, legacy_path)
+    if not os.path.isdir(chunks_dir):
+        return {}
+    out = {}
+    for name in sorted(os.listdir(chunks_dir)):
+        if not name.endswith(".pkl"):
+            continue
+        with open(os.path.join(chunks_dir, name), "rb") as f:
+            header = pickle.load(f)
+        out[header["doc_id"]] = header["fingerprint"]
+    return out
@@ -1,44 +1,56 @@
-# cli.py
-import typer, os, pickle
-from ingest.pdf_ingest import ingest_pdf
-from chunking.chunker import chunk_text, chunk_table
-from embeddings.embedder import embed_texts, embed_image
-from index.faiss_index import build_faiss_index
-from config import RAW_DIR, CHUNKS_PATH
+import typer, os
+from typing import Optional
+from chunking.store import remove_document_chunks, list_documents
+from index.builder import sync_index
+from index.faiss_index import remove_document
+from qa.facts import TEXT_FEATURES
+from index.image_index import remove_document_images
+from index.collections import get_collection, list_collections
+from pipeline.ingest import ingest_to_store
+from pipeline.streaming import stream_pdf_to_index
 
 app = typer.Typer()
 
+COLLECTION_OPTION = typer.Option(None, "--collection", "-c", help="Named collection (default: MMR_COLLECTION or 'default')")
+
+@app.command()
+def ingest(pdf_path: str, workers: Optional[int] = typer.Option(None, help="Page-parsing processes (0 = all cores, 1 = in-process)"),
+           stream: bool = typer.Option(False, help="Parse, embed and index in one bounded-memory pass"),
+           collection: Optional[str] = COLLECTION_OPTION):
+    coll = get_collection(collection)
+    if stream:
+        res = stream_pdf_to_index(pdf_path, workers=workers, image_dir=coll.raw_dir, **coll.index_paths())
+        typer.echo(f"Streamed {res['pages']} pages / {res['chunks']} chunks ({res['images']} images) of {res['doc_id']} into "
+                   f"collection {coll.name} (embedding cache: {res['cache']['hits']} hits, {res['cache']['misses']} misses).")
+        return
+    res = ingest_to_store(pdf_path, workers=workers, chunks_dir=coll.chunks_dir, image_dir=coll.raw_dir)
+    typer.echo(f"Ingested and saved {res['chunks']} chunks for {res['doc_id']} to {coll.chunks_dir}")
+
+@app.command()
+def index(rebuild: bool = typer.Option(False, help="Re-embed every document into a fresh index"),
+          collection: Optional[str] = COLLECTION_OPTION):
+    coll = get_collection(collection)
+    # only new or changed documents are embedded unless --rebuild is given
+    res = sync_index(rebuild=rebuild, **coll.index_paths())
+    typer.echo(f"FAISS index of {coll.name} updated: {len(res['added'])} added, {len(res['removed'])} removed, {len(res['unchanged'])} unchanged.")
+    typer.echo(f"Embedding cache: {res['cache']['hits']} hits, {res['cache']['misses']} misses (encoded).")
+
 @app.command()
-def ingest(pdf_path: str):
-    docs = ingest_pdf(pdf_path)
-    chunks = []
-    for p in docs:
-        # text chunks
-        text_chunks = chunk_text(p['text'], p['page'], p['doc_id'])
-        chunks.extend(text_chunks)
-        # tables
-        for t in p['tables']:
-            chunks.extend(chunk_table(t, p['page'], p['doc_id']))
-        # images: store as chunk with image path as attribute (we don't embed images into same vector here)
-        for img in p['images']:
-            chunks.append({"doc_id": p['doc_id'], "page": p['page'], "chunk_id": f"p{p['page']}_img", "type": "image", "text": f"[Image: {img}]", "image_path": img})
-    os.makedirs(os.path.dirname(CHUNKS_PATH), exist_ok=True)
-    with open(CHUNKS_PATH, "wb") as f:
-        pickle.dump(chunks, f)
-    typer.echo(f"Ingested and saved {len(chunks)} chunks to {CHUNKS_PATH}")
+def remove(doc_id: str, collection: Optional[str] = COLLECTION_OPTION):
+    coll = get_collection(collection)
+    n = remove_document(doc_id, coll.index_path, coll.meta_path, features=TEXT_FEATURES)
+    n_images = remove_document_images(doc_id, coll.image_index_path, coll.image_meta_path)
+    remove_document_chunks(doc_id, coll.chunks_dir)
+    typer.echo(f"Removed {doc_id} ({n} chunks, {n_images} images) from {coll.name}.")
 
 @app.command()
-def index():
-    # load chunks
-    with open(CHUNKS_PATH, "rb") as f:
-        chunks = pickle.load(f)
-    texts = [c.get("text","") for c in chunks]
-    # embed text chunks only (images can be embedded separately if desired)
-    vecs = embed_texts(texts)
-    import numpy as np
-    vecs = np.array(vecs).astype("float32")
-    build_faiss_index(vecs, chunks)
-    typer.echo("Built FAISS index.")
+def collections():
+    """List collections and how many documents each stores / has indexed."""
+    for name in list_collections():
+        coll = get_collection(name)
+        stored = list_documents(coll.chunks_dir, coll.legacy_chunks)
+        indexed = "yes" if os.path.exists(coll.index_path) else "no"
+        typer.echo(f"{name:<32}{len(stored):>6} documents   index: {indexed}")
 
 if __name__ == "__main__":
     app()
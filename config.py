@@ -3,9 +3,112 @@ import os
 
 DATA_DIR = os.getenv("MMR_DATA_DIR", "data")
 RAW_DIR = os.path.join(DATA_DIR, "raw")
-CHUNKS_PATH = os.path.join(DATA_DIR, "chunks.pkl")
+CHUNKS_PATH = os.path.join(DATA_DIR, "chunks.pkl")  # legacy single-corpus file, migrated on first use
+CHUNKS_DIR = os.path.join(DATA_DIR, "chunks")  # one pickle per document
 INDEX_DIR = os.path.join(DATA_DIR, "index")
 FAISS_INDEX_PATH = os.path.join(INDEX_DIR, "faiss.index")
-META_PATH = os.path.join(INDEX_DIR, "meta.pkl")
+META_PATH = os.path.join(INDEX_DIR, "meta")  # prefix of the chunk metadata store (meta.json + data/offset files)
+EMBED_CACHE_DIR = os.path.join(DATA_DIR, "embed_cache")
+# named collections (index/collections.py): each has its own raw files, chunk store, text
+# and image index under COLLECTIONS_DIR/<name>/; "default" is the layout above. Indexes
+# are loaded on first use and the least recently used collections are unloaded once
+# the resident ones exceed COLLECTION_MEMORY_MB
+COLLECTIONS_DIR = os.path.join(DATA_DIR, "collections")
+DEFAULT_COLLECTION = os.getenv("MMR_COLLECTION", "default")  # used when a request names none
+COLLECTION_MEMORY_MB = float(os.getenv("MMR_COLLECTION_MEMORY_MB", "4096"))
+# FAISS index type: flat | ivf_flat | ivf_pq | hnsw (IVF/PQ are trained automatically;
+# corpora too small to train on stay flat until sync_index retrains them)
+FAISS_INDEX_TYPE = os.getenv("MMR_INDEX_TYPE", "flat")
+IVF_NLIST = int(os.getenv("MMR_IVF_NLIST", "1024"))
+IVF_NPROBE = int(os.getenv("MMR_IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("MMR_PQ_M", "48"))  # sub-quantizers; must divide the embedding dim (384 for MiniLM)
+PQ_NBITS = 8
+HNSW_M = int(os.getenv("MMR_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = int(os.getenv("MMR_HNSW_EF_SEARCH", "64"))
+RETRAIN_GROWTH = 4.0  # retrain IVF/PQ once the index is this many times its training set
+# segments (index/faiss_index.py): every add is written as a small delta segment next to
+# the base index; deltas are merged into one beyond INDEX_MAX_SEGMENTS, and into the base
+# once their vectors plus tombstoned (deleted) ones exceed INDEX_MERGE_RATIO of it
+INDEX_MAX_SEGMENTS = int(os.getenv("MMR_INDEX_MAX_SEGMENTS", "8"))
+INDEX_MERGE_RATIO = float(os.getenv("MMR_INDEX_MERGE_RATIO", "0.25"))
+# PDF ingestion: worker processes for page-parallel parsing (0 = all cores, 1 = in-process)
+INGEST_WORKERS = int(os.getenv("MMR_INGEST_WORKERS", "0"))
+INGEST_MP_CONTEXT = os.getenv("MMR_INGEST_MP_CONTEXT", "spawn")  # spawn: safe after torch/OpenMP are loaded
+INGEST_PARALLEL_MIN_PAGES = 8  # below this, process start-up costs more than it saves
+# chunking: text chunk size in embedder tokens; MiniLM reads 256 tokens including [CLS] / [SEP],
+# so longer chunks would be stored and scanned but never embedded
+CHUNK_MAX_TOKENS = int(os.getenv("MMR_CHUNK_MAX_TOKENS", "254"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("MMR_CHUNK_OVERLAP_TOKENS", "32"))  # trailing sentences repeated in the next chunk
+# streaming ingest (pipeline/streaming.py): chunks per embed call, chunks per index append,
+# parsed pages buffered ahead of the chunker. Every flush writes one delta segment holding
+# only its own chunks (see add_document), so a larger flush means fewer segments to merge
+STREAM_EMBED_BATCH = 64
+STREAM_FLUSH_CHUNKS = 512
+STREAM_QUEUE_PAGES = 8
+# OCR: low-text pages are rasterised in memory and OCR'd in batches; results are
+# cached by page-image hash. SAVE_PAGE_RASTERS also writes the PNGs to RAW_DIR.
+OCR_BATCH_SIZE = int(os.getenv("MMR_OCR_BATCH_SIZE", "8"))
+OCR_CACHE_PATH = os.path.join(DATA_DIR, "ocr_cache.sqlite")
+SAVE_PAGE_RASTERS = os.getenv("MMR_SAVE_PAGE_RASTERS", "0") == "1"
+# background ingestion / indexing jobs in the web app (web/jobs.py)
+JOB_WORKERS = int(os.getenv("MMR_JOB_WORKERS", "1"))
+JOB_HISTORY = 100  # finished jobs kept for /jobs
+JOBS_DB_PATH = os.path.join(DATA_DIR, "jobs.sqlite")  # job state, shared by all web workers
+EMBED_PROGRESS_BATCH = 256  # chunks per embed call when a build reports progress
+# hybrid retrieval: BM25 inverted index (<meta>.bm25*) fused with FAISS by reciprocal rank fusion
+HYBRID_SEARCH = os.getenv("MMR_HYBRID_SEARCH", "1") != "0"
+HYBRID_CANDIDATES = int(os.getenv("MMR_HYBRID_CANDIDATES", "50"))  # per retriever, before fusion
+RRF_K = 60
+# keyword rerank: retrieval scores (cosine / fused, in [0, 1]) plus at most this much for
+# KEYWORD_BOOSTS hits, so keywords reorder close candidates without overriding relevance
+RERANK_KEYWORD_WEIGHT = float(os.getenv("MMR_RERANK_KEYWORD_WEIGHT", "0.3"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+QUERY_TOP_K = int(os.getenv("MMR_QUERY_TOP_K", "10"))
+# /query micro-batching: concurrent queries are embedded + searched together
+BATCH_MAX_SIZE = int(os.getenv("MMR_BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("MMR_BATCH_MAX_WAIT_MS", "5"))
+# in-process query caches; answers are keyed by index version so a rebuild invalidates them
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("MMR_QUERY_EMBED_CACHE_SIZE", "1024"))
+ANSWER_CACHE_SIZE = int(os.getenv("MMR_ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("MMR_ANSWER_CACHE_TTL", "600"))  # seconds
+# generation worker: prompts are batched into cohorts decoded round-robin, each request
+# stops at its own token / time budget
+GEN_MODEL = "google/flan-t5-small"
+GEN_MAX_BATCH = int(os.getenv("MMR_GEN_MAX_BATCH", "8"))
+GEN_BATCH_WAIT_MS = float(os.getenv("MMR_GEN_BATCH_WAIT_MS", "10"))
+GEN_MAX_COHORTS = int(os.getenv("MMR_GEN_MAX_COHORTS", "4"))
+GEN_MAX_NEW_TOKENS = int(os.getenv("MMR_GEN_MAX_NEW_TOKENS", "256"))
+GEN_MAX_INPUT_TOKENS = 512
+GEN_TIME_BUDGET_S = float(os.getenv("MMR_GEN_TIME_BUDGET_S", "30"))
+# CPU inference backend for the embedder / generator: fp32 | int8 (dynamic quantisation)
+# | onnx (onnxruntime via optimum, falls back to fp32 when not installed). Embedding
+# caches are kept per backend, so switching never mixes vectors from two backends.
+EMBED_BACKEND = os.getenv("MMR_EMBED_BACKEND", "fp32")
+GEN_BACKEND = os.getenv("MMR_GEN_BACKEND", "fp32")
+MODEL_CACHE_DIR = os.path.join(DATA_DIR, "models")  # exported ONNX graphs
+# image index: CLIP embeddings of cropped figures and rasterised (low-text) pages, kept
+# out of the text index; queries go through CLIP's text tower and the image hits are
+# fused with the text hits by reciprocal rank fusion
+IMAGE_INDEX_PATH = os.path.join(INDEX_DIR, "images.index")
+IMAGE_META_PATH = os.path.join(INDEX_DIR, "images_meta")
+IMAGE_INDEX_TYPE = os.getenv("MMR_IMAGE_INDEX_TYPE", "flat")
+IMAGE_EMBED_BATCH = int(os.getenv("MMR_IMAGE_EMBED_BATCH", "16"))
+IMAGE_TOP_K = int(os.getenv("MMR_IMAGE_TOP_K", "3"))  # image hits fused per query; 0 = text only
+INDEX_PAGE_IMAGES = os.getenv("MMR_INDEX_PAGE_IMAGES", "1") != "0"
+# shared model server (serving/server.py): with MMR_MODEL_SERVER set to a Unix socket
+# path, web workers send embed / OCR / search / generate calls to the one process that
+# holds the models and indexes instead of loading their own copies
+MODEL_SERVER_SOCKET = os.getenv("MMR_MODEL_SERVER", "")
+# calls are pickled, so only holders of the key may connect: without MMR_MODEL_SERVER_AUTHKEY
+# the server writes a random key to <socket>.key (mode 0600) and the workers read it
+MODEL_SERVER_AUTHKEY = os.getenv("MMR_MODEL_SERVER_AUTHKEY", "").encode("utf-8")
+MODEL_SERVER_TIMEOUT_S = float(os.getenv("MMR_MODEL_SERVER_TIMEOUT_S", "300"))  # one call, e.g. OCR of a batch
+MODEL_SERVER_WARMUP = [s.strip() for s in os.getenv("MMR_MODEL_SERVER_WARMUP", "index,embedder,clip,generator").split(",") if s.strip()]
+# web server warm-up: stages run in the background after boot; GET /ready answers 200
+# once all of them are done ("" disables warm-up, the server is then ready immediately).
+# Behind a model server, a worker only waits for the server to be up and warm.
+WARMUP_STAGES = [s.strip() for s in os.getenv("MMR_WARMUP", "model_server" if MODEL_SERVER_SOCKET else "index,embedder,clip,generator").split(",") if s.strip()]
 TEXT_EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 CLIP_MODEL = "ViT-B/32"  
@@ -0,0 +1,95 @@
+# embeddings/backends.py
+"""
+CPU inference backends for the text embedder and the generator:
+
+    fp32  the models as published
+    int8  dynamic int8 quantisation of every nn.Linear (weights int8, activations
+          quantised on the fly); no calibration data, loads in seconds
+    onnx  exported ONNX graph run by onnxruntime (needs optimum[onnxruntime]); the
+          export is written once under MODEL_CACHE_DIR and reused
+
+A backend whose runtime is missing falls back to fp32 with a warning. The fallback is
+decided up front by resolve_backend, never half-way through a load, so the backend a
+caller resolves (e.g. to name an embedding cache) is the one the model then runs on.
+"""
+import os, re, importlib.util
+from importlib import metadata
+from config import MODEL_CACHE_DIR
+
+BACKENDS = ("fp32", "int8", "onnx")
+
+def _check(backend):
+    backend = (backend or "fp32").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    return backend
+
+def _onnx_missing(kind):
+    """Why the onnx backend cannot run models of this kind ("embed" | "seq2seq"), or None."""
+    if not all(importlib.util.find_spec(m) for m in ("onnxruntime", "optimum")):
+        return "optimum[onnxruntime] is not installed"
+    if kind == "seq2seq" and importlib.util.find_spec("optimum.onnxruntime") is None:
+        return "optimum has no onnxruntime support installed"
+    if kind == "embed":
+        try:
+            major, minor = (int(x) for x in metadata.version("sentence-transformers").split(".")[:2])
+        except (metadata.PackageNotFoundError, ValueError):
+            return "the sentence-transformers version is unknown"
+        if (major, minor) < (3, 2):
+            return "sentence-transformers < 3.2 has no onnx backend"
+    return None
+
+def resolve_backend(backend, kind="embed"):
+    """The backend that will actually be used for a model of this kind ("embed" | "seq2seq")."""
+    backend = _check(backend)
+    if backend == "onnx":
+        missing = _onnx_missing(kind)
+        if missing:
+            print(f"onnx backend requested but {missing}; using fp32")
+            return "fp32"
+    return backend
+
+def _export_dir(model_name, kind):
+    slug = re.sub(r"[^A-Za-z0-9._-]", "_", model_name)
+    return os.path.join(MODEL_CACHE_DIR, f"{slug}-{kind}-onnx")
+
+def quantize_int8(model):
+    """Quantised copy of model: dynamic int8 for the Linear layers."""
+    import torch
+    return torch.quantization.quantize_dynamic(model.cpu().eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_sentence_transformer(model_name, backend="fp32"):
+    """(SentenceTransformer, backend used)."""
+    from sentence_transformers import SentenceTransformer
+    backend = resolve_backend(backend, "embed")
+    if backend == "onnx":
+        path = _export_dir(model_name, "embed")
+        if os.path.isdir(path):
+            return SentenceTransformer(path, backend="onnx", device="cpu"), "onnx"
+        model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+        model.save_pretrained(path)
+        return model, "onnx"
+    model = SentenceTransformer(model_name, device="cpu")
+    if backend == "int8":
+        model = quantize_int8(model)
+    return model, backend
+
+def load_seq2seq(model_name, backend="fp32"):
+    """(tokenizer, model, backend used) for a seq2seq generator such as FLAN-T5."""
+    from transformers import AutoTokenizer
+    backend = resolve_backend(backend, "seq2seq")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if backend == "onnx":
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        path = _export_dir(model_name, "seq2seq")
+        if os.path.isdir(path):
+            model = ORTModelForSeq2SeqLM.from_pretrained(path, use_cache=True)
+        else:
+            model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True, use_cache=True)
+            model.save_pretrained(path)
+        return tokenizer, model, "onnx"
+    from transformers import AutoModelForSeq2SeqLM
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name).eval()
+    if backend == "int8":
+        model = quantize_int8(model)
+    return tokenizer, model, backend
@@ -0,0 +1,108 @@
+# embeddings/cache.py
+import os, re, json, hashlib, threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: appends are only serialised within the process
+    fcntl = None
+
+from config import EMBED_CACHE_DIR
+
+_KEY_BYTES = 16
+
+def text_key(text):
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=_KEY_BYTES).digest()
+
+class EmbeddingCache:
+    """
+    Append-only on-disk embedding cache for one model.
+    keys.bin holds 16-byte blake2b digests of the chunk text, vecs.f32 the matching
+    float32 rows (read via np.memmap), so lookups never unpickle anything and an
+    append writes only the new rows.
+    """
+
+    def __init__(self, model_name, cache_dir=EMBED_CACHE_DIR):
+        slug = re.sub(r"[^A-Za-z0-9._-]", "_", model_name)
+        self.dir = os.path.join(cache_dir, slug)
+        self.model_name = model_name
+        self.keys_path = os.path.join(self.dir, "keys.bin")
+        self.vecs_path = os.path.join(self.dir, "vecs.f32")
+        self.info_path = os.path.join(self.dir, "info.json")
+        self.dim = None
+        self._rows = {}      # digest -> row
+        self._n = 0          # rows known to this process
+        self._vecs = None    # memmap over the first self._n rows
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _refresh(self):
+        # pick up rows appended since we last looked (possibly by another process)
+        if self.dim is None:
+            if not os.path.exists(self.info_path):
+                return
+            with open(self.info_path) as f:
+                self.dim = json.load(f)["dim"]
+        if not os.path.exists(self.keys_path):
+            return
+        n_keys = os.path.getsize(self.keys_path) // _KEY_BYTES
+        n_vecs = os.path.getsize(self.vecs_path) // (4 * self.dim) if os.path.exists(self.vecs_path) else 0
+        n = min(n_keys, n_vecs)
+        if n <= self._n:
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self._n * _KEY_BYTES)
+            buf = f.read((n - self._n) * _KEY_BYTES)
+        for i in range(n - self._n):
+            self._rows[buf[i * _KEY_BYTES:(i + 1) * _KEY_BYTES]] = self._n + i
+        self._n = n
+        self._vecs = np.memmap(self.vecs_path, dtype="float32", mode="r", shape=(n, self.dim))
+
+    def get(self, keys):
+        """Returns (vectors for the hits, list of row positions in `keys` that missed)."""
+        with self._lock:
+            self._refresh()
+            rows = [self._rows.get(k, -1) for k in keys]
+            vecs = self._vecs
+        missing = [i for i, r in enumerate(rows) if r < 0]
+        hit_pos = [i for i, r in enumerate(rows) if r >= 0]
+        hit_vecs = np.asarray(vecs[[rows[i] for i in hit_pos]]) if hit_pos else None
+        return hit_pos, hit_vecs, missing
+
+    def put(self, keys, vecs):
+        vecs = np.ascontiguousarray(vecs, dtype="float32")
+        if not len(keys):
+            return
+        with self._lock:
+            os.makedirs(self.dir, exist_ok=True)
+            if self.dim is None:
+                self.dim = int(vecs.shape[1])
+                with open(self.info_path, "w") as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+            with open(self.keys_path + ".lock", "w") as lockf:
+                if fcntl is not None:
+                    fcntl.flock(lockf, fcntl.LOCK_EX)
+                self._truncate_partial()
+                # vectors first: a row only counts once its key is on disk too
+                with open(self.vecs_path, "ab") as f:
+                    f.write(vecs.tobytes())
+                with open(self.keys_path, "ab") as f:
+                    f.write(b"".join(keys))
+            self._refresh()
+
+    def _truncate_partial(self):
+        """
+        Cut both files back to their complete (key, vector) rows before appending; an
+        append interrupted between the two writes would otherwise shift every later
+        key onto another row's vector. Call under the file lock.
+        """
+        n_keys = os.path.getsize(self.keys_path) // _KEY_BYTES if os.path.exists(self.keys_path) else 0
+        n_vecs = os.path.getsize(self.vecs_path) // (4 * self.dim) if os.path.exists(self.vecs_path) else 0
+        n = min(n_keys, n_vecs)
+        for path, size in ((self.keys_path, n * _KEY_BYTES), (self.vecs_path, n * 4 * self.dim)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": self._n}
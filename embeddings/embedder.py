@@ -1,48 +1,230 @@
 # embeddings/embedder.py
-from sentence_transformers import SentenceTransformer
 import numpy as np
-import torch
-from PIL import Image
-import os
-import clip
+import os, re, hashlib, threading
 
-from config import TEXT_EMBED_MODEL, CLIP_MODEL
+from config import TEXT_EMBED_MODEL, CLIP_MODEL, EMBED_BACKEND, IMAGE_EMBED_BATCH
+from embeddings.backends import load_sentence_transformer, resolve_backend
+from embeddings.cache import EmbeddingCache, text_key
+from metrics import span
+from serving.client import get_model_client
 
 # text embedder (small)
 _text_model = None
+_text_backend = None
 # clip model & preprocess
 _clip_model = None
 _clip_preprocess = None
 _device = "cpu"
+_embed_cache = None
+_image_cache = None
+# text embedder's tokenizer (for chunk sizing); False once it failed to load
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
 
 def get_text_model():
     global _text_model
     if _text_model is None:
-        _text_model = SentenceTransformer(TEXT_EMBED_MODEL)
+        # load with the backend resolved once by text_backend(), which also names the cache
+        _text_model, _ = load_sentence_transformer(TEXT_EMBED_MODEL, text_backend())
     return _text_model
 
-def embed_texts(texts, batch_size=32):
+def text_backend():
+    """Backend of the text embedder (resolved without loading the model)."""
+    global _text_backend
+    if _text_backend is None:
+        client = get_model_client()
+        # behind a model server, the backend it actually loaded names the cache
+        _text_backend = client.call("text_backend") if client is not None else resolve_backend(EMBED_BACKEND)
+    return _text_backend
+
+def get_text_tokenizer():
     """
-    texts: list[str]
-    returns: numpy array shape (n, d) dtype=float32
+    Tokenizer of the text embedder, loaded on its own (no model weights), or None
+    when it cannot be loaded (transformers missing, offline without a cached copy).
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                try:
+                    from transformers import AutoTokenizer
+                    _tokenizer = AutoTokenizer.from_pretrained(TEXT_EMBED_MODEL)
+                except Exception as e:
+                    print(f"Embedder tokenizer unavailable ({e}); estimating token counts instead")
+                    _tokenizer = False
+    return _tokenizer or None
+
+# fallback when the tokenizer is unavailable: short word pieces and punctuation, so the
+# estimate errs on the high side of WordPiece counts
+_APPROX_TOKEN = re.compile(r"\w{1,4}|[^\w\s]")
+
+def text_token_spans(texts):
     """
+    (start, end) character span of every embedder token of each text, special tokens
+    excluded; len() of a text's spans is its token count.
+    """
+    tok = get_text_tokenizer()
+    if tok is None or not getattr(tok, "is_fast", False):
+        return [[m.span() for m in _APPROX_TOKEN.finditer(t)] for t in texts]
+    # fast tokenizers are not safe to call from several threads at once
+    with _tokenizer_lock:
+        enc = tok(list(texts), add_special_tokens=False, return_offsets_mapping=True,
+                  return_attention_mask=False, return_token_type_ids=False)
+    return [[tuple(o) for o in offsets] for offsets in enc["offset_mapping"]]
+
+def embed_cache_name(backend):
+    # fp32 keeps the plain model name, so caches written before backends existed stay valid
+    return TEXT_EMBED_MODEL if backend == "fp32" else f"{TEXT_EMBED_MODEL}@{backend}"
+
+def get_embed_cache():
+    global _embed_cache
+    if _embed_cache is None:
+        _embed_cache = EmbeddingCache(embed_cache_name(text_backend()))
+    return _embed_cache
+
+def _encode(texts, batch_size):
     model = get_text_model()
-    embs = model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+    with span("embed.text"):
+        embs = model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
     return embs.astype("float32")
 
+def embed_texts(texts, batch_size=32, use_cache=True, return_stats=False):
+    """
+    texts: list[str]
+    use_cache: look chunks up in the on-disk content-hash cache and only encode misses
+    returns: numpy array shape (n, d) dtype=float32
+             (plus {"hits": int, "misses": int} when return_stats=True)
+    """
+    client = get_model_client()
+    if client is not None:
+        return client.call("embed_texts", texts, batch_size, use_cache, return_stats)
+    if not use_cache or not texts:
+        embs = _encode(texts, batch_size)
+        stats = {"hits": 0, "misses": len(texts)}
+        return (embs, stats) if return_stats else embs
+    cache = get_embed_cache()
+    keys = [text_key(t) for t in texts]
+    with span("embed.cache_lookup"):
+        hit_pos, hit_vecs, missing = cache.get(keys)
+    # identical texts inside one call are encoded once
+    uniq = {}
+    for i in missing:
+        uniq.setdefault(keys[i], i)
+    if uniq:
+        new_vecs = _encode([texts[i] for i in uniq.values()], batch_size)
+        cache.put(list(uniq.keys()), new_vecs)
+        dim = new_vecs.shape[1]
+    else:
+        dim = hit_vecs.shape[1]
+    embs = np.empty((len(texts), dim), dtype="float32")
+    if hit_pos:
+        embs[hit_pos] = hit_vecs
+    if uniq:
+        row_of = {k: r for r, k in enumerate(uniq)}
+        embs[missing] = new_vecs[[row_of[keys[i]] for i in missing]]
+    cache.hits += len(hit_pos)
+    cache.misses += len(missing)
+    stats = {"hits": len(hit_pos), "misses": len(missing)}
+    return (embs, stats) if return_stats else embs
+
 def get_clip():
     global _clip_model, _clip_preprocess
     if _clip_model is None:
+        import clip  # heavy (torch): imported on first use, not at server start
         _clip_model, _clip_preprocess = clip.load(CLIP_MODEL, device=_device)
     return _clip_model, _clip_preprocess
 
+def get_image_cache():
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = EmbeddingCache(f"clip-{CLIP_MODEL}")
+    return _image_cache
+
+def _normalize(x):
+    return (x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)).astype("float32")
+
+def _encode_images(paths, batch_size):
+    """CLIP image tower over paths, batch_size images per forward pass; unreadable files are skipped."""
+    if not paths:
+        return np.zeros((0, 0), dtype="float32"), []
+    import torch
+    from PIL import Image
+    model, preprocess = get_clip()
+    vecs, ok = [], []
+    for i in range(0, len(paths), batch_size):
+        tensors = []
+        for j in range(i, min(i + batch_size, len(paths))):
+            try:
+                with Image.open(paths[j]) as im:
+                    tensors.append(preprocess(im.convert("RGB")))
+                ok.append(j)
+            except (OSError, ValueError) as e:
+                print(f"Skipping unreadable image {paths[j]}: {e}")
+        if tensors:
+            with torch.no_grad(), span("embed.image"):
+                vecs.append(model.encode_image(torch.stack(tensors).to(_device)).float().cpu().numpy())
+    return (_normalize(np.vstack(vecs)) if vecs else np.zeros((0, 0), dtype="float32")), ok
+
+def embed_images(paths, batch_size=IMAGE_EMBED_BATCH, use_cache=True):
+    """
+    paths: list of image files (cropped figures, page rasters)
+    Returns (vecs, ok): L2-normalised CLIP embeddings, one row per readable image, and
+    the positions in paths they belong to. Cached by file content, like embed_texts.
+    """
+    client = get_model_client()
+    if client is not None:
+        # the server reads the files: same host, same data directory
+        return client.call("embed_images", paths, batch_size, use_cache)
+    if not paths:
+        return np.zeros((0, 0), dtype="float32"), []
+    if not use_cache:
+        return _encode_images(paths, batch_size)
+    keys = []
+    for p in paths:
+        try:
+            with open(p, "rb") as f:
+                keys.append(hashlib.blake2b(f.read(), digest_size=16).digest())
+        except OSError:
+            keys.append(None)
+    cache = get_image_cache()
+    hit_pos, hit_vecs, missing = cache.get([k or b"" for k in keys])
+    missing = [i for i in missing if keys[i] is not None]
+    new_vecs, new_ok = _encode_images([paths[i] for i in missing], batch_size)
+    new_pos = [missing[j] for j in new_ok]
+    if new_pos:
+        cache.put([keys[i] for i in new_pos], new_vecs)
+    cache.hits += len(hit_pos)
+    cache.misses += len(missing)
+    rows = {}
+    for r, i in enumerate(hit_pos):
+        rows[i] = hit_vecs[r]
+    for r, i in enumerate(new_pos):
+        rows[i] = new_vecs[r]
+    ok = sorted(rows)
+    if not ok:
+        return np.zeros((0, 0), dtype="float32"), []
+    return np.vstack([rows[i] for i in ok]).astype("float32"), ok
+
+def embed_clip_texts(texts, batch_size=64):
+    """Queries through CLIP's text tower: (n, d) float32, L2-normalised, same space as embed_images."""
+    client = get_model_client()
+    if client is not None:
+        return client.call("embed_clip_texts", texts, batch_size)
+    import clip, torch
+    model, _ = get_clip()
+    out = []
+    for i in range(0, len(texts), batch_size):
+        tokens = clip.tokenize(texts[i:i + batch_size], truncate=True).to(_device)
+        with torch.no_grad(), span("embed.clip_text"):
+            out.append(model.encode_text(tokens).float().cpu().numpy())
+    return _normalize(np.vstack(out))
+
 def embed_image(path):
     """
     path: image file path
     returns: numpy array (1, d) float32
     """
-    model, preprocess = get_clip()
-    image = preprocess(Image.open(path)).unsqueeze(0).to(_device)
-    with torch.no_grad():
-        img_emb = model.encode_image(image).cpu().numpy()
-    return img_emb.astype("float32")
+    vecs, ok = embed_images([path], use_cache=False)
+    if not ok:
+        raise OSError(f"Cannot read image {path}")
+    return vecs
@@ -0,0 +1,112 @@
+# index/builder.py
+import numpy as np
+from chunking.store import list_documents, load_document_chunks
+from embeddings.embedder import embed_texts
+from index.faiss_index import (
+    add_document, remove_document, indexed_documents, build_faiss_index, needs_retrain, ensure_features, compact_index,
+)
+from index.image_index import split_chunks, index_document_images, remove_document_images, rebuild_image_index
+from qa.facts import TEXT_FEATURES
+from config import FAISS_INDEX_PATH, META_PATH, CHUNKS_DIR, CHUNKS_PATH, IMAGE_INDEX_PATH, IMAGE_META_PATH, EMBED_PROGRESS_BATCH
+
+def _embed_with_progress(texts, progress):
+    """embed_texts in EMBED_PROGRESS_BATCH slices, reporting each finished batch."""
+    if progress is None:
+        return embed_texts(texts, return_stats=True)
+    parts, stats = [], {"hits": 0, "misses": 0}
+    for i in range(0, len(texts), EMBED_PROGRESS_BATCH):
+        vecs, s = embed_texts(texts[i:i + EMBED_PROGRESS_BATCH], return_stats=True)
+        parts.append(vecs)
+        stats = {k: stats[k] + s[k] for k in stats}
+        progress(embedded=min(i + EMBED_PROGRESS_BATCH, len(texts)), to_embed=len(texts))
+    return np.vstack(parts), stats
+
+def index_document(doc_id, chunks_dir=CHUNKS_DIR, index_path=FAISS_INDEX_PATH, meta_path=META_PATH, progress=None,
+                   image_index_path=IMAGE_INDEX_PATH, image_meta_path=IMAGE_META_PATH):
+    """
+    Embed one stored document and append it to the index (replacing older vectors for it).
+    Figures and page images go to the CLIP image index instead of the text index.
+    Returns {"chunks": n, "images": n_images, "hits": cache hits, "misses": cache misses}.
+    """
+    chunks, fingerprint = load_document_chunks(doc_id, chunks_dir)
+    if chunks is None:
+        raise FileNotFoundError(f"No chunks stored for {doc_id}")
+    chunks, image_chunks = split_chunks(chunks)
+    n_images = index_document_images(doc_id, image_chunks, fingerprint=fingerprint, progress=progress,
+                                     index_path=image_index_path, meta_path=image_meta_path)
+    texts = [c.get("text", "") for c in chunks]
+    if not texts:
+        return {"chunks": 0, "images": n_images, "hits": 0, "misses": 0}
+    vecs, stats = _embed_with_progress(texts, progress)
+    n = add_document(np.array(vecs).astype("float32"), chunks, doc_id, fingerprint=fingerprint, index_path=index_path, meta_path=meta_path,
+                     features=TEXT_FEATURES)
+    return {"chunks": n, "images": n_images, **stats}
+
+def sync_index(rebuild=False, chunks_dir=CHUNKS_DIR, index_path=FAISS_INDEX_PATH, meta_path=META_PATH, progress=None,
+               image_index_path=IMAGE_INDEX_PATH, image_meta_path=IMAGE_META_PATH):
+    """
+    Bring the index in line with the chunk store: embed documents that are new or
+    whose chunks changed, drop documents that were removed from the store.
+    rebuild=True re-embeds everything into a fresh index; this also happens automatically
+    when an IVF/PQ index needs (re)training for the current corpus size (the embedding
+    cache makes that a re-train, not a re-encode).
+    progress: optional callback, called with keyword updates (docs_total, docs_done,
+    doc, embedded, to_embed, images).
+    The paths default to the "default" collection; Collection.index_paths() gives another's.
+    Returns {"added": [...], "removed": [...], "unchanged": [...], "cache": {"hits", "misses"}}.
+    """
+    # only the default chunk store has a legacy chunks.pkl to migrate
+    stored = list_documents(chunks_dir, CHUNKS_PATH if chunks_dir == CHUNKS_DIR else None)
+    cache = {"hits": 0, "misses": 0}
+    if rebuild:
+        all_chunks, fps = [], {}
+        for doc_id in stored:
+            chunks, fps[doc_id] = load_document_chunks(doc_id, chunks_dir)
+            all_chunks.extend(chunks)
+        if not all_chunks:
+            return {"added": [], "removed": [], "unchanged": [], "cache": cache}
+        if progress:
+            progress(docs_total=len(stored), docs_done=0, doc=None)
+        all_chunks, image_chunks = split_chunks(all_chunks)
+        rebuild_image_index(image_chunks, fingerprints=fps, progress=progress,
+                            index_path=image_index_path, meta_path=image_meta_path)
+        if all_chunks:
+            vecs, cache = _embed_with_progress([c.get("text", "") for c in all_chunks], progress)
+            build_faiss_index(np.array(vecs).astype("float32"), all_chunks, index_path=index_path, meta_path=meta_path, fingerprints=fps,
+                              features=TEXT_FEATURES)
+        return {"added": list(stored), "removed": [], "unchanged": [], "cache": cache}
+
+    # stores written before the facts table / BM25 existed are upgraded here
+    ensure_features(index_path, meta_path, TEXT_FEATURES)
+    indexed = indexed_documents(index_path, meta_path)
+    added, removed = [], []
+    todo = [d for d, fp in stored.items() if not (d in indexed and indexed[d] == fp)]
+    unchanged = [d for d in stored if d not in todo]
+    if progress:
+        progress(docs_total=len(todo), docs_done=0)
+    for i, doc_id in enumerate(todo):
+        if progress:
+            progress(doc=doc_id, docs_done=i)
+        res = index_document(doc_id, chunks_dir, index_path, meta_path, progress=progress,
+                             image_index_path=image_index_path, image_meta_path=image_meta_path)
+        cache["hits"] += res["hits"]
+        cache["misses"] += res["misses"]
+        added.append(doc_id)
+    if progress:
+        progress(docs_done=len(todo))
+    for doc_id in indexed:
+        if doc_id not in stored:
+            remove_document(doc_id, index_path, meta_path, features=TEXT_FEATURES)
+            remove_document_images(doc_id, image_index_path, image_meta_path)
+            removed.append(doc_id)
+    if needs_retrain(index_path, meta_path):
+        res = sync_index(rebuild=True, chunks_dir=chunks_dir, index_path=index_path, meta_path=meta_path, progress=progress,
+                         image_index_path=image_index_path, image_meta_path=image_meta_path)
+        res["cache"] = {k: cache[k] + res["cache"][k] for k in cache}
+        res["removed"] = removed
+        res["retrained"] = True
+        return res
+    # merge the delta segments this sync (or earlier adds) left, when a merge is due
+    compact_index(index_path, meta_path)
+    compact_index(image_index_path, image_meta_path)
+    return {"added": added, "removed": removed, "unchanged": unchanged, "cache": cache}
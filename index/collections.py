@@ -0,0 +1,193 @@
+# index/collections.py
+"""
+Named collections: one corpus per client / fiscal year, each with its own raw files,
+chunk store, text index and image index under COLLECTIONS_DIR/<name>/. The "default"
+collection is the original single-corpus layout (RAW_DIR, CHUNKS_DIR, INDEX_DIR), so
+existing data keeps working unchanged.
+
+The process-wide CollectionRegistry decides which collections stay resident: a
+collection's indexes are loaded the first time it is used, and the least recently
+used collections are unloaded once the resident ones exceed COLLECTION_MEMORY_MB.
+"""
+import os, re, threading
+from collections import OrderedDict
+from index.faiss_index import get_index_manager, release_index_manager
+from config import (
+    RAW_DIR, CHUNKS_DIR, CHUNKS_PATH, FAISS_INDEX_PATH, META_PATH, IMAGE_INDEX_PATH, IMAGE_META_PATH,
+    COLLECTIONS_DIR, DEFAULT_COLLECTION, COLLECTION_MEMORY_MB,
+)
+
+_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+class Collection:
+    """Paths of one collection (nothing is loaded by creating it)."""
+
+    def __init__(self, name):
+        if not isinstance(name, str) or not _NAME.match(name):
+            raise ValueError(f"Invalid collection name {name!r}: use letters, digits, '.', '_' or '-' (max 64)")
+        self.name = name
+        if name == "default":
+            self.raw_dir = RAW_DIR
+            self.chunks_dir = CHUNKS_DIR
+            self.legacy_chunks = CHUNKS_PATH
+            self.index_path, self.meta_path = FAISS_INDEX_PATH, META_PATH
+            self.image_index_path, self.image_meta_path = IMAGE_INDEX_PATH, IMAGE_META_PATH
+        else:
+            root = os.path.join(COLLECTIONS_DIR, name)
+            index_dir = os.path.join(root, "index")
+            self.raw_dir = os.path.join(root, "raw")
+            self.chunks_dir = os.path.join(root, "chunks")
+            self.legacy_chunks = None
+            self.index_path = os.path.join(index_dir, os.path.basename(FAISS_INDEX_PATH))
+            self.meta_path = os.path.join(index_dir, os.path.basename(META_PATH))
+            self.image_index_path = os.path.join(index_dir, os.path.basename(IMAGE_INDEX_PATH))
+            self.image_meta_path = os.path.join(index_dir, os.path.basename(IMAGE_META_PATH))
+
+    def __repr__(self):
+        return f"Collection({self.name!r})"
+
+    def index_paths(self):
+        """Keyword arguments for sync_index / index_document / stream_pdf_to_index."""
+        return {"chunks_dir": self.chunks_dir, "index_path": self.index_path, "meta_path": self.meta_path,
+                "image_index_path": self.image_index_path, "image_meta_path": self.image_meta_path}
+
+    def managers(self):
+        return (get_index_manager(self.index_path, self.meta_path),
+                get_index_manager(self.image_index_path, self.image_meta_path))
+
+    def versions(self):
+        """(text, image) index versions; None where that index has not been built."""
+        # no IndexManager is created for an index that is not on disk
+        return tuple(get_index_manager(i, m).version if os.path.exists(i) else None
+                     for i, m in ((self.index_path, self.meta_path), (self.image_index_path, self.image_meta_path)))
+
+    def load(self):
+        """Load whichever indexes exist; returns their approximate resident size in bytes."""
+        size = 0
+        for mgr in self.managers():
+            if mgr.version is not None:
+                mgr.get()
+            size += mgr.resident_bytes()
+        return size
+
+    def unload(self):
+        release_index_manager(self.index_path, self.meta_path)
+        release_index_manager(self.image_index_path, self.image_meta_path)
+
+    def exists(self):
+        return self.name in ("default", DEFAULT_COLLECTION) or os.path.isdir(self.chunks_dir) or os.path.exists(self.index_path)
+
+
+_collections = {}
+_collections_lock = threading.Lock()
+
+def get_collection(name=None):
+    """
+    Collection by name (None -> DEFAULT_COLLECTION). Raises ValueError for an invalid name.
+    Only collections that exist on disk are cached, so request-supplied names that match
+    nothing do not accumulate.
+    """
+    name = name or DEFAULT_COLLECTION
+    coll = _collections.get(name)
+    if coll is None:
+        coll = Collection(name)
+        if coll.exists():
+            with _collections_lock:
+                coll = _collections.setdefault(name, coll)
+    return coll
+
+def list_collections():
+    """Names of the collections on disk (the default one always included)."""
+    names = {DEFAULT_COLLECTION}
+    if os.path.isdir(COLLECTIONS_DIR):
+        names.update(n for n in os.listdir(COLLECTIONS_DIR)
+                     if _NAME.match(n) and os.path.isdir(os.path.join(COLLECTIONS_DIR, n)))
+    return sorted(names)
+
+
+class CollectionRegistry:
+    """
+    LRU of resident collections under a memory budget. acquire() marks a collection
+    most recently used, loading its indexes the first time; when the total resident
+    size passes the budget, least recently used collections are unloaded (never the
+    one just acquired). Sizes are re-measured whenever a collection's index version
+    changes, so a rebuild or a growing streaming ingest is accounted for.
+    """
+
+    def __init__(self, memory_mb=COLLECTION_MEMORY_MB):
+        self.budget = int(memory_mb * 1024 * 1024)
+        self._resident = OrderedDict()  # name -> (versions, bytes)
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def acquire(self, name=None):
+        coll = get_collection(name)
+        versions = coll.versions()
+        with self._lock:
+            entry = self._resident.get(coll.name)
+            if entry is not None and entry[0] == versions:
+                self._resident.move_to_end(coll.name)
+                return coll
+        if versions == (None, None):
+            # nothing built yet: nothing to load or account for
+            return coll
+        # loading can take seconds: done outside the lock (IndexManager serialises it per index)
+        size = coll.load()
+        with self._lock:
+            if coll.name not in self._resident:
+                self.loads += 1
+            self._resident[coll.name] = (versions, size)
+            self._resident.move_to_end(coll.name)
+            victims = self._evict_over_budget(keep=coll.name)
+        for victim in victims:
+            get_collection(victim).unload()
+        return coll
+
+    def _evict_over_budget(self, keep):
+        victims = []
+        total = sum(size for _, size in self._resident.values())
+        for name in list(self._resident):
+            if total <= self.budget:
+                break
+            if name == keep:
+                continue
+            total -= self._resident.pop(name)[1]
+            victims.append(name)
+            self.evictions += 1
+        return victims
+
+    def release(self, name):
+        """Unload a collection now (e.g. after deleting it)."""
+        coll = get_collection(name)
+        with self._lock:
+            self._resident.pop(coll.name, None)
+        coll.unload()
+
+    def resident(self):
+        with self._lock:
+            return list(self._resident)
+
+    def stats(self):
+        with self._lock:
+            used = sum(size for _, size in self._resident.values())
+            return {
+                "resident": list(self._resident),
+                "resident_mb": round(used / (1024 * 1024), 2),
+                "budget_mb": round(self.budget / (1024 * 1024), 2),
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = CollectionRegistry()
+    return _registry
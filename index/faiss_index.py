@@ -1,41 +1,760 @@
 # index/faiss_index.py
 import faiss
 import numpy as np
-import os, pickle
-from config import FAISS_INDEX_PATH, META_PATH, INDEX_DIR
+import os, glob, pickle, threading, uuid, hashlib
+from contextlib import contextmanager
+from index import meta_store, sparse_index
+from index.meta_store import MetaStore, write_meta_store, update_meta_store
+from index.sparse_index import SparseIndex, write_sparse_index, update_sparse_index, merge_sparse_index, reciprocal_rank_fusion
+from index.segments import add_tombstones, dead_in, read_tombstones, write_tombstones
+from metrics import span, timed
+from config import (
+    FAISS_INDEX_PATH, META_PATH, INDEX_DIR, FAISS_INDEX_TYPE,
+    IVF_NLIST, IVF_NPROBE, PQ_M, PQ_NBITS, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH,
+    RETRAIN_GROWTH, HYBRID_SEARCH, HYBRID_CANDIDATES, RRF_K, INDEX_MAX_SEGMENTS, INDEX_MERGE_RATIO,
+)
 
-def build_faiss_index(vectors, metadata, index_path=FAISS_INDEX_PATH, meta_path=META_PATH):
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX: writes are only serialised within the process
+    fcntl = None
+
+# serialises add/remove within a process (readers go through IndexManager)
+_write_lock = threading.Lock()
+
+@contextmanager
+def _writing(index_path):
+    """
+    Held around every read-modify-write of an index (index, meta store, postings,
+    features and the version bump): _write_lock within the process, an flock on
+    <index_path>.lock across processes (web workers, CLI runs).
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    with _write_lock, open(index_path + ".lock", "w") as lockf:
+        if fcntl is not None:
+            fcntl.flock(lockf, fcntl.LOCK_EX)
+        yield
+
+def chunk_uid(doc_id, chunk_id):
+    """Stable int64 FAISS id for a chunk, derived from (doc_id, chunk_id)."""
+    h = hashlib.blake2b(f"{doc_id}\x00{chunk_id}".encode("utf-8"), digest_size=8).digest()
+    # keep it positive: FAISS uses -1 for "no result"
+    return int.from_bytes(h, "little") & 0x7FFFFFFFFFFFFFFF
+
+def _version_path(index_path):
+    return index_path + ".version"
+
+def _atomic_write(path, write_fn):
+    """
+    Write to a temp file next to `path` and rename it into place, so readers
+    never observe a half-written index or meta file.
+    """
+    tmp = f"{path}.tmp.{os.getpid()}"
+    write_fn(tmp)
+    os.replace(tmp, path)
+
+def _bump_version(index_path):
+    # written last: a new version stamp means index + meta are both complete
+    def _write(p):
+        with open(p, "w") as f:
+            f.write(uuid.uuid4().hex)
+    _atomic_write(_version_path(index_path), _write)
+
+def effective_index_type(index_type, n):
+    """
+    The index type make_index actually builds for n training vectors: IVF needs
+    ~39 points per list and PQ 2**nbits points per codebook, below that we stay flat.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type {index_type!r}; expected one of {INDEX_TYPES}")
+    if index_type == "ivf_flat" and n // 39 < 1:
+        return "flat"
+    if index_type == "ivf_pq" and (n // 39 < 1 or n < 2 ** PQ_NBITS):
+        return "flat"
+    return index_type
+
+def make_index(dim, train_vecs=None, index_type=FAISS_INDEX_TYPE):
+    """
+    Build an empty IDMap2-wrapped index, trained on train_vecs when the type needs it.
+    Normalized vectors + inner product == cosine for every type.
+    Returns (index, actual_type); see effective_index_type for the flat fallback.
+    """
+    n = 0 if train_vecs is None else len(train_vecs)
+    actual = effective_index_type(index_type, n)
+    if actual == "flat":
+        inner = faiss.IndexFlatIP(dim)
+    elif actual == "hnsw":
+        inner = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        inner.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        inner.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        nlist = max(1, min(IVF_NLIST, n // 39))
+        if actual == "ivf_pq":
+            if dim % PQ_M:
+                raise ValueError(f"PQ_M={PQ_M} must divide the embedding dimension {dim}")
+            spec = f"IVF{nlist},PQ{PQ_M}x{PQ_NBITS}"
+        else:
+            spec = f"IVF{nlist},Flat"
+        inner = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+        inner.train(np.ascontiguousarray(train_vecs, dtype="float32"))
+        faiss.extract_index_ivf(inner).nprobe = IVF_NPROBE
+    return faiss.IndexIDMap2(inner), actual
+
+def _apply_search_defaults(index):
+    # nprobe / efSearch are stored in the index file; re-apply the configured defaults
+    inner = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = IVF_NPROBE
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = HNSW_EF_SEARCH
+
+def _search_params(index, nprobe=None, ef_search=None, sel=None):
+    """
+    Per-query SearchParameters, so concurrent searches never mutate the shared index.
+    sel: IDSelector of the ids the search may return (segment tombstones).
+    """
+    if nprobe is None and ef_search is None and sel is None:
+        return None
+    inner = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+    if isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = int(nprobe if nprobe is not None else inner.nprobe)
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = int(ef_search if ef_search is not None else inner.hnsw.efSearch)
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if sel is not None:
+        params.sel = sel
+    return params
+
+def search_vectors(index, q, top_k, nprobe=None, ef_search=None, sel=None):
+    """index.search with optional per-query nprobe (IVF) / efSearch (HNSW) and id filter."""
+    params = _search_params(index, nprobe, ef_search, sel)
+    if params is None:
+        return index.search(q, top_k)
+    return index.search(q, top_k, params=params)
+
+def _save_index(index, index_path):
+    os.makedirs(os.path.dirname(index_path) or INDEX_DIR, exist_ok=True)
+    _atomic_write(index_path, lambda p: faiss.write_index(index, p))
+
+# Index-time text features are computed above this layer and passed in by the callers
+# that write a text index (index/builder.py, pipeline/streaming.py, ...) as `features`,
+# an object with:
+#     annotate(chunk)                        add per-chunk features in place (e.g. kw_score)
+#     update(meta_path, add_chunks=(), remove_uids=(), clear=False)   maintain side tables
+#     exists(meta_path)                      whether the side tables have been built
+# features=None (the image index) writes neither; sparse=False skips the BM25 postings.
+
+def _with_uids(chunks, features=None):
+    """Copies of chunks with their uid (and index-time features when given)."""
+    out = []
+    for c in chunks:
+        c = dict(c)
+        c["uid"] = chunk_uid(c.get("doc_id"), c.get("chunk_id"))
+        if features is not None:
+            features.annotate(c)
+        out.append(c)
+    return out
+
+@timed("index.build")
+def build_faiss_index(vectors, metadata, index_path=FAISS_INDEX_PATH, meta_path=META_PATH, fingerprints=None,
+                      index_type=FAISS_INDEX_TYPE, sparse=True, features=None):
     """
     vectors: numpy array shape (n, d) float32
     metadata: list of dicts (same length n)
+    fingerprints: optional {doc_id: fingerprint} recorded for incremental updates
+    index_type: FAISS index type (the image index passes its own)
+    sparse / features: BM25 postings and index-time text features (see above)
+    Builds a fresh index, replacing whatever was there.
     """
-    os.makedirs(INDEX_DIR, exist_ok=True)
-    # normalize and use IndexFlatIP for cosine via normalized vectors
-    vecs = vectors.copy()
+    vecs = np.ascontiguousarray(vectors, dtype="float32").copy()
     faiss.normalize_L2(vecs)
-    dim = vecs.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(vecs)
-    faiss.write_index(index, index_path)
-    with open(meta_path, "wb") as f:
-        pickle.dump(metadata, f)
+    chunks = _with_uids(metadata, features)
+    ids = np.array([c["uid"] for c in chunks], dtype="int64")
+    index, index_type = make_index(vecs.shape[1], vecs, index_type)
+    index.add_with_ids(vecs, ids)
+    docs = {c.get("doc_id"): None for c in chunks}
+    docs.update(fingerprints or {})
+    with _writing(index_path):
+        old = MetaStore(meta_path).info if meta_store.exists(meta_path) else {}
+        _save_index(index, index_path)
+        info = _base_info(index_type, len(vecs), len(vecs), sparse)
+        write_meta_store(meta_path, chunks, docs, info)
+        _cleanup_segments(index_path, old, info)
+        if sparse:
+            write_sparse_index(_sparse_path(meta_path), chunks)
+        if features is not None:
+            features.update(meta_path, chunks, clear=True)
+        _bump_version(index_path)
     return True
 
-def load_index(index_path=FAISS_INDEX_PATH, meta_path=META_PATH):
-    if not os.path.exists(index_path) or not os.path.exists(meta_path):
-        raise FileNotFoundError("Index or meta not found")
+def _legacy_meta_path(meta_path):
+    return meta_path + ".pkl"
+
+def _sparse_path(meta_path):
+    return meta_path + ".bm25"
+
+def _needs_sparse(meta_path):
+    """A text store written before BM25 existed (image stores record sparse=False)."""
+    if sparse_index.exists(_sparse_path(meta_path)) or not meta_store.exists(meta_path):
+        return False
+    return MetaStore(meta_path).info.get("sparse", True)
+
+def _stored_chunks(meta_path):
+    store = MetaStore(meta_path)
+    return [c for c in store.get_many(store.rows["uid"]) if c is not None]
+
+def _ensure_sparse(meta_path, features=None):
+    """
+    Build the BM25 index (and, given features, their side tables) for a store written
+    before they existed. Call inside _writing().
+    """
+    missing_sparse = _needs_sparse(meta_path)
+    missing_features = features is not None and meta_store.exists(meta_path) and not features.exists(meta_path)
+    if not (missing_sparse or missing_features):
+        return
+    chunks = _stored_chunks(meta_path)
+    if missing_sparse:
+        write_sparse_index(_sparse_path(meta_path), chunks)
+    if missing_features:
+        features.update(meta_path, chunks)
+
+def ensure_features(index_path=FAISS_INDEX_PATH, meta_path=META_PATH, features=None):
+    """Upgrade a store written by an older version: meta format, BM25 postings, feature tables."""
+    with _writing(index_path):
+        _migrate_legacy(index_path, meta_path)
+        _ensure_sparse(meta_path, features)
+
+def _migrate_legacy(index_path, meta_path):
+    """
+    Convert a meta.pkl (positional list, or the {"chunks", "docs"} dict) into the
+    offset-indexed store. Positional indexes are re-keyed to stable uids. Call inside
+    _writing().
+    """
+    legacy = _legacy_meta_path(meta_path)
+    if meta_store.exists(meta_path) or not os.path.exists(legacy) or not os.path.exists(index_path):
+        return
     index = faiss.read_index(index_path)
-    import pickle
-    with open(meta_path, "rb") as f:
+    with open(legacy, "rb") as f:
         meta = pickle.load(f)
-    return index, meta
-
-def search_index(query_vec, top_k=5, index_path=FAISS_INDEX_PATH, meta_path=META_PATH):
-    index, meta = load_index(index_path, meta_path)
-    q = query_vec.copy()
-    faiss.normalize_L2(q)
-    D, I = index.search(q, top_k)
-    results = []
-    for idx in I[0]:
-        results.append(meta[idx])
-    return results, D[0]
+    if isinstance(meta, dict):
+        chunks = _with_uids(meta["chunks"].values())
+        docs = meta["docs"]
+        info = {"index_type": meta.get("index_type", "flat"), "trained_on": meta.get("trained_on", 0)}
+    else:
+        vecs = index.reconstruct_n(0, index.ntotal)
+        chunks = _with_uids(meta)
+        new, _ = make_index(index.d, None, "flat")
+        new.add_with_ids(vecs, np.array([c["uid"] for c in chunks], dtype="int64"))
+        _save_index(new, index_path)
+        docs = {c.get("doc_id"): None for c in chunks}
+        info = {"index_type": "flat", "trained_on": 0}
+    write_meta_store(meta_path, chunks, docs, info)
+    # only text indexes predate the offset-indexed store; feature tables are built by ensure_features
+    write_sparse_index(_sparse_path(meta_path), chunks)
+    os.replace(legacy, legacy + ".migrated")
+    _bump_version(index_path)
+
+def _remove_ids(index, uids, index_type):
+    ids = np.asarray(uids, dtype="int64")
+    try:
+        index.remove_ids(ids)
+        return index
+    except RuntimeError:
+        # HNSW graphs cannot delete in place: rebuild from the remaining vectors
+        all_ids = faiss.vector_to_array(index.id_map)
+        keep = ~np.isin(all_ids, ids)
+        vecs = index.index.reconstruct_n(0, index.ntotal)[keep]
+        new, _ = make_index(index.d, vecs, index_type)
+        new.add_with_ids(vecs, all_ids[keep])
+        return new
+
+# Segments: index_path holds the base index (segment 0). add_document writes each add
+# as a flat delta segment <index_path>.<gen>.seg and deletions as tombstones
+# (index/segments.py); both are listed in the store's info ("segments", "tomb"), so
+# they are published with the metadata in one manifest write. Searches cover the base
+# and every delta, with dead copies filtered inside FAISS. compact_index merges the
+# deltas into one once there are more than INDEX_MAX_SEGMENTS, and everything into
+# the base once deltas + tombstones pass INDEX_MERGE_RATIO of it, in the background
+# after an add (and in sync_index): an add costs what the document costs, the
+# corpus-sized rewrite is amortised over many adds.
+
+def _base_info(index_type, trained_on, base_n, sparse):
+    return {"index_type": index_type, "trained_on": trained_on, "sparse": sparse,
+            "base_n": base_n, "segments": [], "tomb": None, "dead": 0, "next_seq": 1}
+
+def _segment_path(index_path, name):
+    return os.path.join(os.path.dirname(index_path), name)
+
+def _write_segment(index_path, vecs, uids):
+    """A delta segment: a flat index over vecs; returns its file name."""
+    seg, _ = make_index(vecs.shape[1], None, "flat")
+    seg.add_with_ids(np.ascontiguousarray(vecs, dtype="float32"), np.asarray(uids, dtype="int64"))
+    name = f"{os.path.basename(index_path)}.{uuid.uuid4().hex[:12]}.seg"
+    _save_index(seg, _segment_path(index_path, name))
+    return name
+
+def _cleanup_segments(index_path, old, new):
+    """Delete segment / tombstone files neither info lists (same policy as meta_store._cleanup)."""
+    base = os.path.dirname(os.path.abspath(index_path))
+    head = os.path.basename(index_path) + "."
+    keep = set()
+    for info in (old or {}, new):
+        keep |= {s["file"] for s in info.get("segments", [])} | {info.get("tomb")}
+    for name in os.listdir(base):
+        if name.startswith(head) and (name.endswith(".seg") or name.endswith(".tomb.npy")) and name not in keep:
+            try:
+                os.remove(os.path.join(base, name))
+            except OSError:
+                pass
+
+def _tombstone(index_path, info, uids, seq):
+    """info with (uids, seq) added to its tombstones."""
+    if len(uids):
+        tomb = add_tombstones(read_tombstones(index_path, info.get("tomb")), uids, seq)
+        info["tomb"] = write_tombstones(index_path, tomb)
+        info["dead"] = len(tomb)
+    return info
+
+def _compaction_due(info):
+    """"full", "deltas" or None (see the segments note above)."""
+    segments = info.get("segments", [])
+    pending = sum(s["n"] for s in segments) + info.get("dead", 0)
+    # stores written before segments existed have no base_n: merged (and counted) once
+    if pending and pending > INDEX_MERGE_RATIO * info.get("base_n", 0):
+        return "full"
+    if len(segments) > INDEX_MAX_SEGMENTS:
+        return "deltas"
+    return None
+
+@timed("index.add_document")
+def add_document(vectors, chunks, doc_id, fingerprint=None, index_path=FAISS_INDEX_PATH, meta_path=META_PATH, replace=True,
+                 index_type=FAISS_INDEX_TYPE, sparse=True, features=None):
+    """
+    Append one document's vectors + chunk metadata to the index, replacing any
+    vectors previously stored for the same doc_id. The vectors go to a new delta
+    segment, the replaced ones are tombstoned, the BM25 postings and metadata are
+    appended the same way: the work is proportional to the document, the index and
+    postings already on disk are neither read nor rewritten.
+    replace=False appends to what is already stored for doc_id (streaming ingest
+    adds a document batch by batch).
+    index_type: the type to create when this call creates the index.
+    sparse / features: BM25 postings and index-time text features (see above).
+    """
+    vecs = np.asarray(vectors, dtype="float32").copy()
+    if len(vecs):
+        faiss.normalize_L2(vecs)
+    chunks = _with_uids(chunks, features)
+    ids = np.array([c["uid"] for c in chunks], dtype="int64")
+    with _writing(index_path):
+        _migrate_legacy(index_path, meta_path)
+        _ensure_sparse(meta_path, features)
+        if not os.path.exists(index_path) or not meta_store.exists(meta_path):
+            if not len(chunks):
+                return 0
+            # first document: it is the base; IVF/PQ types are trained on it (sync_index
+            # retrains as the corpus grows)
+            index, index_type = make_index(vecs.shape[1], vecs, index_type)
+            index.add_with_ids(vecs, ids)
+            _save_index(index, index_path)
+            info = _base_info(index_type, len(vecs), len(vecs), sparse)
+            update_meta_store(meta_path, add_chunks=chunks, set_docs={doc_id: fingerprint}, info=info)
+            if sparse:
+                write_sparse_index(_sparse_path(meta_path), chunks)
+            if features is not None:
+                features.update(meta_path, chunks)
+            _bump_version(index_path)
+            return len(chunks)
+        store = MetaStore(meta_path)
+        info = dict(store.info)
+        old = store.doc_uids(doc_id) if replace else np.zeros(0, dtype="int64")
+        seq = info.get("next_seq", 1)
+        info["segments"] = list(info.get("segments", []))
+        if len(chunks):
+            info["segments"].append({"seq": seq, "file": _write_segment(index_path, vecs, ids), "n": len(chunks)})
+        # the replaced copies die in every segment before this one; the new ones live in it
+        info = _tombstone(index_path, info, old, seq)
+        info["next_seq"] = seq + 1
+        update_meta_store(meta_path, add_chunks=chunks, set_docs={doc_id: fingerprint},
+                          remove_docs=[doc_id] if replace else [], info=info)
+        _cleanup_segments(index_path, store.info, info)
+        if sparse:
+            update_sparse_index(_sparse_path(meta_path), add_chunks=chunks, remove_uids=old)
+        if features is not None:
+            features.update(meta_path, chunks, remove_uids=old)
+        _bump_version(index_path)
+    _schedule_compaction(index_path, meta_path, info)
+    return len(chunks)
+
+@timed("index.remove_document")
+def remove_document(doc_id, index_path=FAISS_INDEX_PATH, meta_path=META_PATH, features=None):
+    """Delete every vector belonging to doc_id (as tombstones). Returns the number of chunks removed."""
+    with _writing(index_path):
+        _migrate_legacy(index_path, meta_path)
+        _ensure_sparse(meta_path, features)
+        if not os.path.exists(index_path) or not meta_store.exists(meta_path):
+            return 0
+        store = MetaStore(meta_path)
+        if doc_id not in store.docs:
+            return 0
+        old = store.doc_uids(doc_id)
+        info = dict(store.info)
+        seq = info.get("next_seq", 1)
+        info = _tombstone(index_path, info, old, seq)
+        info["next_seq"] = seq + 1
+        update_meta_store(meta_path, remove_docs=[doc_id], info=info)
+        _cleanup_segments(index_path, store.info, info)
+        if sparse_index.exists(_sparse_path(meta_path)):
+            update_sparse_index(_sparse_path(meta_path), remove_uids=old)
+        if features is not None:
+            features.update(meta_path, remove_uids=old)
+        _bump_version(index_path)
+    _schedule_compaction(index_path, meta_path, info)
+    return len(old)
+
+def _live_segment_vectors(index_path, segments, tomb):
+    """(vectors, uids) of the live copies in the given delta segments."""
+    vecs, ids = [], []
+    for s in segments:
+        seg = faiss.read_index(_segment_path(index_path, s["file"]))
+        uids = faiss.vector_to_array(seg.id_map)
+        keep = ~np.isin(uids, dead_in(tomb, s["seq"]))
+        vecs.append(seg.index.reconstruct_n(0, seg.ntotal)[keep])
+        ids.append(uids[keep])
+    if not vecs:
+        return np.zeros((0, 0), dtype="float32"), np.zeros(0, dtype="int64")
+    return np.vstack(vecs), np.concatenate(ids)
+
+@timed("index.compact")
+def compact_index(index_path=FAISS_INDEX_PATH, meta_path=META_PATH, full=None):
+    """
+    Merge delta segments: full=True folds deltas and tombstones into the base,
+    full=False merges the deltas into one delta segment, None does whichever is due
+    (see _compaction_due). The BM25 generations are merged alongside. Returns the
+    merge done ("full" / "deltas") or None.
+    """
+    with _writing(index_path):
+        if not os.path.exists(index_path) or not meta_store.exists(meta_path):
+            return None
+        store = MetaStore(meta_path)
+        info = dict(store.info)
+        mode = _compaction_due(info) if full is None else ("full" if full else "deltas")
+        segments = info.get("segments", [])
+        if mode is None or (mode == "deltas" and len(segments) < 2) or not (segments or info.get("tomb")):
+            return None
+        tomb = read_tombstones(index_path, info.get("tomb"))
+        vecs, ids = _live_segment_vectors(index_path, segments, tomb)
+        if mode == "full":
+            base = _read_index(index_path, mmap=False)
+            # dead base copies, and delta ids an interrupted compaction may already have merged
+            drop = np.union1d(tomb["uid"], ids)
+            if len(drop):
+                base = _remove_ids(base, drop, info.get("index_type", "flat"))
+            if len(ids):
+                base.add_with_ids(vecs, ids)
+            _save_index(base, index_path)
+            info.update(segments=[], tomb=None, dead=0, base_n=int(base.ntotal))
+        else:
+            info["segments"] = [{"seq": max(s["seq"] for s in segments), "n": len(ids),
+                                 "file": _write_segment(index_path, vecs, ids)}] if len(ids) else []
+        update_meta_store(meta_path, info=info)
+        _cleanup_segments(index_path, store.info, info)
+        if sparse_index.exists(_sparse_path(meta_path)):
+            merge_sparse_index(_sparse_path(meta_path), full=mode == "full")
+        _bump_version(index_path)
+    return mode
+
+_compacting = set()
+_compacting_lock = threading.Lock()
+
+def _schedule_compaction(index_path, meta_path, info):
+    """Run compact_index on a background thread when a merge is due (one per index at a time)."""
+    key = os.path.abspath(index_path)
+    if _compaction_due(info) is None:
+        return
+    with _compacting_lock:
+        if key in _compacting:
+            return
+        _compacting.add(key)
+
+    def run():
+        try:
+            compact_index(index_path, meta_path)
+        except Exception as e:
+            print(f"Index compaction of {index_path} failed: {e}")
+        finally:
+            with _compacting_lock:
+                _compacting.discard(key)
+
+    # not a daemon: a CLI run finishes the merge before the interpreter exits
+    threading.Thread(target=run, name="mmr-compact").start()
+
+def needs_retrain(index_path=FAISS_INDEX_PATH, meta_path=META_PATH, index_type=FAISS_INDEX_TYPE):
+    """
+    True when the index on disk should be rebuilt: the configured type changed, the
+    corpus grew large enough to train an IVF/PQ index, or it outgrew its training set.
+    """
+    try:
+        index, store = get_index_manager(index_path, meta_path).get()
+    except FileNotFoundError:
+        return False
+    actual = store.info.get("index_type", "flat")
+    n = len(store)  # live chunks, wherever their vectors are
+    if effective_index_type(index_type, n) != actual:
+        return True
+    trained_on = store.info.get("trained_on", 0)
+    return actual in ("ivf_flat", "ivf_pq") and n > RETRAIN_GROWTH * max(trained_on, 1)
+
+def indexed_documents(index_path=FAISS_INDEX_PATH, meta_path=META_PATH):
+    """{doc_id: fingerprint} for the documents currently in the index."""
+    try:
+        _, store = get_index_manager(index_path, meta_path).get()
+    except FileNotFoundError:
+        return {}
+    return store.docs
+
+def manifest_documents(meta_path=META_PATH):
+    """indexed_documents without loading anything: read from the store manifest (status pages)."""
+    return meta_store.read_docs(meta_path)
+
+def _read_index(index_path, mmap=True):
+    if mmap:
+        # map the index file instead of copying it into each worker's heap; the pages
+        # live in the shared page cache. Not every index type / faiss build supports it.
+        flags = faiss.IO_FLAG_READ_ONLY | faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        try:
+            return faiss.read_index(index_path, flags)
+        except RuntimeError:
+            pass
+    return faiss.read_index(index_path)
+
+class SegmentedIndex:
+    """
+    The base index and its delta segments searched as one (see the segments note
+    above). Tombstoned copies are excluded inside each segment's FAISS search, so every
+    segment returns its own top_k of live vectors and the merge is exact.
+    """
+
+    def __init__(self, base, deltas=(), tomb=None, files=None):
+        self.base = base
+        self.segments = [(0, base)] + list(deltas)  # (seq, faiss index)
+        self.files = files or {}  # file key -> faiss index, reused by the next load
+        self._selectors = {}
+        for seq, _ in self.segments:
+            dead = dead_in(tomb, seq) if tomb is not None else ()
+            if len(dead):
+                batch = faiss.IDSelectorBatch(np.ascontiguousarray(dead, dtype="int64"))
+                self._selectors[seq] = (batch, faiss.IDSelectorNot(batch))  # the Not keeps a pointer to batch
+        self.d = base.d
+        self.ntotal = sum(ix.ntotal for _, ix in self.segments)
+
+    def search(self, q, top_k, nprobe=None, ef_search=None):
+        """(D, I) like faiss Index.search; I is -1 past the live vectors."""
+        if len(self.segments) == 1 and not self._selectors:
+            return search_vectors(self.base, q, top_k, nprobe=nprobe, ef_search=ef_search)
+        Ds, Is = [], []
+        for seq, ix in self.segments:
+            if ix.ntotal:
+                sel = self._selectors.get(seq)
+                D, I = search_vectors(ix, q, top_k, nprobe=nprobe, ef_search=ef_search, sel=sel[1] if sel else None)
+                Ds.append(D)
+                Is.append(I)
+        if not Ds:
+            return np.full((len(q), top_k), -np.inf, dtype="float32"), np.full((len(q), top_k), -1, dtype="int64")
+        D, I = np.hstack(Ds), np.hstack(Is)
+        D = np.where(I >= 0, D, -np.inf)
+        order = np.argsort(-D, axis=1, kind="stable")
+        D, I = np.take_along_axis(D, order, 1), np.take_along_axis(I, order, 1)
+        out_D = np.full((len(q), top_k), -np.inf, dtype="float32")
+        out_I = np.full((len(q), top_k), -1, dtype="int64")
+        for r in range(len(q)):
+            # a uid can briefly sit in two segments while a merge is being published
+            live = I[r] >= 0
+            _, first = np.unique(I[r][live], return_index=True)
+            first = np.sort(first)[:top_k]
+            out_D[r, :len(first)] = D[r][live][first]
+            out_I[r, :len(first)] = I[r][live][first]
+        return out_D, out_I
+
+def load_index(index_path=FAISS_INDEX_PATH, meta_path=META_PATH, mmap=True, reuse=None):
+    """
+    Returns (SegmentedIndex, MetaStore). Indexes are memory-mapped read-only where FAISS
+    supports it. reuse: an earlier SegmentedIndex whose unchanged files are kept
+    instead of read again (a new delta segment only costs reading that segment).
+    """
+    if not os.path.exists(index_path) or not meta_store.exists(meta_path):
+        raise FileNotFoundError("Index or meta not found")
+    meta = MetaStore(meta_path)
+    cache = reuse.files if reuse is not None else {}
+    files = {}
+
+    def read(key, path):
+        ix = cache.get(key)
+        if ix is None:
+            ix = _read_index(path, mmap=mmap)
+            _apply_search_defaults(ix)
+        files[key] = ix
+        return ix
+
+    st = os.stat(index_path)
+    base = read(("base", st.st_ino, st.st_mtime_ns, st.st_size), index_path)
+    deltas = [(s["seq"], read(s["file"], _segment_path(index_path, s["file"]))) for s in meta.info.get("segments", [])]
+    tomb = read_tombstones(index_path, meta.info.get("tomb"))
+    return SegmentedIndex(base, deltas, tomb, files), meta
+
+
+class IndexManager:
+    """
+    Keeps one FAISS index + its metadata resident in the process.
+    Every access stats the version stamp written by build_faiss_index and
+    swaps in the rebuilt index when it changes, so a running server picks up
+    a new build without a restart.
+    """
+
+    def __init__(self, index_path=FAISS_INDEX_PATH, meta_path=META_PATH):
+        self.index_path = index_path
+        self.meta_path = meta_path
+        self._lock = threading.Lock()
+        # (stamp, index, meta, sparse) swapped as one tuple so readers never mix generations
+        self._state = (None, None, None, None)
+
+    def _disk_stamp(self):
+        try:
+            st = os.stat(_version_path(self.index_path))
+            return ("v", st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+        # indexes built before version stamps existed: fall back to file mtimes
+        try:
+            si = os.stat(self.index_path)
+            sm = os.stat(_legacy_meta_path(self.meta_path))
+        except FileNotFoundError:
+            return None
+        return ("m", si.st_mtime_ns, si.st_size, sm.st_mtime_ns, sm.st_size)
+
+    @property
+    def version(self):
+        """Stamp of the index currently on disk (None if there is no index)."""
+        return self._disk_stamp()
+
+    def _current(self):
+        """The full state tuple, loading or reloading from disk only when the stamp changed."""
+        stamp = self._disk_stamp()
+        if stamp is None:
+            raise FileNotFoundError("Index or meta not found")
+        state = self._state
+        if stamp != state[0]:
+            with self._lock:
+                state = self._state
+                if stamp != state[0]:
+                    sp = _sparse_path(self.meta_path)
+                    if not meta_store.exists(self.meta_path) or _needs_sparse(self.meta_path):
+                        with _writing(self.index_path):
+                            _migrate_legacy(self.index_path, self.meta_path)
+                            _ensure_sparse(self.meta_path)
+                        stamp = self._disk_stamp()
+                    with span("index.load"):
+                        # files of the previous generation that are still current are reused
+                        index, meta = load_index(self.index_path, self.meta_path, reuse=state[1])
+                        sparse = SparseIndex(sp, state[3].loaded if state[3] is not None else None) if sparse_index.exists(sp) else None
+                    state = (stamp, index, meta, sparse)
+                    self._state = state
+        return state
+
+    def get(self):
+        """Return (index, meta) of the current generation."""
+        return self._current()[1:3]
+
+    def invalidate(self):
+        with self._lock:
+            self._state = (None, None, None, None)
+
+    @property
+    def loaded(self):
+        return self._state[1] is not None
+
+    def resident_bytes(self):
+        """Approximate memory of the loaded generation: the size of its files (0 when not loaded)."""
+        if not self.loaded:
+            return 0
+        paths = ([self.index_path] + glob.glob(glob.escape(self.index_path) + ".*.seg")
+                 + glob.glob(glob.escape(self.meta_path) + "*"))
+        return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+    def search(self, query_vec, top_k=5, nprobe=None, ef_search=None, query_text=None):
+        texts = [query_text] if query_text is not None else None
+        return self.search_batch(query_vec, top_k, nprobe=nprobe, ef_search=ef_search, query_texts=texts)[0]
+
+    def search_batch(self, query_vecs, top_k=5, nprobe=None, ef_search=None, query_texts=None):
+        """
+        One FAISS call for all rows of query_vecs; returns [(results, scores)] per row.
+        With query_texts (and HYBRID_SEARCH on) each row's dense candidates are fused
+        with BM25 candidates by reciprocal rank fusion and scores are RRF scores.
+        """
+        _, index, meta, sparse = self._current()
+        q = np.ascontiguousarray(query_vecs, dtype="float32").reshape(-1, index.d).copy()
+        faiss.normalize_L2(q)
+        hybrid = HYBRID_SEARCH and sparse is not None and query_texts is not None
+        k = max(top_k, HYBRID_CANDIDATES) if hybrid else top_k
+        with span("index.dense_search"):
+            D, I = index.search(q, k, nprobe=nprobe, ef_search=ef_search)
+        out = []
+        for row, (drow, irow) in enumerate(zip(D, I)):
+            # -1 ids pad results when the index holds fewer than top_k vectors
+            keep = irow >= 0
+            if hybrid:
+                with span("index.bm25_search"):
+                    sparse_uids, _ = sparse.search(query_texts[row], k)
+                uids, drow = reciprocal_rank_fusion([irow[keep], sparse_uids], k=RRF_K, top_k=top_k)
+            else:
+                uids, drow = irow[keep], drow[keep]
+            # only the returned rows are read from the metadata store
+            with span("index.meta_fetch"):
+                rows = meta.get_many(uids)
+            results, scores = [], []
+            for c, d in zip(rows, drow):
+                if c is not None:
+                    results.append(c)
+                    scores.append(d)
+            out.append((results, np.array(scores, dtype="float32")))
+        return out
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+def get_index_manager(index_path=FAISS_INDEX_PATH, meta_path=META_PATH):
+    key = (os.path.abspath(index_path), os.path.abspath(meta_path))
+    with _managers_lock:
+        mgr = _managers.get(key)
+        if mgr is None:
+            mgr = IndexManager(index_path, meta_path)
+            _managers[key] = mgr
+    return mgr
+
+def release_index_manager(index_path=FAISS_INDEX_PATH, meta_path=META_PATH):
+    """Drop the resident index; the next get_index_manager() loads it again. In-flight searches finish on the old copy."""
+    key = (os.path.abspath(index_path), os.path.abspath(meta_path))
+    with _managers_lock:
+        mgr = _managers.pop(key, None)
+    if mgr is not None:
+        mgr.invalidate()
+    return mgr is not None
+
+def search_index(query_vec, top_k=5, index_path=FAISS_INDEX_PATH, meta_path=META_PATH, nprobe=None, ef_search=None, query_text=None):
+    """
+    nprobe (IVF types) / ef_search (HNSW) override the configured defaults for this query;
+    they are ignored by index types they do not apply to.
+    query_text: also run BM25 over the inverted index and fuse both rankings (RRF).
+    """
+    return get_index_manager(index_path, meta_path).search(query_vec, top_k, nprobe=nprobe, ef_search=ef_search, query_text=query_text)
+
+def search_index_batch(query_vecs, top_k=5, index_path=FAISS_INDEX_PATH, meta_path=META_PATH, nprobe=None, ef_search=None, query_texts=None):
+    """search_index for a (n, d) block of queries: [(results, scores)] in row order."""
+    return get_index_manager(index_path, meta_path).search_batch(query_vecs, top_k, nprobe=nprobe, ef_search=ef_search, query_texts=query_texts)
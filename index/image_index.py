@@ -0,0 +1,96 @@
+# index/image_index.py
+"""
+CLIP image index: cropped figures and rasterised pages, kept apart from the text index.
+
+It is the same FAISS + metadata store layout as the text index (index/faiss_index.py),
+at IMAGE_INDEX_PATH / IMAGE_META_PATH, so documents are added, replaced and removed
+the same way, but without BM25 postings or text features: image chunks only carry
+"[Image: ...]" placeholders. Queries are encoded with CLIP's text tower and the image hits are
+fused with the text hits by reciprocal rank fusion.
+"""
+import os
+import numpy as np
+from index.faiss_index import add_document, remove_document, build_faiss_index, indexed_documents, get_index_manager
+from index.sparse_index import reciprocal_rank_fusion
+from config import IMAGE_INDEX_PATH, IMAGE_META_PATH, IMAGE_INDEX_TYPE, IMAGE_TOP_K, RRF_K
+
+IMAGE_TYPES = ("image", "page_image")
+
+def is_image_chunk(chunk):
+    return chunk.get("type") in IMAGE_TYPES
+
+def split_chunks(chunks):
+    """(text chunks, image chunks): image chunks never go to the text index."""
+    text, images = [], []
+    for c in chunks:
+        (images if is_image_chunk(c) else text).append(c)
+    return text, images
+
+def _embed(chunks, progress=None):
+    """CLIP vectors for the image chunks whose file can be read: (vecs, chunks)."""
+    from embeddings.embedder import embed_images
+    chunks = [c for c in chunks if c.get("image_path")]
+    if not chunks:
+        return np.zeros((0, 0), dtype="float32"), []
+    vecs, ok = embed_images([c["image_path"] for c in chunks])
+    if progress:
+        progress(images=len(ok))
+    return vecs, [chunks[i] for i in ok]
+
+def index_document_images(doc_id, chunks, fingerprint=None, replace=True, progress=None,
+                          index_path=IMAGE_INDEX_PATH, meta_path=IMAGE_META_PATH):
+    """
+    Embed a document's image chunks and add them to the image index (replacing the
+    document's earlier images unless replace=False). Returns the number indexed.
+    """
+    vecs, chunks = _embed([c for c in chunks if is_image_chunk(c)], progress)
+    return add_document(vecs, chunks, doc_id, fingerprint=fingerprint, index_path=index_path,
+                        meta_path=meta_path, replace=replace, index_type=IMAGE_INDEX_TYPE, sparse=False)
+
+def remove_document_images(doc_id, index_path=IMAGE_INDEX_PATH, meta_path=IMAGE_META_PATH):
+    return remove_document(doc_id, index_path, meta_path)
+
+def rebuild_image_index(chunks, fingerprints=None, progress=None, index_path=IMAGE_INDEX_PATH, meta_path=IMAGE_META_PATH):
+    """Fresh image index from every image chunk (sync_index(rebuild=True))."""
+    vecs, chunks = _embed([c for c in chunks if is_image_chunk(c)], progress)
+    if not chunks:
+        # nothing to index: drop whatever an earlier build left behind
+        for doc_id in list(indexed_documents(index_path, meta_path)):
+            remove_document(doc_id, index_path, meta_path)
+        return 0
+    build_faiss_index(vecs, chunks, index_path=index_path, meta_path=meta_path,
+                      fingerprints=fingerprints, index_type=IMAGE_INDEX_TYPE, sparse=False)
+    return len(chunks)
+
+def image_index_exists(index_path=IMAGE_INDEX_PATH, meta_path=IMAGE_META_PATH):
+    return os.path.exists(index_path) and get_index_manager(index_path, meta_path).version is not None
+
+def search_images_batch(queries, top_k=IMAGE_TOP_K, query_vecs=None, index_path=IMAGE_INDEX_PATH, meta_path=IMAGE_META_PATH):
+    """
+    Image hits for each query text: [(results, scores)]. query_vecs are CLIP text
+    embeddings (computed here when not given). Empty when there is no image index.
+    """
+    if not queries or top_k <= 0 or not image_index_exists(index_path, meta_path):
+        return [([], np.zeros(0, dtype="float32")) for _ in queries]
+    if query_vecs is None:
+        from embeddings.embedder import embed_clip_texts
+        query_vecs = embed_clip_texts(list(queries))
+    # dense only: the image chunks have no text worth matching
+    return get_index_manager(index_path, meta_path).search_batch(query_vecs, top_k)
+
+def fuse_hits(text_hits, image_hits, k=RRF_K):
+    """
+    Merge (results, scores) from the text and image indexes into one ranking by
+    reciprocal rank fusion. Every text hit is kept; image hits are interleaved by rank.
+    Text hits keep their own scores (the reranker compares them), image hits get the
+    fused score.
+    """
+    text_results, text_scores = text_hits
+    image_results, _ = image_hits
+    if not len(image_results):
+        return text_hits
+    by_uid = {c["uid"]: c for c in list(text_results) + list(image_results)}
+    own = {c["uid"]: float(sc) for c, sc in zip(text_results, text_scores)}
+    uids, scores = reciprocal_rank_fusion([[c["uid"] for c in text_results], [c["uid"] for c in image_results]], k=k)
+    scores = np.array([own.get(int(u), sc) for u, sc in zip(uids, scores)], dtype="float32")
+    return [by_uid[int(u)] for u in uids], scores
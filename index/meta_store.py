@@ -0,0 +1,225 @@
+# index/meta_store.py
+import os, json, uuid
+import numpy as np
+
+# one row per chunk, sorted by uid so lookups are a searchsorted on the mmapped array.
+# kw is the index-time keyword feature (qa.rerank.keyword_score); NaN when unknown.
+ROW_DTYPE = np.dtype([("uid", "<i8"), ("off", "<i8"), ("len", "<i4"), ("doc", "<i4"), ("kw", "<f4")])
+FEATURES = ("kw_score",)
+
+def _json_path(meta_path):
+    return meta_path + ".json"
+
+def _replace_json(meta_path, manifest):
+    path = _json_path(meta_path)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+def _write_rows(meta_path, rows):
+    name = f"{os.path.basename(meta_path)}.{uuid.uuid4().hex[:12]}.idx.npy"
+    path = os.path.join(os.path.dirname(meta_path), name)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, np.sort(rows, order="uid"))
+    os.replace(tmp, path)
+    return name
+
+def _upgrade_rows(rows):
+    """Rows written before the kw column existed: copy into ROW_DTYPE with kw = NaN."""
+    if rows.dtype == ROW_DTYPE:
+        return rows
+    out = np.zeros(len(rows), dtype=ROW_DTYPE)
+    out["kw"] = np.nan
+    for name in rows.dtype.names:
+        out[name] = rows[name]
+    return out
+
+def _append_records(dat_path, chunks, doc_ords, rows_out):
+    """
+    Append JSON records to the data file; fills rows_out (ROW_DTYPE) with their offsets.
+    Feature keys are stored in their row column, not in the record.
+    """
+    with open(dat_path, "ab") as f:
+        off = f.tell()
+        for i, c in enumerate(chunks):
+            kw = c.get("kw_score")
+            rec = {k: v for k, v in c.items() if k not in FEATURES}
+            rec = json.dumps(rec, ensure_ascii=False, default=str).encode("utf-8")
+            f.write(rec)
+            rows_out[i] = (c["uid"], off, len(rec), doc_ords[c.get("doc_id")], np.nan if kw is None else kw)
+            off += len(rec)
+
+def exists(meta_path):
+    return os.path.exists(_json_path(meta_path))
+
+def read_docs(meta_path):
+    """{doc_id: fingerprint} from the manifest alone ({} when there is no store)."""
+    try:
+        with open(_json_path(meta_path)) as f:
+            docs = json.load(f)["docs"]
+    except FileNotFoundError:
+        return {}
+    return {d: v["fp"] for d, v in docs.items()}
+
+
+class MetaStore:
+    """
+    Read side of the chunk metadata store that sits next to the FAISS index.
+
+    <meta>.json       manifest: docs {doc_id: {"fp", "ord"}}, index info, current file names
+    <meta>.<gen>.dat  chunk dicts as JSON records written back to back
+    <meta>.<gen>.idx.npy  ROW_DTYPE rows (uid, offset, length, doc ordinal), opened with mmap
+
+    Opening costs the same regardless of corpus size and a lookup reads only the
+    records it returns. Writers never modify files a reader has open: they append to
+    the .dat and publish a new .idx/.json, so an open MetaStore stays consistent.
+    """
+
+    def __init__(self, meta_path):
+        with open(_json_path(meta_path)) as f:
+            self.manifest = json.load(f)
+        base = os.path.dirname(meta_path)
+        self.rows = np.load(os.path.join(base, self.manifest["idx"]), mmap_mode="r")
+        self._fd = os.open(os.path.join(base, self.manifest["dat"]), os.O_RDONLY)
+        self.info = self.manifest.get("info", {})
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __del__(self):
+        try:
+            os.close(self._fd)
+        except Exception:
+            pass
+
+    @property
+    def docs(self):
+        """{doc_id: fingerprint}"""
+        return {d: v["fp"] for d, v in self.manifest["docs"].items()}
+
+    def positions(self, uids):
+        """Row positions for uids (-1 where missing)."""
+        uids = np.asarray(uids, dtype="int64")
+        col = self.rows["uid"]
+        if not len(col):
+            return np.full(len(uids), -1, dtype="int64")
+        pos = np.minimum(np.searchsorted(col, uids), len(col) - 1)
+        return np.where(col[pos] == uids, pos, -1)
+
+    def get_many(self, uids):
+        """Chunk dicts for uids, in order (None for uids not in the store). Stored features
+        are added as keys ("kw_score") when known."""
+        has_kw = "kw" in self.rows.dtype.names
+        out = []
+        for p in self.positions(uids):
+            if p < 0:
+                out.append(None)
+                continue
+            r = self.rows[p]
+            c = json.loads(os.pread(self._fd, int(r["len"]), int(r["off"])))
+            if has_kw and not np.isnan(r["kw"]):
+                c["kw_score"] = float(r["kw"])
+            out.append(c)
+        return out
+
+    def doc_uids(self, doc_id):
+        d = self.manifest["docs"].get(doc_id)
+        if d is None:
+            return np.zeros(0, dtype="int64")
+        return np.asarray(self.rows["uid"][self.rows["doc"] == d["ord"]])
+
+
+def write_meta_store(meta_path, chunks, docs, info):
+    """
+    Write a fresh (compacted) store. chunks must carry "uid"; docs is {doc_id: fingerprint}.
+    """
+    os.makedirs(os.path.dirname(meta_path) or ".", exist_ok=True)
+    old = None
+    if exists(meta_path):
+        with open(_json_path(meta_path)) as f:
+            old = json.load(f)
+    doc_ords = {}
+    for c in chunks:
+        doc_ords.setdefault(c.get("doc_id"), len(doc_ords))
+    for d in docs:
+        doc_ords.setdefault(d, len(doc_ords))
+    dat = f"{os.path.basename(meta_path)}.{uuid.uuid4().hex[:12]}.dat"
+    rows = np.zeros(len(chunks), dtype=ROW_DTYPE)
+    _append_records(os.path.join(os.path.dirname(meta_path), dat), chunks, doc_ords, rows)
+    manifest = {
+        "idx": _write_rows(meta_path, rows),
+        "dat": dat,
+        "docs": {d: {"fp": docs.get(d), "ord": o} for d, o in doc_ords.items()},
+        "next_ord": len(doc_ords),
+        "info": info,
+    }
+    _replace_json(meta_path, manifest)
+    _cleanup(meta_path, old, manifest)
+
+def update_meta_store(meta_path, add_chunks=(), set_docs=None, remove_docs=(), info=None):
+    """
+    Incremental update: drop every row of remove_docs, append add_chunks, record
+    fingerprints from set_docs ({doc_id: fingerprint}). Appends only the new records;
+    the data file is compacted once more than half of it is dead.
+    """
+    if not exists(meta_path):
+        docs = dict(set_docs or {})
+        return write_meta_store(meta_path, list(add_chunks), docs, info or {})
+    base = os.path.dirname(meta_path)
+    with open(_json_path(meta_path)) as f:
+        old = json.load(f)
+    manifest = json.loads(json.dumps(old))
+    rows = _upgrade_rows(np.load(os.path.join(base, old["idx"])))
+    drop_ords = [manifest["docs"][d]["ord"] for d in remove_docs if d in manifest["docs"]]
+    if drop_ords:
+        rows = rows[~np.isin(rows["doc"], drop_ords)]
+    for d in remove_docs:
+        manifest["docs"].pop(d, None)
+    for d, fp in (set_docs or {}).items():
+        if d not in manifest["docs"]:
+            manifest["docs"][d] = {"fp": fp, "ord": manifest["next_ord"]}
+            manifest["next_ord"] += 1
+        manifest["docs"][d]["fp"] = fp
+    add_chunks = list(add_chunks)
+    for c in add_chunks:
+        if c.get("doc_id") not in manifest["docs"]:
+            manifest["docs"][c.get("doc_id")] = {"fp": None, "ord": manifest["next_ord"]}
+            manifest["next_ord"] += 1
+    if info:
+        manifest["info"].update(info)
+
+    dat_path = os.path.join(base, manifest["dat"])
+    live = int(rows["len"].sum())
+    if os.path.getsize(dat_path) > 2 * max(live, 1):
+        # compact: too much of the data file belongs to deleted documents
+        store = MetaStore(meta_path)
+        kept = [c for c in store.get_many(rows["uid"]) if c is not None]
+        docs = {d: v["fp"] for d, v in manifest["docs"].items()}
+        return write_meta_store(meta_path, kept + add_chunks, docs, manifest["info"])
+
+    new_rows = np.zeros(len(add_chunks), dtype=ROW_DTYPE)
+    ords = {d: v["ord"] for d, v in manifest["docs"].items()}
+    _append_records(dat_path, add_chunks, ords, new_rows)
+    manifest["idx"] = _write_rows(meta_path, np.concatenate([rows, new_rows]))
+    _replace_json(meta_path, manifest)
+    _cleanup(meta_path, old, manifest)
+
+def _cleanup(meta_path, old, new):
+    """
+    Delete store files from generations before `old`. The previous generation is kept
+    so a reader that has just read the old manifest can still open its files; readers
+    that already have files open keep them alive anyway (POSIX unlink semantics).
+    """
+    base = os.path.dirname(meta_path) or "."
+    prefix = os.path.basename(meta_path) + "."
+    keep = {new.get("idx"), new.get("dat")}
+    if old:
+        keep |= {old.get("idx"), old.get("dat")}
+    for name in os.listdir(base):
+        if name.startswith(prefix) and (name.endswith(".idx.npy") or name.endswith(".dat")) and name not in keep:
+            try:
+                os.remove(os.path.join(base, name))
+            except OSError:
+                pass
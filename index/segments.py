@@ -0,0 +1,49 @@
+# index/segments.py
+"""
+Tombstones of the segmented FAISS index (index/faiss_index.py) and BM25 index
+(index/sparse_index.py).
+
+Both write every add as an append-only segment, numbered by a per-index counter
+(the base is segment 0). Deleting or replacing chunks leaves the segments that hold
+them as they are: a tombstone (uid, seq) marks every copy of uid in a segment
+numbered below seq as dead, so a chunk re-added in segment seq stays live. Merging
+segments drops the dead copies; once everything is merged into the base the
+tombstones are cleared.
+"""
+import os, uuid
+import numpy as np
+
+TOMB_DTYPE = np.dtype([("uid", "<i8"), ("seq", "<i8")])
+
+def add_tombstones(tomb, uids, seq):
+    """tomb plus (uid, seq) for uids; one entry per uid, the highest seq wins."""
+    uids = np.unique(np.asarray(uids, dtype="int64"))
+    if not len(uids):
+        return tomb
+    new = np.zeros(len(uids), dtype=TOMB_DTYPE)
+    new["uid"], new["seq"] = uids, seq
+    both = np.concatenate([tomb, new])
+    # sorted by uid, then seq: the last entry of each uid is its highest seq
+    both = both[np.lexsort((both["seq"], both["uid"]))]
+    last = np.r_[both["uid"][1:] != both["uid"][:-1], True]
+    return both[last]
+
+def dead_in(tomb, seq):
+    """Sorted uids whose copies in segment seq are dead."""
+    return np.asarray(tomb["uid"][tomb["seq"] > seq])
+
+def write_tombstones(prefix, tomb):
+    """Write a new tombstone file next to prefix; returns its name (None when empty)."""
+    if not len(tomb):
+        return None
+    name = f"{os.path.basename(prefix)}.{uuid.uuid4().hex[:12]}.tomb.npy"
+    path = os.path.join(os.path.dirname(prefix), name)
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, tomb)
+    os.replace(path + ".tmp", path)
+    return name
+
+def read_tombstones(prefix, name):
+    if not name:
+        return np.zeros(0, dtype=TOMB_DTYPE)
+    return np.load(os.path.join(os.path.dirname(prefix), name))
@@ -0,0 +1,313 @@
+# index/sparse_index.py
+import os, re, json, math, uuid, shutil
+from collections import Counter
+import numpy as np
+from index.segments import add_tombstones, dead_in, read_tombstones, write_tombstones
+from config import BM25_K1, BM25_B, RRF_K
+
+# words, and numbers with their thousands separators / decimals kept together ("26,044", "32.1")
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+_MAX_TOKEN = 40
+_STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were which with
+""".split())
+
+def tokenize(text):
+    """Lowercased terms; "26,044" is also indexed as "26044" so either spelling matches."""
+    out = []
+    for t in _TOKEN_RE.findall((text or "").lower()):
+        if t in _STOPWORDS or len(t) > _MAX_TOKEN:
+            continue
+        out.append(t)
+        if "," in t and t[0].isdigit():
+            out.append(t.replace(",", ""))
+    return out
+
+def _json_path(prefix):
+    return prefix + ".json"
+
+def exists(prefix):
+    return os.path.exists(_json_path(prefix))
+
+
+class _Segment:
+    """One generation directory: postings of the chunks it was written with (mmapped)."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, "vocab.json")) as f:
+            self.terms = json.load(f)
+        self.vocab = {t: i for i, t in enumerate(self.terms)}
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode="r")
+        self.ptr = load("ptr.npy")
+        self.post_doc = load("post_doc.npy")
+        self.post_tf = load("post_tf.npy")
+        self.doc_uid = load("doc_uid.npy")
+        self.doc_len = load("doc_len.npy")
+
+    def postings(self, term, dead):
+        """(uids, tfs, doc lengths) of term's live postings, or None."""
+        i = self.vocab.get(term)
+        if i is None:
+            return None
+        lo, hi = int(self.ptr[i]), int(self.ptr[i + 1])
+        docs = np.asarray(self.post_doc[lo:hi])
+        uids = np.asarray(self.doc_uid[docs])
+        tf = np.asarray(self.post_tf[lo:hi], dtype="float32")
+        dl = np.asarray(self.doc_len[docs], dtype="float32")
+        if len(dead):
+            keep = ~np.isin(uids, dead)
+            uids, tf, dl = uids[keep], tf[keep], dl[keep]
+        return uids, tf, dl
+
+    def rows(self, dead):
+        """Every live posting as (term ids into self.terms, uids, tfs) plus the live doc table."""
+        ptr = np.asarray(self.ptr)
+        tid = np.repeat(np.arange(len(self.terms), dtype="int64"), np.diff(ptr))
+        uid = np.asarray(self.doc_uid)[np.asarray(self.post_doc)]
+        tf = np.asarray(self.post_tf)
+        d_uid, d_len = np.asarray(self.doc_uid), np.asarray(self.doc_len)
+        if len(dead):
+            keep = ~np.isin(uid, dead)
+            tid, uid, tf = tid[keep], uid[keep], tf[keep]
+            dkeep = ~np.isin(d_uid, dead)
+            d_uid, d_len = d_uid[dkeep], d_len[dkeep]
+        return tid, uid, tf, d_uid, d_len
+
+
+class SparseIndex:
+    """
+    BM25 inverted index over chunk text, keyed by the same uids as the FAISS index.
+
+    <prefix>.json          manifest: base dir, delta dirs, tombstones, live n_docs / avgdl
+    <prefix>.<gen>/vocab.json   sorted term list (term id = position)
+    <prefix>.<gen>/ptr.npy      postings of term i are [ptr[i], ptr[i+1])
+    <prefix>.<gen>/post_doc.npy, post_tf.npy   doc row + term frequency per posting
+    <prefix>.<gen>/doc_uid.npy, doc_len.npy    doc table sorted by uid
+
+    The base generation is segment 0; update_sparse_index appends each add as a delta
+    generation and records deletions as tombstones (index/segments.py), and
+    merge_sparse_index folds them back. Statistics are those of the live chunks, so
+    scores match a fresh build. A query only touches the postings of its own terms in
+    each segment. Arrays are opened with mmap; segments is {dir: _Segment} of an
+    earlier generation whose unchanged directories are reused instead of reopened.
+    """
+
+    def __init__(self, prefix, segments=None):
+        with open(_json_path(prefix)) as f:
+            self.manifest = json.load(f)
+        base = os.path.dirname(prefix)
+        segments = segments or {}
+        self.tomb = read_tombstones(prefix, self.manifest.get("tomb"))
+        self.segments = []  # (seq, dir, _Segment, dead uids)
+        for seq, d in [(0, self.manifest["dir"])] + [(x["seq"], x["dir"]) for x in self.manifest.get("deltas", [])]:
+            seg = segments.get(d) or _Segment(os.path.join(base, d))
+            self.segments.append((seq, d, seg, dead_in(self.tomb, seq)))
+        self.n_docs = self.manifest["n_docs"]
+        self.avgdl = self.manifest["avgdl"] or 1.0
+
+    def __len__(self):
+        return self.n_docs
+
+    @property
+    def loaded(self):
+        return {d: seg for _, d, seg, _ in self.segments}
+
+    def search(self, text, top_k=50, k1=BM25_K1, b=BM25_B):
+        """(uids, scores) of the top_k chunks by BM25, best first."""
+        rows, contrib = [], []
+        for t in set(tokenize(text)):
+            parts = [p for p in (seg.postings(t, dead) for _, _, seg, dead in self.segments) if p is not None]
+            if not parts:
+                continue
+            uids, tf, dl = (np.concatenate(x) for x in zip(*parts))
+            df = len(uids)
+            if not df:
+                continue
+            idf = math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            norm = k1 * (1.0 - b + b * dl / self.avgdl)
+            rows.append(uids)
+            contrib.append(idf * tf * (k1 + 1.0) / (tf + norm))
+        if not rows:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        uniq, inv = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(inv, weights=np.concatenate(contrib)).astype("float32")
+        if len(scores) > top_k:
+            top = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return uniq[top], scores[top]
+
+    def live_lengths(self, uids):
+        """(uids that have a live copy, their doc lengths)."""
+        todo = np.unique(np.asarray(uids, dtype="int64"))
+        found, lens = [], []
+        # a live uid sits in exactly one segment; the newest are looked at first
+        for _, _, seg, dead in reversed(self.segments):
+            if not len(todo):
+                break
+            col = np.asarray(seg.doc_uid)
+            if not len(col):
+                continue
+            pos = np.minimum(np.searchsorted(col, todo), len(col) - 1)
+            hit = (col[pos] == todo) & ~np.isin(todo, dead)
+            found.append(todo[hit])
+            lens.append(np.asarray(seg.doc_len)[pos[hit]])
+            todo = todo[~hit]
+        if not found:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="int64")
+        return np.concatenate(found), np.concatenate(lens).astype("int64")
+
+
+def _chunk_postings(chunks):
+    """Posting rows (terms, uids, tfs) plus the doc table (uids, lengths) for chunks carrying "uid"."""
+    terms, uids, tfs, doc_uid, doc_len = [], [], [], [], []
+    for c in chunks:
+        toks = tokenize(c.get("text", ""))
+        counts = Counter(toks)
+        terms.extend(counts.keys())
+        tfs.extend(counts.values())
+        uids.extend([c["uid"]] * len(counts))
+        doc_uid.append(c["uid"])
+        doc_len.append(len(toks))
+    return (np.array(terms, dtype=str), np.array(uids, dtype="int64"), np.array(tfs, dtype="int32"),
+            np.array(doc_uid, dtype="int64"), np.array(doc_len, dtype="int32"))
+
+def _write_generation(prefix, vocab, term_id, uid, tf, doc_uid, doc_len):
+    """Write one generation directory from posting rows (term_id indexes vocab); returns its name."""
+    # drop terms with no postings left, then lay postings out term by term
+    used, term_id = np.unique(term_id, return_inverse=True)
+    vocab = vocab[used] if len(used) else np.zeros(0, dtype=str)
+    d_order = np.argsort(doc_uid, kind="stable")
+    doc_uid, doc_len = doc_uid[d_order], doc_len[d_order]
+    post_doc = np.searchsorted(doc_uid, uid).astype("int32")
+    order = np.lexsort((post_doc, term_id))
+    term_id, post_doc, tf = term_id[order], post_doc[order], tf[order]
+    ptr = np.zeros(len(vocab) + 1, dtype="int64")
+    ptr[1:] = np.cumsum(np.bincount(term_id, minlength=len(vocab)))
+
+    base = os.path.dirname(prefix) or "."
+    os.makedirs(base, exist_ok=True)
+    name = f"{os.path.basename(prefix)}.{uuid.uuid4().hex[:12]}"
+    tmp = os.path.join(base, name + ".tmp")
+    os.makedirs(tmp)
+    with open(os.path.join(tmp, "vocab.json"), "w") as f:
+        json.dump(vocab.tolist(), f, ensure_ascii=False)
+    for fname, arr in (("ptr.npy", ptr), ("post_doc.npy", post_doc), ("post_tf.npy", tf.astype("int32")),
+                       ("doc_uid.npy", doc_uid), ("doc_len.npy", doc_len.astype("int32"))):
+        np.save(os.path.join(tmp, fname), arr)
+    os.replace(tmp, os.path.join(base, name))
+    return name
+
+def _chunks_generation(prefix, chunks):
+    """Generation for chunk dicts: (name, n_docs, total length)."""
+    terms, uids, tfs, doc_uid, doc_len = _chunk_postings(chunks)
+    vocab, term_id = np.unique(terms, return_inverse=True)
+    name = _write_generation(prefix, vocab, term_id.astype("int64"), uids, tfs, doc_uid, doc_len)
+    return name, len(doc_uid), int(doc_len.sum())
+
+def _publish(prefix, manifest):
+    old = None
+    if exists(prefix):
+        with open(_json_path(prefix)) as f:
+            old = json.load(f)
+    # indexes written before deltas existed only record avgdl
+    manifest.setdefault("sum_len", round(manifest.get("avgdl", 0.0) * manifest["n_docs"]))
+    manifest["avgdl"] = manifest["sum_len"] / manifest["n_docs"] if manifest["n_docs"] else 0.0
+    path = _json_path(prefix)
+    with open(f"{path}.tmp.{os.getpid()}", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp.{os.getpid()}", path)
+    _cleanup(prefix, old, manifest)
+
+def write_sparse_index(prefix, chunks):
+    """Build a fresh sparse index from chunk dicts (each carrying "uid")."""
+    name, n, total = _chunks_generation(prefix, chunks)
+    _publish(prefix, {"dir": name, "deltas": [], "tomb": None, "next_seq": 1, "n_docs": n, "sum_len": total})
+
+def update_sparse_index(prefix, add_chunks=(), remove_uids=()):
+    """
+    Drop the postings of remove_uids (and of re-added uids), add add_chunks. Writes
+    add_chunks as a new delta generation and the dropped uids as tombstones: the cost
+    is that of the change, not of the index. merge_sparse_index folds deltas back.
+    """
+    add_chunks = list(add_chunks)
+    if not exists(prefix):
+        return write_sparse_index(prefix, add_chunks)
+    index = SparseIndex(prefix)
+    manifest = dict(index.manifest)
+    seq = manifest.get("next_seq", 1)
+    n_docs, sum_len = manifest["n_docs"], manifest.get("sum_len", round(manifest["avgdl"] * manifest["n_docs"]))
+    deltas = list(manifest.get("deltas", []))
+    if add_chunks:
+        name, n, total = _chunks_generation(prefix, add_chunks)
+        deltas.append({"dir": name, "seq": seq})
+        n_docs, sum_len = n_docs + n, sum_len + total
+    drop = np.asarray(list(remove_uids) + [c["uid"] for c in add_chunks], dtype="int64")
+    dead, dead_len = index.live_lengths(drop)
+    tomb = manifest.get("tomb")
+    if len(dead):
+        tomb = write_tombstones(prefix, add_tombstones(index.tomb, dead, seq))
+        n_docs, sum_len = n_docs - len(dead), sum_len - int(dead_len.sum())
+    manifest.update(deltas=deltas, tomb=tomb, next_seq=seq + 1, n_docs=n_docs, sum_len=sum_len)
+    _publish(prefix, manifest)
+
+def merge_sparse_index(prefix, full=True):
+    """
+    Fold the delta generations into the base (full) or into one delta generation,
+    dropping dead postings. Only the merged generations are read.
+    """
+    if not exists(prefix):
+        return
+    index = SparseIndex(prefix)
+    manifest = dict(index.manifest)
+    merged = index.segments if full else index.segments[1:]
+    if not merged or (not full and len(merged) == 1):
+        return
+    parts = [(seg.terms, seg.rows(dead)) for _, _, seg, dead in merged]
+    vocab = np.unique(np.concatenate([np.array(t, dtype=str) for t, _ in parts] + [np.zeros(0, dtype=str)]))
+    term_id = np.concatenate([np.searchsorted(vocab, np.array(t, dtype=str))[r[0]] for t, r in parts]).astype("int64")
+    uid, tf, d_uid, d_len = (np.concatenate([r[i] for _, r in parts]) for i in range(1, 5))
+    name = _write_generation(prefix, vocab, term_id, uid, tf, d_uid, d_len)
+    if full:
+        manifest.update(dir=name, deltas=[], tomb=None)
+    else:
+        manifest["deltas"] = [{"dir": name, "seq": max(seq for seq, _, _, _ in merged)}]
+    _publish(prefix, manifest)
+
+def _cleanup(prefix, old, new):
+    """Delete generations older than the previous one (same policy as meta_store._cleanup)."""
+    base = os.path.dirname(prefix) or "."
+    head = os.path.basename(prefix) + "."
+    keep = set()
+    for m in (new, old):
+        if m:
+            keep |= {m.get("dir"), m.get("tomb")} | {d["dir"] for d in m.get("deltas", [])}
+    for name in os.listdir(base):
+        path = os.path.join(base, name)
+        if not name.startswith(head) or name in keep:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name.endswith(".tomb.npy"):
+            os.remove(path)
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K, top_k=None):
+    """
+    Fuse ranked uid lists: score(uid) = sum over lists of 1 / (k + rank), rank from 1,
+    scaled so that a uid ranked first in every list scores 1.0 (scores are in (0, 1],
+    on the same scale as the cosine scores of a dense-only search).
+    Returns (uids, scores) best first; ties keep first-seen order.
+    """
+    fused = {}
+    scale = (k + 1) / max(len(rankings), 1)
+    for ranking in rankings:
+        for rank, uid in enumerate(ranking, 1):
+            uid = int(uid)
+            fused[uid] = fused.get(uid, 0.0) + scale / (k + rank)
+    items = sorted(fused.items(), key=lambda x: x[1], reverse=True)
+    if top_k is not None:
+        items = items[:top_k]
+    return (np.array([u for u, _ in items], dtype="int64"),
+            np.array([s for _, s in items], dtype="float32"))
@@ -1,9 +1,13 @@
-import easyocr
+import hashlib, os, sqlite3, threading
+import numpy as np
+from config import OCR_CACHE_PATH, OCR_BATCH_SIZE
+from serving.client import get_model_client
 _reader = None
 
 def _get_reader():
     global _reader
     if _reader is None:
+        import easyocr  # pulls in torch + opencv; only needed once a page has to be OCR'd
         # english only; gpu=False to run on CPU
         _reader = easyocr.Reader(['en'], gpu=False)
     return _reader
@@ -16,3 +20,99 @@ def ocr_image(path):
     except Exception as e:
         print(f"OCR failed on {path}: {e}")
         return ""
+
+def image_key(arr):
+    """Content hash of a rasterised page (shape + pixels)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(arr.shape).encode("ascii"))
+    h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+class OcrCache:
+    """Persistent page-image hash -> OCR text map (sqlite, safe to share between processes)."""
+
+    def __init__(self, path=OCR_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ocr (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        with self._lock:
+            out = {}
+            uniq = list(set(keys))
+            # stay under sqlite's bound-parameter limit
+            for i in range(0, len(uniq), 500):
+                part = uniq[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, text FROM ocr WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                out.update(rows)
+        return out
+
+    def put_many(self, items):
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO ocr (key, text) VALUES (?, ?)", items)
+            self._conn.commit()
+
+_cache = None
+
+def get_ocr_cache():
+    global _cache
+    if _cache is None:
+        _cache = OcrCache()
+    return _cache
+
+def _ocr_batch(arrays, batch_size):
+    client = get_model_client()
+    if client is not None:
+        # only cache misses travel to the model server; the cache is shared on disk
+        return client.call("ocr_batch", arrays, batch_size)
+    reader = _get_reader()
+    # None marks a failed batch: reported as "" but never cached
+    out = [None] * len(arrays)
+    # readtext_batched needs equal-sized inputs; pages of one PDF almost always are
+    by_shape = {}
+    for i, a in enumerate(arrays):
+        by_shape.setdefault(a.shape, []).append(i)
+    for idxs in by_shape.values():
+        try:
+            results = reader.readtext_batched([arrays[i] for i in idxs], batch_size=batch_size, detail=0)
+        except Exception as e:
+            print(f"Batched OCR failed on {len(idxs)} pages: {e}")
+            continue
+        for i, lines in zip(idxs, results):
+            out[i] = "\n".join(lines)
+    return out
+
+def ocr_arrays(arrays, batch_size=OCR_BATCH_SIZE, use_cache=True):
+    """
+    OCR in-memory page rasters (HxWx3 uint8 arrays) in batches.
+    Pages whose pixels were OCR'd before (same scan re-uploaded, shared cover or
+    exhibit pages) come from the persistent cache and skip EasyOCR entirely.
+    Returns one text per array.
+    """
+    if not arrays:
+        return []
+    if not use_cache:
+        return [t or "" for t in _ocr_batch(arrays, batch_size)]
+    cache = get_ocr_cache()
+    keys = [image_key(a) for a in arrays]
+    known = cache.get_many(keys)
+    miss = {}
+    for i, k in enumerate(keys):
+        if k not in known:
+            miss.setdefault(k, i)
+    cache.hits += len(keys) - sum(1 for k in keys if k not in known)
+    cache.misses += len(miss)
+    if miss:
+        texts = _ocr_batch([arrays[i] for i in miss.values()], batch_size)
+        new = dict(zip(miss.keys(), texts))
+        cache.put_many([(k, t) for k, t in new.items() if t is not None])
+        known.update(new)
+    return [known[k] or "" for k in keys]
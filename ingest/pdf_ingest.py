@@ -1,39 +1,167 @@
 import pdfplumber
-import os, io
+import os, io, time, threading
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
-from config import RAW_DIR
-from ingest.ocr import ocr_image
+import numpy as np
+from config import RAW_DIR, INGEST_WORKERS, INGEST_MP_CONTEXT, INGEST_PARALLEL_MIN_PAGES, OCR_BATCH_SIZE, SAVE_PAGE_RASTERS, INDEX_PAGE_IMAGES
+from ingest.ocr import ocr_arrays
+from metrics import span, record
 
 os.makedirs(RAW_DIR, exist_ok=True)
 
-def ingest_pdf(path, save_images=True):
+# reused across calls so a long-running server pays worker start-up once
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    # concurrent upload jobs must share one pool rather than each starting (and leaking) one
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context(INGEST_MP_CONTEXT))
+            _pool_workers = workers
+        return _pool
+
+def _resolve_workers(workers):
+    if workers is None:
+        workers = INGEST_WORKERS
+    return workers if workers > 0 else (os.cpu_count() or 1)
+
+def _ingest_page(page, i, filename, save_images, image_dir=RAW_DIR):
+    # stage times travel with the page: this may run in a pool worker, whose histograms
+    # nobody scrapes, so the parent records them (_record_timings)
+    timings = []
+    t0 = time.perf_counter()
+    text = page.extract_text() or ""
+    timings.append(("ingest.parse", time.perf_counter() - t0))
+    raster = None
+    page_image = None
+    # if page has very little text, rasterize it for OCR; the OCR itself runs batched
+    # in the parent process (_with_ocr). The PNG is only written when asked for, or when
+    # the page goes to the image index (figure-only pages are searchable through CLIP)
+    if len(text.strip()) < 20:
+        t0 = time.perf_counter()
+        im = page.to_image(resolution=150)
+        if SAVE_PAGE_RASTERS or (save_images and INDEX_PAGE_IMAGES):
+            page_image = os.path.join(image_dir, f"{filename}_page_{i}.png")
+            im.save(page_image, format="PNG")
+        raster = np.asarray(im.original.convert("RGB"))
+        timings.append(("ingest.rasterize", time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    tables = [t for t in page.extract_tables() if t]
+    timings.append(("ingest.tables", time.perf_counter() - t0))
+    images = []
+    if save_images and page.images:
+        t0 = time.perf_counter()
+        for j, img in enumerate(page.images):
+            try:
+                bbox = (img["x0"], img["top"], img["x1"], img["bottom"])
+                cropped = page.within_bbox(bbox).to_image(resolution=150)
+                img_path = os.path.join(image_dir, f"{filename}_page_{i}_img_{j}.png")
+                cropped.save(img_path, format="PNG")
+                images.append(img_path)
+            except Exception:
+                continue
+        timings.append(("ingest.images", time.perf_counter() - t0))
+    return {"doc_id": filename, "page": i, "text": text, "tables": tables, "images": images, "raster": raster,
+            "page_image": page_image if save_images and INDEX_PAGE_IMAGES else None, "timings": timings}
+
+def _iter_page_range(path, start, end, save_images, image_dir=RAW_DIR):
+    filename = os.path.basename(path)
+    with pdfplumber.open(path) as pdf:
+        for i in range(start, end + 1):
+            page = pdf.pages[i - 1]
+            yield _ingest_page(page, i, filename, save_images, image_dir)
+            # drop pdfplumber's per-page object cache; long reports otherwise grow without bound
+            page.flush_cache()
+
+def _ingest_page_range(path, start, end, save_images, image_dir=RAW_DIR):
+    """Worker entry point: ingest pages start..end (1-based, inclusive) of one PDF."""
+    return list(_iter_page_range(path, start, end, save_images, image_dir))
+
+def _page_ranges(n_pages, workers):
+    # a few ranges per worker so one slow (OCR-heavy) range doesn't leave cores idle
+    size = max(1, -(-n_pages // (workers * 4)))
+    return [(s, min(s + size - 1, n_pages)) for s in range(1, n_pages + 1, size)]
+
+def _ocr_flush(buf):
+    idx = [k for k, p in enumerate(buf) if p.get("raster") is not None]
+    with span("ingest.ocr"):
+        texts = ocr_arrays([buf[k]["raster"] for k in idx])
+    for k, t in zip(idx, texts):
+        buf[k]["text"] = (buf[k]["text"] + "\n" + t).strip()
+    for p in buf:
+        p.pop("raster", None)
+        yield p
+
+def _with_ocr(pages, batch_size=OCR_BATCH_SIZE):
     """
-    Returns list of dicts: [{"doc_id": filename, "page": i, "text": text, "tables": tables, "images": [paths]}]
+    Fill in OCR text for rasterised pages, batch_size rasters per EasyOCR call, while
+    keeping page order. Pages ahead of the first pending raster pass straight through;
+    the buffer is also flushed after 4 * batch_size pages to bound memory.
     """
-    docs = []
-    filename = os.path.basename(path)
+    buf, n_rasters = [], 0
+    for p in pages:
+        if not buf and p.get("raster") is None:
+            p.pop("raster", None)
+            yield p
+            continue
+        buf.append(p)
+        n_rasters += p.get("raster") is not None
+        if n_rasters >= batch_size or len(buf) >= 4 * batch_size:
+            yield from _ocr_flush(buf)
+            buf, n_rasters = [], 0
+    if buf:
+        yield from _ocr_flush(buf)
+
+def _record_timings(pages):
+    for p in pages:
+        for stage, seconds in p.pop("timings", ()):
+            record(stage, seconds)
+        yield p
+
+def _iter_parsed_pages(path, save_images, workers, max_pending, image_dir=RAW_DIR):
+    with pdfplumber.open(path) as pdf:
+        n_pages = len(pdf.pages)
+    if workers <= 1 or n_pages < INGEST_PARALLEL_MIN_PAGES:
+        if n_pages:
+            yield from _iter_page_range(path, 1, n_pages, save_images, image_dir)
+        return
+    pool = _get_pool(workers)
+    max_pending = max_pending or 2 * workers
+    pending = deque()
+    for s, e in _page_ranges(n_pages, workers):
+        pending.append(pool.submit(_ingest_page_range, path, s, e, save_images, image_dir))
+        if len(pending) >= max_pending:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+def iter_pdf_pages(path, save_images=True, workers=None, max_pending=None, image_dir=RAW_DIR):
+    """
+    Yield page dicts (same shape as ingest_pdf) in page order as soon as they are parsed.
+    With a process pool at most max_pending page ranges (default 2 per worker) are in
+    flight, so a slow consumer holds back parsing instead of buffering the whole PDF.
+    image_dir: where figure crops and page PNGs are written (per collection).
+    """
+    workers = _resolve_workers(workers)
+    os.makedirs(image_dir, exist_ok=True)
+    yield from _with_ocr(_record_timings(_iter_parsed_pages(path, save_images, workers, max_pending, image_dir)))
+
+def pdf_page_count(path):
     with pdfplumber.open(path) as pdf:
-        for i, page in enumerate(pdf.pages, start=1):
-            text = page.extract_text() or ""
-            # if page has very little text, run OCR on a rasterized page
-            if len(text.strip()) < 20:
-                # dump a page image and OCR it
-                im = page.to_image(resolution=150)
-                img_path = os.path.join(RAW_DIR, f"{filename}_page_{i}.png")
-                im.save(img_path, format="PNG")
-                ocr_text = ocr_image(img_path)
-                text = (text + "\n" + ocr_text).strip()
-            tables = [t for t in page.extract_tables() if t]
-            images = []
-            if save_images and page.images:
-                for j, img in enumerate(page.images):
-                    try:
-                        bbox = (img["x0"], img["top"], img["x1"], img["bottom"])
-                        cropped = page.within_bbox(bbox).to_image(resolution=150)
-                        img_path = os.path.join(RAW_DIR, f"{filename}_page_{i}_img_{j}.png")
-                        cropped.save(img_path, format="PNG")
-                        images.append(img_path)
-                    except Exception:
-                        continue
-            docs.append({"doc_id": filename, "page": i, "text": text, "tables": tables, "images": images})
-    return docs
+        return len(pdf.pages)
+
+def ingest_pdf(path, save_images=True, workers=None):
+    """
+    Returns list of dicts: [{"doc_id": filename, "page": i, "text": text, "tables": tables, "images": [paths],
+    "page_image": raster path of a low-text page or None}]
+    workers: processes to spread page ranges over (None -> INGEST_WORKERS, 0 -> all cores,
+    1 -> in-process). Pages come back in page order either way.
+    """
+    return list(iter_pdf_pages(path, save_images=save_images, workers=workers))
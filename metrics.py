@@ -0,0 +1,122 @@
+# metrics.py
+"""
+Stage timing for the query and ingest pipelines.
+
+    with span("query.rerank"):
+        ...
+
+Every span feeds the mmr_stage_seconds{stage=...} histogram, exposed in Prometheus
+text format by GET /metrics. Inside a trace() block the spans of the current thread
+(or task) are also collected, which is how /query?debug=1 builds its per-request
+breakdown. Work done for a request on another thread (the query micro-batcher) or
+process (page-parallel ingest) is handed back with record() / extend_trace().
+"""
+import threading, time, contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+# seconds; spans range from sub-millisecond lookups to multi-second OCR / generation
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per stage label."""
+
+    def __init__(self, name, help, buckets=BUCKETS, label="stage"):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series = {}   # label value -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, label):
+        with self._lock:
+            s = self._series.get(label)
+            if s is None:
+                s = self._series[label] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[-2] += 1
+            s[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for value in sorted(series):
+            s = series[value]
+            lab = f'{self.label}="{_escape(value)}"'
+            for b, n in zip(self.buckets, s):
+                lines.append(f'{self.name}_bucket{{{lab},le="{b:g}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{lab},le="+Inf"}} {s[-2]}')
+            lines.append(f"{self.name}_sum{{{lab}}} {s[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{lab}}} {s[-2]}")
+        return "\n".join(lines)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+stage_seconds = Histogram("mmr_stage_seconds", "Wall time per pipeline stage in seconds.")
+_trace = contextvars.ContextVar("mmr_trace", default=None)
+
+def record(stage, seconds):
+    """Observe an externally measured duration (also added to the active trace)."""
+    stage_seconds.observe(seconds, stage)
+    spans = _trace.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+@contextmanager
+def span(stage):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+def timed(stage):
+    """Decorator form of span()."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+@contextmanager
+def trace():
+    """Collect the [(stage, seconds)] recorded in this context until the block exits."""
+    spans = []
+    token = _trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+
+def extend_trace(spans):
+    """Add spans measured on another thread to this context's trace (histograms already have them)."""
+    active = _trace.get()
+    if active is not None:
+        active.extend(spans)
+
+def breakdown(spans, total_s=None):
+    """Per-request summary: stages in first-seen order with summed ms and call counts (spans nest)."""
+    by_stage = {}
+    for stage, sec in spans:
+        ms, n = by_stage.get(stage, (0.0, 0))
+        by_stage[stage] = (ms + sec * 1000.0, n + 1)
+    out = {"stages": [{"stage": s, "ms": round(ms, 3), "calls": n} for s, (ms, n) in by_stage.items()]}
+    if total_s is not None:
+        out["total_ms"] = round(total_s * 1000.0, 3)
+    return out
+
+def render_prometheus():
+    return stage_seconds.render() + "\n"
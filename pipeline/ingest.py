@@ -0,0 +1,33 @@
+# pipeline/ingest.py
+import os
+from ingest.pdf_ingest import iter_pdf_pages, pdf_page_count
+from chunking.chunker import PageChunker
+from chunking.store import DocumentChunkWriter
+from config import CHUNKS_DIR, RAW_DIR
+
+def ingest_to_store(pdf_path, workers=None, save_images=True, chunks_dir=CHUNKS_DIR, progress=None, image_dir=RAW_DIR):
+    """
+    Ingest a PDF and store its chunks as one document in the chunk store (replacing an
+    earlier copy); indexing is left to sync_index. Pages are chunked as they arrive
+    (text chunks may run across page breaks).
+    progress: optional callback, called with keyword updates (total_pages, pages, chunks).
+    image_dir: where cropped figures / page images are written (the collection's raw dir).
+    Returns {"doc_id", "pages", "chunks"}.
+    """
+    doc_id = os.path.basename(pdf_path)
+    progress = progress or (lambda **kw: None)
+    progress(total_pages=pdf_page_count(pdf_path), pages=0, chunks=0)
+    writer = DocumentChunkWriter(doc_id, chunks_dir)
+    chunker = PageChunker()
+    n_pages = 0
+    try:
+        for p in iter_pdf_pages(pdf_path, save_images=save_images, workers=workers, image_dir=image_dir):
+            writer.write(chunker.add(p))
+            n_pages += 1
+            progress(pages=n_pages, chunks=writer.n_chunks)
+        writer.write(chunker.close())
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    return {"doc_id": doc_id, "pages": n_pages, "chunks": writer.n_chunks}
@@ -0,0 +1,158 @@
+# pipeline/streaming.py
+"""
+Streaming ingest -> chunk -> embed -> index pipeline.
+
+Pages are parsed in a producer thread, chunked in a second thread and embedded in
+fixed-size batches on the caller's thread. The stages are joined by bounded queues,
+so a slow stage blocks the one upstream of it (backpressure) and peak memory is set
+by the queue sizes and the flush size, not by the length of the document. Every
+flush appends a delta segment to the live index (see add_document), so the first
+pages are searchable while the rest of the PDF is still being parsed, and a flush
+costs the same however large the index already is.
+"""
+import os, queue, threading
+import numpy as np
+
+from ingest.pdf_ingest import iter_pdf_pages, pdf_page_count
+from chunking.chunker import PageChunker
+from chunking.store import DocumentChunkWriter
+from embeddings.embedder import embed_texts
+from index.faiss_index import add_document, remove_document
+from qa.facts import TEXT_FEATURES
+from index.image_index import split_chunks, index_document_images, remove_document_images
+from config import (
+    FAISS_INDEX_PATH, META_PATH, CHUNKS_DIR, IMAGE_INDEX_PATH, IMAGE_META_PATH, RAW_DIR,
+    STREAM_EMBED_BATCH, STREAM_FLUSH_CHUNKS, STREAM_QUEUE_PAGES,
+)
+
+_DONE = object()
+
+class _Failed:
+    def __init__(self, exc):
+        self.exc = exc
+
+def _put(q, item, stop):
+    # blocking put that gives up once the pipeline is being torn down
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _stage(fn, out_q, stop):
+    def run():
+        try:
+            for item in fn():
+                if not _put(out_q, item, stop):
+                    return
+            _put(out_q, _DONE, stop)
+        except BaseException as e:
+            _put(out_q, _Failed(e), stop)
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
+
+def _drain(q):
+    while True:
+        item = q.get()
+        if item is _DONE:
+            return
+        if isinstance(item, _Failed):
+            raise item.exc
+        yield item
+
+def stream_pdf_to_index(pdf_path, workers=None, save_images=True,
+                        embed_batch=STREAM_EMBED_BATCH, flush_chunks=STREAM_FLUSH_CHUNKS,
+                        index_path=FAISS_INDEX_PATH, meta_path=META_PATH, chunks_dir=CHUNKS_DIR,
+                        progress=None, image_index_path=IMAGE_INDEX_PATH, image_meta_path=IMAGE_META_PATH,
+                        image_dir=RAW_DIR):
+    """
+    Ingest a PDF and index it incrementally. Replaces any earlier copy of the document.
+    progress: optional callback, called with keyword updates (total_pages, pages,
+    batches, chunks, indexed_chunks, indexed_images).
+    image_dir: where cropped figures / page images are written (the collection's raw dir).
+    Returns {"doc_id", "pages", "chunks", "images", "cache": {"hits", "misses"}}.
+    """
+    doc_id = os.path.basename(pdf_path)
+    progress = progress or (lambda **kw: None)
+    progress(total_pages=pdf_page_count(pdf_path), pages=0, batches=0, chunks=0, indexed_chunks=0, indexed_images=0)
+    stop = threading.Event()
+    pages_q = queue.Queue(maxsize=STREAM_QUEUE_PAGES)
+    batches_q = queue.Queue(maxsize=2)
+    n_pages = [0]
+
+    def pages():
+        for p in iter_pdf_pages(pdf_path, save_images=save_images, workers=workers, image_dir=image_dir):
+            yield p
+
+    def batches():
+        chunker = PageChunker()
+        batch = []
+        for p in _drain(pages_q):
+            n_pages[0] += 1
+            progress(pages=n_pages[0])
+            batch.extend(chunker.add(p))
+            while len(batch) >= embed_batch:
+                yield batch[:embed_batch]
+                batch = batch[embed_batch:]
+        batch.extend(chunker.close())
+        while len(batch) >= embed_batch:
+            yield batch[:embed_batch]
+            batch = batch[embed_batch:]
+        if batch:
+            yield batch
+
+    remove_document(doc_id, index_path, meta_path, features=TEXT_FEATURES)
+    remove_document_images(doc_id, image_index_path, image_meta_path)
+    writer = DocumentChunkWriter(doc_id, chunks_dir)
+    threads = [_stage(pages, pages_q, stop), _stage(batches, batches_q, stop)]
+    pending_vecs, pending_chunks, pending_images = [], [], []
+    stats = {"hits": 0, "misses": 0}
+    n_chunks = 0
+    n_batches = 0
+    n_indexed = [0]
+    n_images = [0]
+
+    def flush(fingerprint=None):
+        vecs = np.vstack(pending_vecs) if pending_vecs else np.zeros((0, 0), dtype="float32")
+        add_document(vecs, pending_chunks, doc_id, fingerprint=fingerprint,
+                     index_path=index_path, meta_path=meta_path, replace=False, features=TEXT_FEATURES)
+        # figures / page images: one batched CLIP pass per flush into the image index
+        n_images[0] += index_document_images(doc_id, pending_images, fingerprint=fingerprint, replace=False,
+                                             index_path=image_index_path, meta_path=image_meta_path)
+        n_indexed[0] += len(pending_chunks)
+        progress(indexed_chunks=n_indexed[0], indexed_images=n_images[0])
+        pending_vecs.clear()
+        pending_chunks.clear()
+        pending_images.clear()
+
+    try:
+        for batch in _drain(batches_q):
+            writer.write(batch)
+            text_batch, image_batch = split_chunks(batch)
+            if text_batch:
+                vecs, s = embed_texts([c.get("text", "") for c in text_batch], return_stats=True)
+                stats["hits"] += s["hits"]
+                stats["misses"] += s["misses"]
+                pending_vecs.append(np.asarray(vecs, dtype="float32"))
+                pending_chunks.extend(text_batch)
+            pending_images.extend(image_batch)
+            n_chunks += len(batch)
+            n_batches += 1
+            progress(batches=n_batches, chunks=n_chunks)
+            if len(pending_chunks) + len(pending_images) >= flush_chunks:
+                flush()
+        fingerprint = writer.close()
+        # final flush records the fingerprint so sync_index sees the document as up to date
+        flush(fingerprint)
+    except BaseException:
+        stop.set()
+        writer.abort()
+        raise
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=1.0)
+    return {"doc_id": doc_id, "pages": n_pages[0], "chunks": n_chunks, "images": n_images[0], "cache": stats}
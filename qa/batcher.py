@@ -0,0 +1,128 @@
+# qa/batcher.py
+import threading, time, queue
+from concurrent.futures import Future
+from config import BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS
+from qa.generator import retrieve_batch
+from metrics import trace, record, extend_trace
+
+class QueryBatcher:
+    """
+    Collects concurrent retrieval requests and serves them with one embed call and
+    one FAISS search per batch.
+
+    A request that arrives while nothing else is pending is dispatched at once, so
+    an idle server adds no wait. Once requests overlap (the previous batch had more
+    than one query, or more are already queued) the dispatcher holds the batch open
+    for up to max_wait_ms or until max_size queries are collected.
+
+    A batch may mix collections: the queries are still embedded together and each
+    collection is searched once (retrieve_fn gets one collection name per query).
+
+    Stage spans recorded while serving a batch are handed back to every caller's
+    trace (see metrics.py), together with its own query.batch_wait.
+    """
+
+    def __init__(self, max_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, retrieve_fn=retrieve_batch):
+        self.max_size = max(1, int(max_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.retrieve_fn = retrieve_fn
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._last_size = 0
+        self.batches = 0
+        self.queries = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    t = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                    t.start()
+                    self._thread = t
+
+    def submit(self, query, top_k=20, collection=None):
+        """Future resolving to (results, scores) for query in collection (None -> default)."""
+        self._ensure_started()
+        fut = Future()
+        fut.enqueued = time.perf_counter()
+        fut.spans = []        # this query's batch_wait + its batch's spans (what retrieve() traces)
+        fut.batch_spans = []  # the batch's spans alone, shared by every future of the batch
+        self._queue.put((query, top_k, collection, fut))
+        return fut
+
+    def retrieve(self, query, top_k=20, timeout=None, collection=None):
+        """Blocking submit: (results, scores) as from search_index."""
+        fut = self.submit(query, top_k, collection)
+        out = fut.result(timeout)
+        extend_trace(fut.spans)
+        return out
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.max_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if self.max_wait and (len(batch) > 1 or self._last_size > 1):
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._last_size = len(batch)
+            self.batches += 1
+            self.queries += len(batch)
+            # callers may ask for different top_k: search once with the largest and slice
+            top_k = max(k for _, k, _, _ in batch)
+            started = time.perf_counter()
+            for *_, fut in batch:
+                record("query.batch_wait", started - fut.enqueued)
+            try:
+                with trace() as spans:
+                    # one failing collection must not fail the others' queries
+                    out = self.retrieve_fn([q for q, _, _, _ in batch], top_k=top_k,
+                                           collection=[c for _, _, c, _ in batch], return_exceptions=True)
+            except Exception as e:
+                for *_, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, k, _, fut), hit in zip(batch, out):
+                fut.batch_spans = spans
+                fut.spans = [("query.batch_wait", started - fut.enqueued)] + spans
+                if isinstance(hit, Exception):
+                    fut.set_exception(hit)
+                    continue
+                results, scores = hit
+                fut.set_result((results[:k], scores[:k]))
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch": (self.queries / self.batches) if self.batches else 0.0,
+            "max_size": self.max_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def get_query_batcher():
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = QueryBatcher()
+    return _batcher
@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 from typing import List, Tuple, Optional
 
 _money_with_commas_or_dollar = re.compile(
@@ -7,8 +8,9 @@ _money_with_commas_or_dollar = re.compile(
 _loose_number = re.compile(r"\(?\$?\s*([0-9]{1,3}(?:,[0-9]{3})*(?:\.\d+)?|[0-9]{1,})(?:\s*(million|billion))?\)?", re.IGNORECASE)
 
 _percent_pat = re.compile(r"([0-9]{1,3}(?:\.\d+)?)\s*%")
+# \D+ matches the same gaps as the former (?:\D{1,6})+ without its exponential backtracking
 _two_numbers_line = re.compile(
-    r"(?:\$?\s*)([0-9]{1,3}(?:,[0-9]{3})*(?:\.\d+)?|[0-9]{4,}(?:\.\d+)?)(?:\D{1,6})+([0-9]{1,3}(?:,[0-9]{3})*(?:\.\d+)?|[0-9]{4,}(?:\.\d+)?)"
+    r"(?:\$?\s*)([0-9]{1,3}(?:,[0-9]{3})*(?:\.\d+)?|[0-9]{4,}(?:\.\d+)?)\D+([0-9]{1,3}(?:,[0-9]{3})*(?:\.\d+)?|[0-9]{4,}(?:\.\d+)?)"
 )
 
 _label_money_hint = re.compile(r"(revenue|cost of revenue|net income|cash and cash equivalents|total assets|total liabilities|eps|earnings per share)", re.IGNORECASE)
@@ -19,19 +21,23 @@ def _clean_text_dedupe(text: str, max_repeat_seq_len: int = 80) -> str:
     if not text:
         return text
     t = re.sub(r'\s+', ' ', text).strip()
-    # naive de-dup: if start repeats, collapse repeats
+    # if the start repeats, collapse the run of copies to one (counted in place, one slice)
     for L in range(10, min(max_repeat_seq_len, len(t)//2 + 1), 10):
         sub = t[:L]
-        if sub and t.startswith(sub*2):
-            while t.startswith(sub*2):
-                t = t[len(sub):]
-            t = t.strip()
+        n = len(sub)
+        if sub and t.startswith(sub, n):
+            r = 2
+            while t.startswith(sub, r * n):
+                r += 1
+            t = t[(r - 1) * n:].strip()
     return t
 
+@lru_cache(maxsize=65536)
 def _parse_number(token: str) -> Optional[float]:
     """
     Parse numeric token like "26,044", "$26,044", "(26,044)", "26 million".
     Returns numeric value in plain number (no unit conversion except million/billion).
+    Memoised: the same tokens recur across chunks and extractors.
     """
     if not token:
         return None
@@ -73,14 +79,101 @@ def _select_best_money_candidate(candidates: List[str]) -> Optional[str]:
     if not parsed:
         return None
     # preferred ones: those that originally matched _money_with_commas_or_dollar OR contained '$' or ','
-    preferred = [t for t, v in parsed if ('$' in t) or (',' in t)]
-    if preferred:
-        # choose the preferred one with largest absolute value
-        best = max([(t, _parse_number(t)) for t in preferred], key=lambda x: abs(x[1]))
-        return best[0]
-    # else return the largest numeric by absolute value
-    best = max(parsed, key=lambda x: abs(x[1]))
-    return best[0]
+    preferred = [(t, v) for t, v in parsed if ('$' in t) or (',' in t)]
+    # the preferred one with largest absolute value, else the largest numeric by absolute value
+    return max(preferred or parsed, key=lambda x: abs(x[1]))[0]
+
+
+class ChunkTokens:
+    """
+    Numeric tokenisation of one chunk's text, computed once and shared by every extractor:
+    lines (raw + lowercased) and, per line, the two-number match, strict money candidates,
+    loose numbers (with million/billion units) and a percent flag. Each per-line field and
+    the whole-text candidate lists (matches may span lines there) are computed on first use.
+    """
+    __slots__ = ("text", "lower", "_lines", "_low", "_two", "_strict", "_loose", "_pct", "_all_strict", "_all_loose")
+
+    def __init__(self, text: str):
+        self.text = (text or "").replace("\r", "\n")
+        self.lower = self.text.lower()
+        self._lines = None
+        self._low = None
+        self._all_strict = None
+        self._all_loose = None
+
+    @property
+    def lines(self) -> List[str]:
+        if self._lines is None:
+            self._lines = self.text.split("\n")
+            n = len(self._lines)
+            self._two, self._strict, self._loose, self._pct = [False] * n, [None] * n, [None] * n, [None] * n
+        return self._lines
+
+    @property
+    def low(self) -> List[str]:
+        if self._low is None:
+            self._low = self.lower.split("\n")
+        return self._low
+
+    def two(self, i: int):
+        """(first, second) number of the line's two-number pattern, or None."""
+        lines = self.lines
+        t = self._two[i]
+        if t is False:
+            m = _two_numbers_line.search(lines[i])
+            t = self._two[i] = m.groups() if m else None
+        return t
+
+    def strict(self, i: int) -> List[str]:
+        lines = self.lines
+        t = self._strict[i]
+        if t is None:
+            t = self._strict[i] = _money_with_commas_or_dollar.findall(lines[i])
+        return t
+
+    def loose(self, i: int) -> List[str]:
+        lines = self.lines
+        t = self._loose[i]
+        if t is None:
+            # _loose_number never includes a "%", so its matches need no percent filter
+            t = self._loose[i] = [m.group(0) for m in _loose_number.finditer(lines[i])]
+        return t
+
+    def pct(self, i: int) -> bool:
+        lines = self.lines
+        t = self._pct[i]
+        if t is None:
+            t = self._pct[i] = _percent_pat.search(lines[i]) is not None
+        return t
+
+    @property
+    def all_strict(self) -> List[str]:
+        if self._all_strict is None:
+            self._all_strict = _money_with_commas_or_dollar.findall(self.text)
+        return self._all_strict
+
+    @property
+    def all_loose(self) -> List[str]:
+        if self._all_loose is None:
+            self._all_loose = [m.group(0) for m in _loose_number.finditer(self.text)]
+        return self._all_loose
+
+@lru_cache(maxsize=4096)
+def chunk_tokens(text: str) -> ChunkTokens:
+    """
+    Memoised ChunkTokens. Keyed by the chunk text rather than chunk_id: ids repeat across
+    documents, and the retrieved dicts hand the same str object back, whose hash is cached.
+    """
+    return ChunkTokens(text)
+
+def _lower(text: str) -> str:
+    return chunk_tokens(text).lower if text else ""
+
+def clear_token_cache():
+    chunk_tokens.cache_clear()
+    _parse_number.cache_clear()
+    repurchase_value.cache_clear()
+    certification_value.cache_clear()
 
 def extract_first_money_after_label(text: str, label: str) -> Optional[str]:
     """
@@ -88,62 +181,60 @@ def extract_first_money_after_label(text: str, label: str) -> Optional[str]:
     """
     if not text:
         return None
-    txt = text.replace("\r", "\n")
-    lines = txt.split("\n")
+    tok = chunk_tokens(text)
     label_l = label.lower()
     # look for lines containing label
-    for i, ln in enumerate(lines):
-        if label_l in ln.lower():
+    for i, ln in enumerate(tok.low):
+        if label_l in ln:
             # 1) try two numbers in same line
-            two = _two_numbers_line.search(ln)
+            two = tok.two(i)
             if two:
-                return two.group(1)
+                return two[0]
             # 2) look for strict money candidates in the same line
-            cands = _money_with_commas_or_dollar.findall(ln)
-            if cands:
-                return _select_best_money_candidate(cands)
+            if tok.strict(i):
+                return _select_best_money_candidate(tok.strict(i))
             loose = []
-            for j in range(0, 3):
-                if i + j < len(lines):
-                    l2 = lines[i + j]
-                    # skip percentages
-                    if _percent_pat.search(l2):
-                        continue
-                    for m in _loose_number.finditer(l2):
-                        num_str = m.group(0)
-                        loose.append(num_str)
+            for j in range(i, min(i + 3, len(tok.lines))):
+                # skip percentages
+                if not tok.pct(j):
+                    loose.extend(tok.loose(j))
             if loose:
                 # prefer best loose candidate
                 return _select_best_money_candidate(loose)
+    return first_money_in_text(text)
+
+def first_money_in_text(text: str) -> Optional[str]:
+    """Label-independent part of extract_first_money_after_label: best money figure anywhere."""
+    if not text:
+        return None
+    tok = chunk_tokens(text)
     # fallback: search entire text for strict money pattern
-    all_cands = _money_with_commas_or_dollar.findall(txt)
-    if all_cands:
-        return _select_best_money_candidate(all_cands)
+    if tok.all_strict:
+        return _select_best_money_candidate(tok.all_strict)
     # last resort: any loose number
-    all_loose = [m.group(0) for m in _loose_number.finditer(txt) if not _percent_pat.search(m.group(0))]
-    if all_loose:
-        return _select_best_money_candidate(all_loose)
+    if tok.all_loose:
+        return _select_best_money_candidate(tok.all_loose)
     return None
 
 def extract_two_period_values_from_row(text: str, label_hint: str = None) -> Tuple[Optional[str], Optional[str], Optional[str]]:
 
     if not text:
         return None, None, None
-    txt = text.replace("\r", "\n")
-    lines = txt.split("\n")
-    for ln in lines:
-        if label_hint and label_hint.lower() not in ln.lower():
+    tok = chunk_tokens(text)
+    hint = label_hint.lower() if label_hint else None
+    for i, ln in enumerate(tok.lines):
+        if hint and hint not in tok.low[i]:
             continue
-        m = _two_numbers_line.search(ln)
-        if m:
-            return m.group(1), m.group(2), ln
-    for ln in lines:
+        two = tok.two(i)
+        if two:
+            return two[0], two[1], ln
+    for i, ln in enumerate(tok.lines):
         # find money-with-commas tokens
-        strict = _money_with_commas_or_dollar.findall(ln)
+        strict = tok.strict(i)
         if len(strict) >= 2:
             return strict[0], strict[1], ln
         # loose fallback
-        loose = [m.group(0) for m in _loose_number.finditer(ln) if not _percent_pat.search(m.group(0))]
+        loose = tok.loose(i)
         if len(loose) >= 2:
             # pick two best candidates
             v1 = _select_best_money_candidate([loose[0]])
@@ -151,37 +242,48 @@ def extract_two_period_values_from_row(text: str, label_hint: str = None) -> Tup
             return v1, v2, ln
     return None, None, None
 
-def extract_numeric_candidates_from_chunks(chunks: List[dict], labels: List[str]):
+def _money(c: dict, label: str, facts=None) -> Optional[str]:
+    if facts is not None:
+        return facts.money(c, label)
+    return extract_first_money_after_label(c.get("text","") or "", label=label)
+
+def _pair(c: dict, label_hint: str = None, facts=None) -> Tuple[Optional[str], Optional[str]]:
+    if facts is not None:
+        return facts.pair(c, label_hint)
+    cur, pri, _ = extract_two_period_values_from_row(c.get("text","") or "", label_hint=label_hint)
+    return cur, pri
+
+def extract_numeric_candidates_from_chunks(chunks: List[dict], labels: List[str], facts=None):
     """
     Given list of chunks and labels, return the first found numeric value and the chunk that contained it.
     Prefers chunks whose 'type' is 'table_row' or contains the label text.
+    facts: optional qa.facts.ChunkFacts; per-chunk values are looked up instead of re-extracted.
     """
     for label in labels:
         for c in chunks:
             text = c.get("text","") or ""
-            if c.get("type","").lower().startswith("table") and label.lower() in text.lower():
-                val = extract_first_money_after_label(text, label=label)
+            if c.get("type","").lower().startswith("table") and label.lower() in _lower(text):
+                val = _money(c, label, facts)
                 if val:
                     return val, c, label
     
     for label in labels:
         for c in chunks:
             text = c.get("text","") or ""
-            if label.lower() in text.lower():
-                val = extract_first_money_after_label(text, label=label)
+            if label.lower() in _lower(text):
+                val = _money(c, label, facts)
                 if val:
                     return val, c, label
     # finally try any chunk, prefer table_row chunks
     for c in chunks:
-        text = c.get("text","") or ""
-        val = extract_first_money_after_label(text, label=labels[0] if labels else "")
+        val = _money(c, labels[0] if labels else "", facts)
         if val:
             return val, c, labels[0] if labels else None
     return None, None, None
 
 
 # ----- Add this function to qa/extractors.py -----
-def extract_comparison_from_chunks(chunks: List[dict], label_hint: str = None) -> Tuple[Optional[str], Optional[str], Optional[dict]]:
+def extract_comparison_from_chunks(chunks: List[dict], label_hint: str = None, facts=None) -> Tuple[Optional[str], Optional[str], Optional[dict]]:
     if not chunks:
         return None, None, None
 
@@ -192,8 +294,8 @@ def extract_comparison_from_chunks(chunks: List[dict], label_hint: str = None) -
                 continue
             ctype = c.get("type", "").lower()
             text = c.get("text", "") or ""
-            if ctype.startswith("table") and label_hint.lower() in text.lower():
-                cur, pri, ln = extract_two_period_values_from_row(text, label_hint=label_hint)
+            if ctype.startswith("table") and label_hint.lower() in _lower(text):
+                cur, pri = _pair(c, label_hint, facts)
                 if cur and pri:
                     return cur, pri, c
 
@@ -203,8 +305,8 @@ def extract_comparison_from_chunks(chunks: List[dict], label_hint: str = None) -
             if not c:
                 continue
             text = c.get("text", "") or ""
-            if label_hint.lower() in text.lower():
-                cur, pri, ln = extract_two_period_values_from_row(text, label_hint=label_hint)
+            if label_hint.lower() in _lower(text):
+                cur, pri = _pair(c, label_hint, facts)
                 if cur and pri:
                     return cur, pri, c
 
@@ -215,7 +317,7 @@ def extract_comparison_from_chunks(chunks: List[dict], label_hint: str = None) -
         ctype = c.get("type", "").lower()
         text = c.get("text", "") or ""
         if ctype.startswith("table"):
-            cur, pri, ln = extract_two_period_values_from_row(text, label_hint=None)
+            cur, pri = _pair(c, None, facts)
             if cur and pri:
                 
                 if label_hint and label_hint.lower() not in text.lower():
@@ -229,7 +331,7 @@ def extract_comparison_from_chunks(chunks: List[dict], label_hint: str = None) -
         if not c:
             continue
         text = c.get("text", "") or ""
-        cur, pri, ln = extract_two_period_values_from_row(text, label_hint=None)
+        cur, pri = _pair(c, None, facts)
         if cur and pri:
             return cur, pri, c
 
@@ -238,38 +340,60 @@ def extract_comparison_from_chunks(chunks: List[dict], label_hint: str = None) -
 
 
 
-def extract_repurchases(chunks: List[dict]):
+@lru_cache(maxsize=4096)
+def repurchase_value(text: str) -> Optional[str]:
+    """Repurchase amount / share count (or a cleaned snippet) for one chunk's text, None if it has no repurchase line."""
+    low = (text or "").lower()
+    if not any(k in low for k in _repurch_row_keywords):
+        return None
+    # try strict money first (the pattern has no letters, so case does not matter)
+    strict = chunk_tokens(text or "").all_strict
+    if strict:
+        return _select_best_money_candidate(strict)
+    # try loose numbers with shares
+    m2 = re.search(r"([0-9]{1,3}(?:,[0-9]{3})*)\s+shares", low)
+    if m2:
+        return m2.group(1) + " shares"
+    # else return a cleaned snippet
+    return _clean_text_dedupe(low[:400])
+
+def extract_repurchases(chunks: List[dict], facts=None):
     """
     Search for repurchase-related lines and try to return either monetary or share amounts.
-    
+    Returns (value, chunk), or (None, None) when no chunk mentions a repurchase.
     """
     for c in chunks:
-        text = (c.get("text","") or "").lower()
-        if any(k in text for k in _repurch_row_keywords):
-            # try strict money first
-            strict = _money_with_commas_or_dollar.findall(text)
-            if strict:
-                return _select_best_money_candidate(strict), c
-            # try loose numbers with shares
-            m2 = re.search(r"([0-9]{1,3}(?:,[0-9]{3})*)\s+shares", text)
-            if m2:
-                return m2.group(1) + " shares", c
-            # else return a cleaned snippet
-            snippet = _clean_text_dedupe(text[:400])
-            return snippet, c
-    return None, None, None
+        if facts is not None:
+            val = facts.repurchase(c)
+        else:
+            val = repurchase_value(c.get("text","") or "")
+        if val is not None:
+            return val, c
+    return None, None
 
-def extract_certification_text(chunks: List[dict]):
+@lru_cache(maxsize=4096)
+def certification_value(text: str) -> Optional[str]:
+    """Cleaned certification / exhibit paragraph for one chunk's text, None if it has none."""
+    txt = text or ""
+    low = _lower(txt)
+    if 'certificat' in low or 'exhibit' in low or 'furnished' in low:
+        return _clean_text_dedupe(txt)
+    return None
+
+def extract_certification_text(chunks: List[dict], facts=None):
     """
     Look for certification / exhibit text blocks and return cleaned paragraph + chunk.
+    Returns (None, None) when there is none.
     """
     candidates = []
     for c in chunks:
-        txt = c.get("text","") or ""
-        if 'certificat' in txt.lower() or 'exhibit' in txt.lower() or 'furnished' in txt.lower():
-            cleaned = _clean_text_dedupe(txt)
+        if facts is not None:
+            cleaned = facts.certification(c)
+        else:
+            cleaned = certification_value(c.get("text","") or "")
+        if cleaned is not None:
             candidates.append((cleaned, c))
     if candidates:
         candidates.sort(key=lambda x: len(x[0]), reverse=True)
         return candidates[0]
-    return None, None, None
+    return None, None
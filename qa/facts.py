@@ -0,0 +1,218 @@
+# qa/facts.py
+import os, re, sqlite3, threading
+from qa.extractors import (
+    extract_first_money_after_label,
+    extract_two_period_values_from_row,
+    first_money_in_text,
+    repurchase_value,
+    certification_value,
+)
+from qa.rerank import keyword_score
+
+# labels answer_query asks the extractors for; other labels fall back to the regex scan
+FACT_LABELS = [
+    "total revenue", "revenue", "net revenue", "cost of revenue", "net income",
+    "cash and cash equivalents", "basic net income per share",
+    "diluted net income per share", "earnings per share", "eps", "total assets",
+    "total liabilities",
+]
+ANY_LABEL = "*"          # label-independent fallback: first money figure / first two-number line
+REPURCHASE = "repurchase"
+CERTIFICATION = "certification"
+
+_UNIT_RE = re.compile(r"\bin (thousands|millions|billions)\b")
+
+def _unit(text, value):
+    if value and value.endswith(" shares"):
+        return "shares"
+    m = _UNIT_RE.search(text.lower())
+    return m.group(1) if m else None
+
+def extract_chunk_facts(chunk):
+    """
+    Facts for one chunk: [(label, value, current, prior, unit)]. Values are exactly what
+    the regex extractors return for this chunk, so lookups answer like the scan did.
+    """
+    text = chunk.get("text", "") or ""
+    low = text.lower()
+    out = []
+    for label in FACT_LABELS:
+        if label in low:
+            value = extract_first_money_after_label(text, label=label)
+            cur, pri, _ = extract_two_period_values_from_row(text, label_hint=label)
+            if value or (cur and pri):
+                out.append((label, value, cur, pri, _unit(text, value)))
+    value = first_money_in_text(text)
+    cur, pri, _ = extract_two_period_values_from_row(text, label_hint=None)
+    if value or (cur and pri):
+        out.append((ANY_LABEL, value, cur, pri, _unit(text, value)))
+    rep = repurchase_value(text)
+    if rep:
+        out.append((REPURCHASE, rep, None, None, _unit(text, rep)))
+    cert = certification_value(text)
+    if cert:
+        out.append((CERTIFICATION, cert, None, None, None))
+    return out
+
+
+class ChunkFacts:
+    """
+    Per-query view of the facts for a set of retrieved chunks. Chunks the facts store has
+    scanned are answered from it; any other chunk goes through the regex extractors.
+    """
+
+    def __init__(self, facts, scanned):
+        self.facts = facts          # {uid: {label: (value, current, prior)}}
+        self.scanned = scanned      # uids present in the store (with or without facts)
+
+    def _get(self, chunk, label):
+        uid = chunk.get("uid")
+        if uid not in self.scanned:
+            return None
+        return self.facts.get(uid, {}).get(label, (None, None, None))
+
+    @staticmethod
+    def _label_key(chunk, label):
+        """Fact label answering (chunk, label); None when only the regex scan can answer it."""
+        if label and label.lower() in (chunk.get("text", "") or "").lower():
+            return label.lower() if label.lower() in FACT_LABELS else None
+        return ANY_LABEL
+
+    def money(self, chunk, label):
+        # a label missing from the text falls through to the label-independent scan
+        key = self._label_key(chunk, label)
+        f = self._get(chunk, key) if key else None
+        if f is None:
+            return extract_first_money_after_label(chunk.get("text", "") or "", label=label)
+        return f[0]
+
+    def pair(self, chunk, label_hint=None):
+        # with a hint the extractor only agrees with the stored pair when the label is present
+        key = ANY_LABEL if not label_hint else self._label_key(chunk, label_hint)
+        f = self._get(chunk, key) if key and not (label_hint and key == ANY_LABEL) else None
+        if f is None:
+            cur, pri, _ = extract_two_period_values_from_row(chunk.get("text", "") or "", label_hint=label_hint)
+            return cur, pri
+        return f[1], f[2]
+
+    def repurchase(self, chunk):
+        f = self._get(chunk, REPURCHASE)
+        return repurchase_value(chunk.get("text", "") or "") if f is None else f[0]
+
+    def certification(self, chunk):
+        f = self._get(chunk, CERTIFICATION)
+        return certification_value(chunk.get("text", "") or "") if f is None else f[0]
+
+
+class FactsStore:
+    """
+    Structured facts extracted when chunks are indexed (sqlite, indexed by label and uid).
+    Kept in step with the FAISS index through TEXT_FEATURES (build_faiss_index /
+    add_document / remove_document call its update).
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (uid INTEGER PRIMARY KEY, doc_id TEXT, page INTEGER, chunk_id TEXT);
+            CREATE TABLE IF NOT EXISTS facts (
+                uid INTEGER NOT NULL, label TEXT NOT NULL, value TEXT, current TEXT, prior TEXT, unit TEXT,
+                doc_id TEXT, page INTEGER, chunk_id TEXT
+            );
+            CREATE INDEX IF NOT EXISTS facts_label ON facts (label, doc_id);
+            CREATE INDEX IF NOT EXISTS facts_uid ON facts (uid);
+        """)
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def update(self, add_chunks=(), remove_uids=(), clear=False):
+        """Extract and store facts for add_chunks (carrying "uid"), dropping remove_uids first."""
+        chunk_rows, fact_rows = [], []
+        for c in add_chunks:
+            uid = int(c["uid"])
+            chunk_rows.append((uid, c.get("doc_id"), c.get("page"), c.get("chunk_id")))
+            for label, value, cur, pri, unit in extract_chunk_facts(c):
+                fact_rows.append((uid, label, value, cur, pri, unit, c.get("doc_id"), c.get("page"), c.get("chunk_id")))
+        drop = [(int(u),) for u in remove_uids] + [(r[0],) for r in chunk_rows]
+        with self._lock:
+            if clear:
+                self._conn.execute("DELETE FROM facts")
+                self._conn.execute("DELETE FROM chunks")
+            else:
+                self._conn.executemany("DELETE FROM facts WHERE uid = ?", drop)
+                self._conn.executemany("DELETE FROM chunks WHERE uid = ?", drop)
+            self._conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", chunk_rows)
+            self._conn.executemany("INSERT INTO facts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", fact_rows)
+            self._conn.commit()
+        return len(fact_rows)
+
+    def lookup(self, uids):
+        """ChunkFacts for the given chunk uids."""
+        uids = list({int(u) for u in uids if u is not None})
+        facts, scanned = {}, set()
+        with self._lock:
+            # stay under sqlite's bound-parameter limit
+            for i in range(0, len(uids), 500):
+                part = uids[i:i + 500]
+                marks = ",".join("?" * len(part))
+                scanned.update(r[0] for r in self._conn.execute(f"SELECT uid FROM chunks WHERE uid IN ({marks})", part))
+                for uid, label, value, cur, pri in self._conn.execute(
+                        f"SELECT uid, label, value, current, prior FROM facts WHERE uid IN ({marks})", part):
+                    facts.setdefault(uid, {})[label] = (value, cur, pri)
+        return ChunkFacts(facts, scanned)
+
+    def find(self, label, doc_id=None):
+        """All facts recorded under a label (optionally for one document)."""
+        sql = "SELECT doc_id, page, chunk_id, label, value, current, prior, unit FROM facts WHERE label = ?"
+        args = [label.strip().lower()]
+        if doc_id is not None:
+            sql += " AND doc_id = ?"
+            args.append(doc_id)
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        keys = ("doc_id", "page", "chunk_id", "label", "value", "current", "prior", "unit")
+        return [dict(zip(keys, r)) for r in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_facts_store(path):
+    path = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = FactsStore(path)
+            _stores[path] = store
+    return store
+
+
+def facts_path(meta_path):
+    return meta_path + ".facts.sqlite"
+
+
+class TextFeatures:
+    """
+    Index-time features of text chunks, handed to the index writers as their features
+    hook (see index/faiss_index.py): the kw_score column read by the keyword reranker
+    and the facts table.
+    """
+
+    def annotate(self, chunk):
+        if "kw_score" not in chunk:
+            chunk["kw_score"] = keyword_score(chunk.get("text", ""))
+
+    def update(self, meta_path, add_chunks=(), remove_uids=(), clear=False):
+        get_facts_store(facts_path(meta_path)).update(add_chunks, remove_uids=remove_uids, clear=clear)
+
+    def exists(self, meta_path):
+        return os.path.exists(facts_path(meta_path))
+
+
+TEXT_FEATURES = TextFeatures()
@@ -0,0 +1,251 @@
+# qa/generation.py
+import threading, time, queue
+from config import (
+    GEN_MODEL, GEN_BACKEND, GEN_MAX_BATCH, GEN_BATCH_WAIT_MS, GEN_MAX_COHORTS,
+    GEN_MAX_NEW_TOKENS, GEN_MAX_INPUT_TOKENS, GEN_TIME_BUDGET_S,
+)
+from metrics import span, record
+from serving.client import get_model_client, RemoteGenerationWorker
+
+_DONE = object()
+
+
+class GenerationRequest:
+    """
+    One prompt handed to the GenerationWorker. Text arrives incrementally through
+    stream(); result() waits for the whole answer. finish_reason is "eos",
+    "max_tokens", "time_budget", "cancelled" or "error".
+    """
+
+    def __init__(self, prompt, max_new_tokens=GEN_MAX_NEW_TOKENS, time_budget=GEN_TIME_BUDGET_S):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.submitted = time.monotonic()
+        # the budget covers queueing as well as decoding
+        self.deadline = self.submitted + time_budget
+        self.ids = []
+        self.text = ""
+        self.finish_reason = None
+        self.error = None
+        self.first_token_s = None
+        self._events = queue.Queue()
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self):
+        return self.finish_reason is not None
+
+    def cancel(self):
+        """Stop decoding for this request (e.g. the client went away)."""
+        self._cancel.set()
+
+    def stream(self, timeout=None):
+        """Yield text deltas as they are decoded; raises RuntimeError if generation failed."""
+        while True:
+            item = self._events.get(timeout=timeout)
+            if item is _DONE:
+                break
+            yield item
+        if self.error is not None:
+            raise RuntimeError(self.error)
+
+    def result(self, timeout=None):
+        for _ in self.stream(timeout):
+            pass
+        return self.text
+
+    # worker side
+    def _push(self, token_id, tokenizer):
+        if self.first_token_s is None:
+            self.first_token_s = time.monotonic() - self.submitted
+            record("generate.first_token", self.first_token_s)
+        self.ids.append(token_id)
+        text = tokenizer.decode(self.ids, skip_special_tokens=True)
+        # sentencepiece can re-space earlier text, so send the suffix that is new
+        delta = text[len(self.text):] if text.startswith(self.text) else text
+        self.text = text
+        if delta:
+            self._events.put(delta)
+
+    def _finish(self, reason, error=None):
+        if self.finished:
+            return
+        self.finish_reason = reason
+        self.error = error
+        self._events.put(_DONE)
+
+    def _check_budget(self):
+        if self._cancel.is_set():
+            self._finish("cancelled")
+        elif time.monotonic() > self.deadline:
+            self._finish("time_budget")
+        elif len(self.ids) >= self.max_new_tokens:
+            self._finish("max_tokens")
+
+
+class _Cohort:
+    """Requests admitted together: encoded once, then greedy-decoded one step at a time with a KV cache."""
+
+    def __init__(self, worker, reqs):
+        import torch
+        self.torch = torch
+        self.worker = worker
+        self.reqs = reqs
+        tok, model = worker.tokenizer, worker.model
+        enc = tok([r.prompt for r in reqs], return_tensors="pt", padding=True,
+                  truncation=True, max_length=GEN_MAX_INPUT_TOKENS)
+        with torch.inference_mode(), span("generate.encode"):
+            self.encoder_outputs = model.get_encoder()(input_ids=enc["input_ids"], attention_mask=enc["attention_mask"])
+        self.attention_mask = enc["attention_mask"]
+        self.next_ids = torch.full((len(reqs), 1), model.config.decoder_start_token_id, dtype=torch.long)
+        self.past = None
+
+    @property
+    def done(self):
+        return all(r.finished for r in self.reqs)
+
+    def step(self):
+        torch, tok, model = self.torch, self.worker.tokenizer, self.worker.model
+        with torch.inference_mode(), span("generate.step"):
+            out = model(encoder_outputs=self.encoder_outputs, attention_mask=self.attention_mask,
+                        decoder_input_ids=self.next_ids, past_key_values=self.past, use_cache=True)
+        self.past = out.past_key_values
+        nxt = out.logits[:, -1, :].argmax(-1)
+        for i, r in enumerate(self.reqs):
+            if r.finished:
+                # finished rows stay in the batch until the cohort ends; feed them padding
+                nxt[i] = tok.pad_token_id
+                continue
+            tid = int(nxt[i])
+            if tid == tok.eos_token_id:
+                r._finish("eos")
+                continue
+            r._push(tid, tok)
+            r._check_budget()
+        self.next_ids = nxt.unsqueeze(-1)
+
+    def fail(self, error):
+        for r in self.reqs:
+            r._finish("error", error)
+
+
+class GenerationWorker:
+    """
+    Single thread that owns the seq2seq model and serves every generation request.
+
+    Prompts arriving together (within GEN_BATCH_WAIT_MS, up to GEN_MAX_BATCH) form a
+    cohort that is encoded and decoded as one batch. Up to GEN_MAX_COHORTS cohorts are
+    decoded round-robin, one token step each, so a request that arrives while a long
+    answer is being generated gets its first token after a single step of the others
+    rather than after they finish. Each request stops at its own token / time budget.
+    """
+
+    def __init__(self, model_name=GEN_MODEL, max_batch=GEN_MAX_BATCH, batch_wait_ms=GEN_BATCH_WAIT_MS,
+                 max_cohorts=GEN_MAX_COHORTS, backend=GEN_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self.max_batch = max(1, int(max_batch))
+        self.batch_wait = max(0.0, float(batch_wait_ms)) / 1000.0
+        self.max_cohorts = max(1, int(max_cohorts))
+        self.tokenizer = None
+        self.model = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._cohorts = []
+        self.requests = 0
+        self.cohorts_started = 0
+
+    def _load(self):
+        if self.model is None:
+            from embeddings.backends import load_seq2seq
+            self.tokenizer, self.model, self.backend = load_seq2seq(self.model_name, self.backend)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    t = threading.Thread(target=self._run, name="generation-worker", daemon=True)
+                    t.start()
+                    self._thread = t
+
+    def submit(self, prompt, max_new_tokens=None, time_budget=None):
+        """Queue a prompt; returns its GenerationRequest immediately."""
+        self._ensure_started()
+        req = GenerationRequest(prompt,
+                                max_new_tokens=max_new_tokens or GEN_MAX_NEW_TOKENS,
+                                time_budget=time_budget or GEN_TIME_BUDGET_S)
+        self.requests += 1
+        self._queue.put(req)
+        return req
+
+    def generate(self, prompt, max_new_tokens=None, time_budget=None):
+        """Blocking convenience: the full generated text."""
+        return self.submit(prompt, max_new_tokens, time_budget).result()
+
+    def _admit(self, block):
+        """Collect the next cohort's requests (dropping ones already cancelled / expired)."""
+        batch = []
+        try:
+            first = self._queue.get() if block else self._queue.get_nowait()
+        except queue.Empty:
+            return batch
+        batch.append(first)
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic() if block else 0
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        live = []
+        for r in batch:
+            r._check_budget()
+            if not r.finished:
+                live.append(r)
+        return live
+
+    def _run(self):
+        while True:
+            if len(self._cohorts) < self.max_cohorts:
+                reqs = self._admit(block=not self._cohorts)
+                if reqs:
+                    try:
+                        self._load()
+                        self._cohorts.append(_Cohort(self, reqs))
+                        self.cohorts_started += 1
+                    except Exception as e:
+                        for r in reqs:
+                            r._finish("error", str(e))
+            for cohort in list(self._cohorts):
+                try:
+                    cohort.step()
+                except Exception as e:
+                    cohort.fail(str(e))
+                if cohort.done:
+                    self._cohorts.remove(cohort)
+
+    def stats(self):
+        return {
+            "backend": self.backend,
+            "requests": self.requests,
+            "cohorts": self.cohorts_started,
+            "active_cohorts": len(self._cohorts),
+            "queued": self._queue.qsize(),
+            "max_batch": self.max_batch,
+            "max_cohorts": self.max_cohorts,
+        }
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def get_generation_worker():
+    """The process-wide worker (a RemoteGenerationWorker when a model server is configured)."""
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                client = get_model_client()
+                _worker = RemoteGenerationWorker(client) if client is not None else GenerationWorker()
+    return _worker
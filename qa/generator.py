@@ -4,14 +4,17 @@ import pickle
 import re
 from typing import List, Dict, Any
 import numpy as np
-from embeddings.embedder import embed_texts
-from index.faiss_index import search_index
-from config import CHUNKS_PATH
-from embeddings.embedder import embed_texts
-from index.faiss_index import search_index 
+from config import CHUNKS_PATH, QUERY_EMBED_CACHE_SIZE, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, IMAGE_TOP_K
+from embeddings.embedder import embed_texts, embed_clip_texts
+from index.faiss_index import search_index_batch
+from index.image_index import image_index_exists, search_images_batch, fuse_hits, is_image_chunk
+from index.collections import get_collection, get_registry
+from qa.facts import get_facts_store, facts_path
+from qa.generation import get_generation_worker
+from qa.cache import LRUCache, normalize_query
 from qa.rerank import rerank_by_keyword
-from qa.extractors import extract_numeric_candidates_from_chunks, extract_first_money_after_label
-from transformers import pipeline
+from metrics import span
+from serving.client import get_model_client
 from qa.extractors import (
     extract_numeric_candidates_from_chunks,
     extract_comparison_from_chunks,
@@ -19,13 +22,10 @@ from qa.extractors import (
     extract_certification_text
 )
 
-_local_generator = None
-def get_local_generator():
-    global _local_generator
-    if _local_generator is None:
-        _local_generator = pipeline("text2text-generation", model="google/flan-t5-small", device=-1)
-    return _local_generator
-
+# query text (or ("clip", text) for the image index) -> embedding row
+_query_embed_cache = LRUCache(QUERY_EMBED_CACHE_SIZE)
+# (normalised query, top_k, (text, image) index versions, use_openai) -> answer payload
+_answer_cache = LRUCache(ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
 def assemble_numeric_prompt(query, top_chunks):
     ctx = ""
     for i, r in enumerate(top_chunks, 1):
@@ -50,26 +50,194 @@ def assemble_prompt(query: str, retrieved_chunks: List[Dict[str, Any]]) -> str:
     )
     return prompt
 
-def answer_query(query: str, top_k: int = 20, use_openai: bool = False, openai_client = None) -> Dict[str, Any]:
+def embed_queries(queries: List[str]) -> np.ndarray:
+    """Query embeddings through the in-process LRU; only unseen query texts are encoded."""
+    embs = [_query_embed_cache.get(q) for q in queries]
+    todo = {}
+    for i, e in enumerate(embs):
+        if e is None:
+            todo.setdefault(queries[i], []).append(i)
+    if todo:
+        with span("query.embed"):
+            new = embed_texts(list(todo), use_cache=False)
+        for (q, idxs), v in zip(todo.items(), new):
+            _query_embed_cache.put(q, v)
+            for i in idxs:
+                embs[i] = v
+    return np.vstack(embs).astype("float32")
+
+def retrieve_batch(queries: List[str], top_k: int = 20, collection=None, return_exceptions: bool = False):
+    """
+    Embed all queries in one forward pass and search them in one FAISS call per
+    collection (fused with BM25 over the inverted index when hybrid search is on).
+    When an image index exists, the top IMAGE_TOP_K image hits (CLIP text tower) are
+    fused in too.
+    collection: a collection name for all queries, or one name per query (None -> default);
+    each collection is loaded through the registry, which may unload idle ones.
+    Returns [(results, scores)] in the order of queries. return_exceptions=True puts a
+    failing collection's exception in its queries' places instead of raising.
+    With a model server, the whole call runs there (it holds the models and indexes).
+    """
+    queries = list(queries)
+    client = get_model_client()
+    if client is not None:
+        return client.call("retrieve_batch", queries, top_k, collection, return_exceptions)
+    names = list(collection) if isinstance(collection, (list, tuple)) else [collection] * len(queries)
+    q_emb = embed_queries(queries)
+    groups = {}
+    for i, name in enumerate(names):
+        groups.setdefault(name, []).append(i)
+    hits = [None] * len(queries)
+    for name, rows in groups.items():
+        try:
+            coll = get_registry().acquire(name)
+            found = _search_collection(coll, [queries[i] for i in rows], q_emb[rows], top_k)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            found = [e] * len(rows)
+        for i, h in zip(rows, found):
+            hits[i] = h
+    return hits
+
+def _search_collection(coll, queries, q_emb, top_k):
+    if not os.path.exists(coll.index_path):
+        # checked here so no IndexManager is created (and kept) for an unbuilt collection
+        raise RuntimeError("Index search failed: Index or meta not found")
+    try:
+        with span("query.search"):
+            hits = search_index_batch(q_emb, top_k=top_k, query_texts=queries,
+                                      index_path=coll.index_path, meta_path=coll.meta_path)
+    except Exception as e:
+        raise RuntimeError(f"Index search failed: {e}")
+    if IMAGE_TOP_K > 0 and image_index_exists(coll.image_index_path, coll.image_meta_path):
+        try:
+            clip_vecs = embed_clip_queries(queries)
+            with span("query.image_search"):
+                image_hits = search_images_batch(queries, IMAGE_TOP_K, query_vecs=clip_vecs,
+                                                 index_path=coll.image_index_path, meta_path=coll.image_meta_path)
+                hits = [fuse_hits(t, i) for t, i in zip(hits, image_hits)]
+        except Exception as e:
+            # the image side is best effort: text answers must not depend on CLIP
+            print(f"Image search failed, answering from text only: {e}")
+    return hits
+
+def embed_clip_queries(queries: List[str]) -> np.ndarray:
+    """CLIP text-tower embeddings for the image index, through the same query LRU."""
+    embs = [_query_embed_cache.get(("clip", q)) for q in queries]
+    todo = list(dict.fromkeys(q for q, e in zip(queries, embs) if e is None))
+    if todo:
+        with span("query.clip_embed"):
+            new = dict(zip(todo, embed_clip_texts(todo)))
+        for q, v in new.items():
+            _query_embed_cache.put(("clip", q), v)
+        embs = [e if e is not None else new[q] for q, e in zip(queries, embs)]
+    return np.vstack(embs).astype("float32")
+
+def _retrieve_one(query, top_k, collection=None):
+    return retrieve_batch([query], top_k=top_k, collection=collection)[0]
+
+def _lookup_facts(chunks, collection=None):
+    path = facts_path(get_collection(collection).meta_path)
+    if not os.path.exists(path):
+        return None
+    with span("query.facts_lookup"):
+        return get_facts_store(path).lookup(c.get("uid") for c in chunks)
+
+def cache_stats() -> Dict[str, Any]:
+    return {"query_embeddings": _query_embed_cache.stats(), "answers": _answer_cache.stats()}
+
+def clear_caches():
+    _query_embed_cache.clear()
+    _answer_cache.clear()
+
+def _answer_key(query: str, top_k: int, use_openai: bool = False, collection=None):
+    # the version is read before retrieval: if a rebuild lands meanwhile, the entry is
+    # filed under the old version and never served again
+    # the image index version is part of the key too: its hits are in the payload
+    coll = get_collection(collection)
+    return (normalize_query(query), top_k, coll.versions(), bool(use_openai), coll.name)
+
+def remember_answer(key, resp: Dict[str, Any]):
+    """Cache a finished answer payload; failed, truncated or pending generations are not cached."""
+    answer = resp.get("answer")
+    if key[2][0] is None or answer is None or str(answer).startswith("Generation failed"):
+        return
+    if resp.get("finish_reason") not in (None, "eos", "max_tokens"):
+        return
+    _answer_cache.put(key, resp)
+
+def prepare_answer(query: str, top_k: int = 20, retriever=None, collection=None):
+    """
+    answer_query up to (not including) local generation. Returns (cache key, payload);
+    cached and extracted answers are complete, while for the generation fallback
+    payload["answer"] is None and payload["prompt"] is what to generate from.
+    """
+    key = _answer_key(query, top_k, collection=collection)
+    with span("query.answer_cache"):
+        cached = _answer_cache.get(key)
+    if cached is not None:
+        return key, dict(cached)
+    with span("query.retrieve"):
+        results, scores = retriever(query, top_k) if retriever else _retrieve_one(query, top_k, collection)
+    return key, answer_from_results(query, results, scores, top_k=top_k, generate=False, collection=collection)
+
+def answer_query(query: str, top_k: int = 20, use_openai: bool = False, openai_client = None, retriever=None, collection=None) -> Dict[str, Any]:
     """
     High-level flow:
+     - answer cache lookup (normalised query, top_k, index version)
      - embed query and search FAISS (top_k)
      - rerank by keyword boosts
      - attempt specialized extractions (comparison, numeric, repurchase, certification)
      - if found -> return concise extracted answer + citation
-     - else -> assemble prompt with top chunks and generate answer via local generator (or openai if configured)
+     - else -> assemble prompt with top chunks and generate answer via the batched generation worker (or openai if configured)
+    retriever: optional fn(query, top_k) -> (results, scores), e.g. the /query micro-batcher
+    (it must search the same collection)
+    collection: named corpus to answer from (None -> DEFAULT_COLLECTION)
     Returns dict with keys: answer (str), method (extract/generate), citations (list of chunks), retrieved (top chunks)
     """
+    key = _answer_key(query, top_k, use_openai, collection)
+    with span("query.answer_cache"):
+        cached = _answer_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+
     # embed + retrieve
-    q_emb = embed_texts([query])
-    try:
-        results, scores = search_index(q_emb, top_k=top_k)
-    except Exception as e:
-        raise RuntimeError(f"Index search failed: {e}")
+    with span("query.retrieve"):
+        results, scores = retriever(query, top_k) if retriever else _retrieve_one(query, top_k, collection)
+    resp = answer_from_results(query, results, scores, top_k=top_k, use_openai=use_openai, openai_client=openai_client,
+                               collection=collection)
+    remember_answer(key, resp)
+    return dict(resp)
+
+def answer_from_results(query: str, results: List[Dict[str, Any]], scores, top_k: int = 20, use_openai: bool = False, openai_client = None, generate: bool = True,
+                        collection=None) -> Dict[str, Any]:
+    """
+    answer_query steps 2+ on already retrieved chunks.
+    Image hits (CLIP index) are kept out of extraction and the prompt; they are
+    returned under "images" with their fused score.
+    generate=False stops before local generation: the payload then has answer None and the prompt.
+    """
+    text, text_scores, images = [], [], []
+    for c, sc in zip(results, scores):
+        if is_image_chunk(c):
+            images.append(dict(c, score=float(sc)))
+        else:
+            text.append(c)
+            text_scores.append(sc)
+    resp = _answer_from_text(query, text, np.array(text_scores, dtype="float32"), top_k=top_k, use_openai=use_openai,
+                             openai_client=openai_client, generate=generate, collection=collection)
+    resp["images"] = images
+    return resp
 
+def _answer_from_text(query: str, results: List[Dict[str, Any]], scores, top_k: int = 20, use_openai: bool = False, openai_client = None, generate: bool = True,
+                      collection=None) -> Dict[str, Any]:
     # 2) rerank using keyword boosts + base scores
-    ranked = rerank_by_keyword(results, base_scores=scores)
+    with span("query.rerank"):
+        ranked = rerank_by_keyword(results, base_scores=scores)
     best_chunks = [r[0] for r in ranked]  # ordered highest->lowest
+    # facts extracted at index time for these chunks; the extractors fall back to regex on a miss
+    facts = _lookup_facts(best_chunks, collection)
 
     # normalize query lowercase for heuristics
     q_lower = (query or "").strip().lower()
@@ -79,7 +247,8 @@ def answer_query(query: str, top_k: int = 20, use_openai: bool = False, openai_c
     if is_comparison:
         primary_labels = ["revenue", "total revenue", "net revenue"]
         for lab in primary_labels:
-            cur, pri, cchunk = extract_comparison_from_chunks(best_chunks[:max(20, top_k)], lab)
+            with span("query.extract.comparison"):
+                cur, pri, cchunk = extract_comparison_from_chunks(best_chunks[:max(20, top_k)], lab, facts=facts)
             if cur and pri:
                 answer_text = f"${cur} (current) vs ${pri} (prior) — source: {cchunk.get('doc_id')} page {cchunk.get('page')}"
                 citation = {"doc_id": cchunk.get('doc_id'), "page": cchunk.get('page'), "chunk_id": cchunk.get('chunk_id'), "label": lab}
@@ -92,7 +261,8 @@ def answer_query(query: str, top_k: int = 20, use_openai: bool = False, openai_c
 
     # ---------- 4) Repurchase / buyback extraction ----------
     if any(tok in q_lower for tok in ["repurchase", "repurchased", "buyback", "share repurchase", "shares repurchased"]):
-        rep_val, rep_chunk = extract_repurchases(best_chunks[:max(30, top_k)])
+        with span("query.extract.repurchase"):
+            rep_val, rep_chunk = extract_repurchases(best_chunks[:max(30, top_k)], facts=facts)
         if rep_val:
             answer_text = f"{rep_val} (from {rep_chunk.get('doc_id')} page {rep_chunk.get('page')})"
             return {
@@ -104,7 +274,8 @@ def answer_query(query: str, top_k: int = 20, use_openai: bool = False, openai_c
 
     # ---------- 5) Certification / exhibit extraction ----------
     if any(tok in q_lower for tok in ["certification", "certifications", "certify", "certified", "exhibit 32", "exhibit 101"]):
-        cert_text, cert_chunk = extract_certification_text(best_chunks[:max(40, top_k)])
+        with span("query.extract.certification"):
+            cert_text, cert_chunk = extract_certification_text(best_chunks[:max(40, top_k)], facts=facts)
         if cert_text:
             short = cert_text if len(cert_text) < 1200 else cert_text[:1200] + "..."
             return {
@@ -121,7 +292,8 @@ def answer_query(query: str, top_k: int = 20, use_openai: bool = False, openai_c
         "diluted net income per share", "earnings per share", "eps", "total assets",
         "total liabilities"
     ]
-    val, chunk, label = extract_numeric_candidates_from_chunks(best_chunks[:max(12, top_k)], numeric_labels)
+    with span("query.extract.numeric"):
+        val, chunk, label = extract_numeric_candidates_from_chunks(best_chunks[:max(12, top_k)], numeric_labels, facts=facts)
     if val:
         answer_text = f"${val} (from {chunk.get('doc_id')} page {chunk.get('page')})"
         citation = {"doc_id": chunk.get('doc_id'), "page": chunk.get('page'), "chunk_id": chunk.get('chunk_id'), "label": label}
@@ -142,22 +314,27 @@ def answer_query(query: str, top_k: int = 20, use_openai: bool = False, openai_c
     else:
         prompt = assemble_prompt(query, prompt_chunks)
 
+    finish_reason = None
     if use_openai and openai_client:
         # using OpenAI (caller must pass configured client)
-        resp = openai_client.Completion.create(
-            engine="text-davinci-003",
-            prompt=prompt,
-            max_tokens=256,
-            temperature=0.0
-        )
+        with span("query.generate"):
+            resp = openai_client.Completion.create(
+                engine="text-davinci-003",
+                prompt=prompt,
+                max_tokens=256,
+                temperature=0.0
+            )
         out = resp.choices[0].text.strip()
+    elif not generate:
+        # the caller streams the generation itself (see web/app.py /query/stream)
+        out = None
     else:
-        # local generator fallback
-        gen = get_local_generator()
-        # generate; adjust max_length to control verbosity
+        # local generation: batched with concurrent requests, bounded by token / time budgets
         try:
-            gen_out = gen(prompt, max_length=256, do_sample=False)
-            out = gen_out[0].get("generated_text", "").strip()
+            with span("query.generate"):
+                req = get_generation_worker().submit(prompt)
+                out = req.result().strip()
+            finish_reason = req.finish_reason
         except Exception as e:
             # graceful fallback message
             out = f"Generation failed: {e}"
@@ -171,6 +348,7 @@ def answer_query(query: str, top_k: int = 20, use_openai: bool = False, openai_c
         "method": "generation",
         "citations": citations,
         "retrieved": best_chunks[:min(len(best_chunks), 20)],
-        "prompt": prompt
+        "prompt": prompt,
+        "finish_reason": finish_reason,
     }
 
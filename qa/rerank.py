@@ -1,5 +1,7 @@
-# qa/rerank.py 
+# qa/rerank.py
 import re
+import numpy as np
+from config import RERANK_KEYWORD_WEIGHT
 
 KEYWORD_BOOSTS = [
     "revenue", "net revenue", "total revenue", "condensed consolidated statements",
@@ -7,22 +9,41 @@ KEYWORD_BOOSTS = [
     "cash and cash equivalents", "operating income", "eps", "earnings per share", "balance sheet"
 ]
 
+_MONEY_RE = re.compile(r"(revenue|net income|cost of revenue|cash)\s*[\$:]{0,1}\s*[0-9]{1,3}(?:,[0-9]{3})+")
+
+# one pass over the text: the lookahead reports, at every position, the longest keyword
+# starting there (alternatives are tried longest first)
+_KW_RE = re.compile("(?=(" + "|".join(re.escape(k) for k in sorted(KEYWORD_BOOSTS, key=len, reverse=True)) + "))")
+# a match also implies every keyword it contains ("total revenue" -> "revenue")
+_KW_CLOSURE = {k: frozenset(j for j in KEYWORD_BOOSTS if j in k) for k in KEYWORD_BOOSTS}
+
 def keyword_score(text):
+    """+1 per KEYWORD_BOOSTS entry present in text, +2 for a label followed by a money figure."""
     t = (text or "").lower()
-    score = 0.0
-    for kw in KEYWORD_BOOSTS:
-        if kw in t:
-            score += 1.0
-    if re.search(r"(revenue|net income|cost of revenue|cash)\s*[\$:]{0,1}\s*[0-9]{1,3}(?:,[0-9]{3})+", t):
+    found = set()
+    for m in _KW_RE.finditer(t):
+        found |= _KW_CLOSURE[m.group(1)]
+    score = float(len(found))
+    if _MONEY_RE.search(t):
         score += 2.0
-    return float(score)
+    return score
 
 def rerank_by_keyword(retrieved_chunks, base_scores=None):
-    out = []
-    for idx, c in enumerate(retrieved_chunks):
-        b = float(base_scores[idx]) if base_scores is not None else 0.0
-        k = keyword_score(c.get("text", ""))
-        combined = b + 2.0 * k
-        out.append((c, combined))
-    out.sort(key=lambda x: x[1], reverse=True)
-    return out
+    """
+    Sort chunks by base score + RERANK_KEYWORD_WEIGHT * kw / (kw + 1). Base scores are
+    the retrieval scores, in [0, 1] (cosine, or reciprocal rank fusion scaled to 1.0);
+    the keyword term saturates below the weight, so it reorders close candidates but a
+    clearly more relevant chunk stays ahead. Keyword scores come from the "kw_score"
+    feature stored at index time; chunks without it are scored here.
+    Returns [(chunk, combined)] best first (ties keep retrieval order).
+    """
+    n = len(retrieved_chunks)
+    if not n:
+        return []
+    kw = np.array([c.get("kw_score", np.nan) for c in retrieved_chunks], dtype="float32")
+    for i in np.flatnonzero(np.isnan(kw)):
+        kw[i] = keyword_score(retrieved_chunks[i].get("text", ""))
+    base = np.zeros(n, dtype="float32") if base_scores is None else np.asarray(base_scores, dtype="float32")[:n]
+    combined = base + RERANK_KEYWORD_WEIGHT * kw / (kw + 1.0)
+    order = np.argsort(-combined, kind="stable")
+    return [(retrieved_chunks[i], float(combined[i])) for i in order]
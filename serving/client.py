@@ -0,0 +1,222 @@
+# serving/client.py
+"""
+Client side of the shared model server (serving/server.py).
+
+With MMR_MODEL_SERVER set, the model entry points (embed_texts, embed_images,
+embed_clip_texts, ocr_arrays, retrieve_batch, get_generation_worker) forward their
+work to the server instead of loading models and indexes in this process.
+get_model_client() returns the client, or None when models run in-process (no server
+configured, or this process is the server).
+
+Calls are pickled over a Unix socket (multiprocessing.connection), authenticated with
+MMR_MODEL_SERVER_AUTHKEY or the random key the server writes to <socket>.key. Each calling thread
+keeps its own connection and uses it strictly request / response; a generation stream
+gets a connection of its own, which is closed to cancel it.
+"""
+import os, secrets, threading
+from multiprocessing.connection import Client, AuthenticationError
+from config import MODEL_SERVER_SOCKET, MODEL_SERVER_AUTHKEY, MODEL_SERVER_TIMEOUT_S, GEN_MAX_NEW_TOKENS, GEN_TIME_BUDGET_S
+from metrics import span, record
+
+
+def authkey_path(address):
+    return address + ".key"
+
+def write_authkey(address):
+    """New random key in <address>.key, readable by this user only (model server start-up)."""
+    path = authkey_path(address)
+    tmp = f"{path}.tmp.{os.getpid()}"
+    key = secrets.token_hex(32).encode("ascii")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    os.replace(tmp, path)
+    return key
+
+def read_authkey(address):
+    """MMR_MODEL_SERVER_AUTHKEY, else the key the server wrote next to its socket."""
+    if MODEL_SERVER_AUTHKEY:
+        return MODEL_SERVER_AUTHKEY
+    with open(authkey_path(address), "rb") as f:
+        return f.read().strip()
+
+
+class ModelClient:
+
+    def __init__(self, address=MODEL_SERVER_SOCKET, authkey=None, timeout=MODEL_SERVER_TIMEOUT_S):
+        self.address = address
+        self.timeout = timeout
+        self._authkey = authkey
+        self._fixed_key = authkey is not None or bool(MODEL_SERVER_AUTHKEY)
+        self._local = threading.local()
+
+    def _key(self, reload=False):
+        if self._authkey is None or (reload and not self._fixed_key):
+            self._authkey = read_authkey(self.address)
+        return self._authkey
+
+    def connect(self):
+        for attempt in range(2):
+            try:
+                return Client(self.address, family="AF_UNIX", authkey=self._key(reload=attempt > 0))
+            except AuthenticationError as e:
+                # a restarted server writes a new key file: re-read it once
+                if attempt or self._fixed_key:
+                    raise ConnectionError(f"Model server at {self.address} rejected the authkey: {e}")
+            except (OSError, EOFError) as e:
+                raise ConnectionError(f"Model server at {self.address} is not reachable: {e}")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, op, *args, **kwargs):
+        """Run op on the server and return its result. Stage spans measured there are recorded here too."""
+        with span(f"model_server.{op}"):
+            try:
+                conn = self._conn()
+                conn.send((op, args, kwargs))
+            except (OSError, EOFError):
+                # stale connection (the server restarted): reconnect once
+                self._drop()
+                conn = self._conn()
+                conn.send((op, args, kwargs))
+            try:
+                answered = conn.poll(self.timeout)
+                if answered:
+                    status, payload, spans = conn.recv()
+            except (OSError, EOFError) as e:
+                self._drop()
+                raise ConnectionError(f"Model server connection lost during {op}: {e}")
+            if not answered:
+                # the late reply would be read by the next call: start over on a new connection
+                self._drop()
+                raise TimeoutError(f"Model server did not answer {op} within {self.timeout:.0f}s")
+        for stage, seconds in spans:
+            record(stage, seconds)
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+
+class RemoteGenerationRequest:
+    """GenerationRequest stand-in: the prompt is decoded by the model server's GenerationWorker."""
+
+    def __init__(self, client, prompt, max_new_tokens=GEN_MAX_NEW_TOKENS, time_budget=GEN_TIME_BUDGET_S):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.text = ""
+        self.finish_reason = None
+        self.error = None
+        self.first_token_s = None
+        self._cancelled = False
+        self._lock = threading.Lock()
+        try:
+            self._conn = client.connect()
+            self._conn.send(("generate", (prompt,), {"max_new_tokens": max_new_tokens, "time_budget": time_budget}))
+        except (OSError, EOFError) as e:
+            self._conn = None
+            self._finish("error", str(e))
+
+    @property
+    def finished(self):
+        return self.finish_reason is not None
+
+    def cancel(self):
+        """Stop decoding: the server sees the closed connection and cancels its request."""
+        with self._lock:
+            self._cancelled = True
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+    def _finish(self, reason, error=None):
+        if not self.finished:
+            self.finish_reason = reason
+            self.error = error
+
+    def stream(self, timeout=None):
+        """Yield text deltas as they are decoded; raises RuntimeError if generation failed."""
+        while not self.finished:
+            conn = self._conn
+            if conn is None:
+                self._finish("cancelled")
+                break
+            try:
+                if timeout is not None and not conn.poll(timeout):
+                    raise TimeoutError(f"No generated text within {timeout}s")
+                kind, data = conn.recv()
+            except (OSError, EOFError) as e:
+                if self._cancelled:
+                    self._finish("cancelled")
+                else:
+                    self._finish("error", f"Model server connection lost: {e}")
+                break
+            if kind == "token":
+                self.text += data
+                yield data
+            else:
+                self.text = data["text"]
+                self.first_token_s = data.get("first_token_s")
+                self._finish(data["finish_reason"], data.get("error"))
+        self.cancel()
+        if self.error is not None:
+            raise RuntimeError(self.error)
+
+    def result(self, timeout=None):
+        for _ in self.stream(timeout):
+            pass
+        return self.text
+
+
+class RemoteGenerationWorker:
+    """get_generation_worker() stand-in that hands every prompt to the model server."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, prompt, max_new_tokens=None, time_budget=None):
+        return RemoteGenerationRequest(self.client, prompt,
+                                       max_new_tokens=max_new_tokens or GEN_MAX_NEW_TOKENS,
+                                       time_budget=time_budget or GEN_TIME_BUDGET_S)
+
+    def generate(self, prompt, max_new_tokens=None, time_budget=None):
+        return self.submit(prompt, max_new_tokens, time_budget).result()
+
+    @property
+    def backend(self):
+        return self.stats()["backend"]
+
+    def stats(self):
+        return dict(self.client.call("generation_stats"), model_server=self.client.address)
+
+
+_client = None
+_client_lock = threading.Lock()
+_serving = False
+
+def serve_locally():
+    """Called by the model server process: its model entry points must never forward."""
+    global _serving
+    _serving = True
+
+def get_model_client():
+    global _client
+    if _serving or not MODEL_SERVER_SOCKET:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ModelClient()
+    return _client
@@ -0,0 +1,191 @@
+# serving/server.py
+"""
+Shared model server: one process holds the text embedder, CLIP, EasyOCR, the
+generator and the resident indexes for every web worker on the machine.
+
+    python -m serving.server --socket /run/mmr/models.sock
+    MMR_MODEL_SERVER=/run/mmr/models.sock uvicorn web.app:app --workers 8
+
+Workers connect over the Unix socket (serving/client.py). Concurrent calls are served
+on one thread per connection, and the batching already in place still applies across
+workers: retrieval goes through this process's QueryBatcher, generation through its
+GenerationWorker. Model memory is paid once, so HTTP concurrency can grow with the
+worker count.
+"""
+import os, socket, threading
+from multiprocessing.connection import Listener, AuthenticationError
+import typer
+
+from config import MODEL_SERVER_SOCKET, MODEL_SERVER_AUTHKEY, MODEL_SERVER_WARMUP
+from metrics import trace, extend_trace
+from serving.client import serve_locally, write_authkey
+
+
+class ModelServer:
+    """Serves the model ops to web workers, one thread per connection."""
+
+    def __init__(self, address=MODEL_SERVER_SOCKET, authkey=MODEL_SERVER_AUTHKEY, warmup_stages=MODEL_SERVER_WARMUP):
+        """authkey: empty -> a random key is written to <address>.key at start-up."""
+        from web.warmup import Warmup
+        if not address:
+            raise ValueError("No socket path: pass --socket or set MMR_MODEL_SERVER")
+        self.address = address
+        self.authkey = authkey
+        self.warmup = Warmup(warmup_stages)
+        self.connections = 0
+        self._lock = threading.Lock()
+        self.ops = self._ops()
+
+    def _ops(self):
+        from embeddings.embedder import embed_texts, embed_images, embed_clip_texts, text_backend
+        from ingest.ocr import _ocr_batch
+        from qa.generation import get_generation_worker
+        return {
+            "ping": lambda: {"pid": os.getpid()},
+            "status": self.status,
+            "text_backend": text_backend,
+            "embed_texts": embed_texts,
+            "embed_images": embed_images,
+            "embed_clip_texts": embed_clip_texts,
+            "ocr_batch": _ocr_batch,
+            "retrieve_batch": self._retrieve_batch,
+            "generation_stats": lambda: get_generation_worker().stats(),
+        }
+
+    def _retrieve_batch(self, queries, top_k=20, collection=None, return_exceptions=False):
+        """retrieve_batch through this process's micro-batcher, so queries from all workers share batches."""
+        from qa.batcher import get_query_batcher
+        names = list(collection) if isinstance(collection, (list, tuple)) else [collection] * len(queries)
+        batcher = get_query_batcher()
+        futs = [batcher.submit(q, top_k, c) for q, c in zip(queries, names)]
+        out, seen = [], set()
+        for fut in futs:
+            try:
+                out.append(fut.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                out.append(e)
+            # every query's own queue wait, each batch's stage spans once
+            extend_trace(fut.spans[:1])
+            if id(fut.batch_spans) not in seen:
+                seen.add(id(fut.batch_spans))
+                extend_trace(fut.batch_spans)
+        return out
+
+    def status(self):
+        from embeddings.embedder import text_backend
+        from index.collections import get_registry
+        from qa.batcher import get_query_batcher
+        from qa.generator import cache_stats
+        from qa.generation import get_generation_worker
+        return {
+            "pid": os.getpid(),
+            "address": self.address,
+            "connections": self.connections,
+            "warmup": self.warmup.to_dict(),
+            "collections": get_registry().stats(),
+            "query_batching": get_query_batcher().stats(),
+            "query_cache": cache_stats(),
+            "embed_backend": text_backend(),
+            "generation": get_generation_worker().stats(),
+        }
+
+    def _generate(self, conn, prompt, max_new_tokens=None, time_budget=None):
+        from qa.generation import get_generation_worker
+        req = get_generation_worker().submit(prompt, max_new_tokens, time_budget)
+        try:
+            try:
+                for delta in req.stream():
+                    conn.send(("token", delta))
+            except RuntimeError:
+                pass  # req.error is reported in "done"
+            conn.send(("done", {"text": req.text, "finish_reason": req.finish_reason,
+                                "error": req.error, "first_token_s": req.first_token_s}))
+        except (OSError, EOFError):
+            pass  # the client went away (or cancelled)
+        finally:
+            req.cancel()
+
+    def _handle(self, conn):
+        with self._lock:
+            self.connections += 1
+        try:
+            while True:
+                try:
+                    op, args, kwargs = conn.recv()
+                except (OSError, EOFError):
+                    return
+                if op == "generate":
+                    self._generate(conn, *args, **kwargs)
+                    continue
+                with trace() as spans:
+                    try:
+                        fn = self.ops.get(op)
+                        if fn is None:
+                            raise ValueError(f"Unknown model server op {op!r}")
+                        reply = ("ok", fn(*args, **kwargs), spans)
+                    except Exception as e:
+                        reply = ("error", f"{type(e).__name__}: {e}", spans)
+                try:
+                    conn.send(reply)
+                except (OSError, EOFError):
+                    return
+                except Exception as e:
+                    # result that does not pickle
+                    conn.send(("error", f"{type(e).__name__}: {e}", []))
+        finally:
+            with self._lock:
+                self.connections -= 1
+            conn.close()
+
+    def _check_address(self):
+        if not os.path.exists(self.address):
+            return
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(self.address)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(self.address)  # socket file left behind by a server that is gone
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"A model server is already listening on {self.address}")
+
+    def serve_forever(self):
+        serve_locally()
+        self._check_address()
+        os.makedirs(os.path.dirname(os.path.abspath(self.address)), mode=0o700, exist_ok=True)
+        # the socket and the key file are created owner-only: no window in which another
+        # local user could connect (umask is process-wide; nothing else runs yet)
+        old_umask = os.umask(0o077)
+        try:
+            if not self.authkey:
+                self.authkey = write_authkey(self.address)
+            listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(old_umask)
+        self.warmup.start()
+        print(f"Model server (pid {os.getpid()}) listening on {self.address}")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    print(f"Rejected model server connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), name="model-server-conn", daemon=True).start()
+        finally:
+            listener.close()
+
+
+app = typer.Typer()
+
+@app.command()
+def main(socket: str = typer.Option(MODEL_SERVER_SOCKET, help="Unix socket path (default: MMR_MODEL_SERVER)"),
+         warmup: str = typer.Option(",".join(MODEL_SERVER_WARMUP), help="Warm-up stages to run at start ('' for none)")):
+    stages = [s.strip() for s in warmup.split(",") if s.strip()]
+    ModelServer(socket, warmup_stages=stages).serve_forever()
+
+if __name__ == "__main__":
+    app()
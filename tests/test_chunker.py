@@ -0,0 +1,99 @@
+# tests/test_chunker.py
+import pytest
+from chunking.chunker import PageChunker, chunk_table, chunk_text
+from embeddings.embedder import text_token_spans
+
+STATEMENT = [
+    ["(in millions, except per share data)", "Three Months Ended", None, None, None],
+    [None, "April 28, 2024", None, "April 30, 2023", None],
+    ["Revenue", "$", "26,044", "$", "7,192"],
+    ["Operating expenses", None, None, None, None],
+    ["Research and development", None, "2,720", None, "1,875"],
+    ["Total operating expenses", None, "3,497", None, "2,508"],
+    ["Net income", "$", "14,881", "$", "2,043"],
+]
+
+
+def test_statement_rows_carry_header_and_periods():
+    chunks = chunk_table(STATEMENT, 3, "d", table_idx=2)
+    texts = [c["text"] for c in chunks]
+    header = "(in millions, except per share data) | Three Months Ended April 28, 2024 | Three Months Ended April 30, 2023"
+    assert texts[0] == f"Revenue | $26,044 | $7,192\n{header}"
+    assert texts[1].startswith("Operating expenses: Research and development | 2,720 | 1,875\n")
+    assert texts[3].startswith("Net income | $14,881 | $2,043\n")
+    assert all(c["type"] == "table_row" for c in chunks)
+    assert len({c["chunk_id"] for c in chunks}) == len(chunks)
+
+
+def test_small_integer_rows_are_data_not_header():
+    table = [["Metric", "FY24", "FY23"], ["Units sold", "512", "480"], ["Returns", "12", "10"], ["Net", "1,500", "470"]]
+    texts = [c["text"] for c in chunk_table(table, 1, "d")]
+    assert texts == ["Units sold | 512 | 480\nMetric | FY24 | FY23",
+                     "Returns | 12 | 10\nMetric | FY24 | FY23",
+                     "Net | 1,500 | 470\nMetric | FY24 | FY23"]
+
+
+def test_table_without_figures_uses_first_row_as_header():
+    table = [["Exhibit", "Description"], ["31.1", "Certification of CEO"], ["32", "Section 906 certification"]]
+    texts = [c["text"] for c in chunk_table(table, 9, "d")]
+    assert texts == ["31.1 | Certification of CEO\nExhibit | Description",
+                     "32 | Section 906 certification\nExhibit | Description"]
+
+
+def _sentences(n, page_tag="s"):
+    return [f"Sentence {page_tag}{i} reports revenue growth in the quarter." for i in range(n)]
+
+
+def _tokens(text):
+    return len(text_token_spans([text])[0])
+
+
+def test_text_chunks_stay_within_max_tokens():
+    chunks = chunk_text(" ".join(_sentences(40)), 1, "d", max_tokens=40, overlap_tokens=10)
+    assert len(chunks) > 1
+    for c in chunks:
+        assert c["tokens"] <= 40
+        assert _tokens(c["text"]) <= 40
+
+
+def test_overlap_sentences_start_the_next_chunk():
+    sents = _sentences(20)
+    per = _tokens(sents[0])
+    chunks = chunk_text(" ".join(sents), 1, "d", max_tokens=3 * per, overlap_tokens=per)
+    for prev, nxt in zip(chunks, chunks[1:]):
+        last = [s for s in sents if s in prev["text"]][-1]
+        assert nxt["text"].startswith(last)
+
+
+def test_oversized_sentence_is_windowed():
+    long = " ".join(f"word{i}" for i in range(200)) + "."
+    chunks = chunk_text(long, 1, "d", max_tokens=30, overlap_tokens=5)
+    assert len(chunks) > 1
+    assert all(c["tokens"] <= 30 for c in chunks)
+    assert chunks[0]["text"].startswith("word0 ")
+    assert chunks[-1]["text"].endswith("word199.")
+
+
+def test_chunk_across_page_break_lists_pages_and_numbering_is_per_page():
+    chunker = PageChunker(max_tokens=200, overlap_tokens=0)
+    chunker.doc_id = "d"
+    out = chunker.add_text("First page ends here.", 1)
+    out += chunker.add_text("Second page starts here.", 2)
+    out += chunker.close()
+    assert len(out) == 1
+    assert out[0]["page"] == 1 and out[0]["pages"] == [1, 2]
+
+    chunker = PageChunker(max_tokens=_tokens(_sentences(1)[0]), overlap_tokens=0)
+    chunker.doc_id = "d"
+    out = chunker.add_text(" ".join(_sentences(2, "a")), 1)
+    out += chunker.add_text(" ".join(_sentences(2, "b")), 2)
+    out += chunker.close()
+    assert [c["chunk_id"] for c in out] == ["p1_c1", "p1_c2", "p2_c1", "p2_c2"]
+    assert all("pages" not in c for c in out)
+
+
+def test_overlap_must_be_below_max_tokens():
+    with pytest.raises(ValueError):
+        PageChunker(max_tokens=32, overlap_tokens=32)
+    with pytest.raises(ValueError):
+        PageChunker(max_tokens=32, overlap_tokens=40)
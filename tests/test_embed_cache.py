@@ -0,0 +1,18 @@
+# tests/test_embed_cache.py
+import numpy as np
+from embeddings.cache import EmbeddingCache, text_key
+
+
+def test_interrupted_append_does_not_shift_rows(tmp_path):
+    cache = EmbeddingCache("m", cache_dir=str(tmp_path))
+    a, b, c = (text_key(t) for t in ("a", "b", "c"))
+    cache.put([a], np.full((1, 4), 1.0, dtype="float32"))
+    # a put killed after writing its vector but before its key
+    with open(cache.vecs_path, "ab") as f:
+        f.write(np.full((1, 4), 9.0, dtype="float32").tobytes())
+    cache.put([b, c], np.array([[2.0] * 4, [3.0] * 4], dtype="float32"))
+
+    fresh = EmbeddingCache("m", cache_dir=str(tmp_path))
+    hit_pos, vecs, missing = fresh.get([a, b, c])
+    assert hit_pos == [0, 1, 2] and not missing
+    assert vecs[:, 0].tolist() == [1.0, 2.0, 3.0]
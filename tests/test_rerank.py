@@ -0,0 +1,29 @@
+# tests/test_rerank.py
+from index.sparse_index import reciprocal_rank_fusion
+from qa.rerank import rerank_by_keyword
+
+
+def test_relevance_outranks_keyword_on_cosine_scores():
+    weak = {"chunk_id": "weak", "text": "Total revenue was $1,000 million."}
+    strong = {"chunk_id": "strong", "text": "Data Center sales grew on Hopper demand."}
+    ranked = rerank_by_keyword([weak, strong], base_scores=[0.2, 0.9])
+    assert [c["chunk_id"] for c, _ in ranked] == ["strong", "weak"]
+
+
+def test_relevance_outranks_keyword_on_fused_scores():
+    # strong: first in both the dense and the BM25 ranking; weak: 30th in one of them
+    dense = [1] + list(range(100, 128)) + [2]
+    uids, scores = reciprocal_rank_fusion([dense, [1]], k=60)
+    assert scores[0] == 1.0
+    chunks = {1: {"chunk_id": "strong", "text": "Data Center sales grew on Hopper demand."},
+              2: {"chunk_id": "weak", "text": "Total revenue was $1,000 million."}}
+    pick = [i for i, u in enumerate(uids) if int(u) in chunks]
+    ranked = rerank_by_keyword([chunks[int(uids[i])] for i in pick], base_scores=scores[pick])
+    assert [c["chunk_id"] for c, _ in ranked] == ["strong", "weak"]
+
+
+def test_keyword_breaks_near_ties():
+    plain = {"chunk_id": "plain", "text": "Gross margin discussion."}
+    labelled = {"chunk_id": "labelled", "text": "Net income $14,881 million."}
+    ranked = rerank_by_keyword([plain, labelled], base_scores=[0.62, 0.60])
+    assert [c["chunk_id"] for c, _ in ranked] == ["labelled", "plain"]
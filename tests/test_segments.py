@@ -0,0 +1,103 @@
+# tests/test_segments.py
+import os
+import threading
+import numpy as np
+import pytest
+from index import faiss_index as fi
+from index.sparse_index import SparseIndex
+
+WORDS = "revenue income margin cash assets hopper gaming data center automotive dividend shares".split()
+
+
+def _doc(doc_id, n, seed):
+    rng = np.random.default_rng(seed)
+    chunks = [{"doc_id": doc_id, "chunk_id": f"c{i}", "page": 1,
+               "text": " ".join(rng.choice(WORDS, size=int(rng.integers(3, 12))))} for i in range(n)]
+    return rng.standard_normal((n, 16)).astype("float32"), chunks
+
+
+def _paths(tmp_path, name):
+    d = tmp_path / name
+    d.mkdir()
+    return str(d / "faiss.index"), str(d / "meta")
+
+
+def _results(index_path, meta_path, queries, texts):
+    fi.release_index_manager(index_path, meta_path)
+    mgr = fi.get_index_manager(index_path, meta_path)
+    dense = [[c["uid"] for c in r] for r, _ in mgr.search_batch(queries, top_k=8)]
+    sparse = SparseIndex(meta_path + ".bm25")
+    bm25 = [sparse.search(t, 8) for t in texts]
+    return dense, [u.tolist() for u, _ in bm25], [np.round(s, 5).tolist() for _, s in bm25]
+
+
+@pytest.fixture
+def no_auto_merge(monkeypatch):
+    monkeypatch.setattr(fi, "INDEX_MERGE_RATIO", 1e9)
+    monkeypatch.setattr(fi, "INDEX_MAX_SEGMENTS", 10 ** 6)
+
+
+def test_segments_match_a_fresh_build(tmp_path, no_auto_merge):
+    seg_paths, fresh_paths = _paths(tmp_path, "seg"), _paths(tmp_path, "fresh")
+    docs = {f"d{i}": _doc(f"d{i}", 20, i) for i in range(4)}
+    for doc_id, (vecs, chunks) in docs.items():
+        fi.add_document(vecs, chunks, doc_id, index_path=seg_paths[0], meta_path=seg_paths[1])
+    base_stat = os.stat(seg_paths[0])
+    docs["d1"] = _doc("d1", 15, 99)  # replaced, with fewer chunks
+    fi.add_document(*docs["d1"], "d1", index_path=seg_paths[0], meta_path=seg_paths[1])
+    fi.remove_document("d2", index_path=seg_paths[0], meta_path=seg_paths[1])
+    del docs["d2"]
+    # adds, replaces and removes never rewrite the base index
+    assert os.stat(seg_paths[0]).st_ino == base_stat.st_ino
+
+    vecs = np.vstack([v for v, _ in docs.values()])
+    chunks = [c for _, cs in docs.values() for c in cs]
+    fi.build_faiss_index(vecs, chunks, index_path=fresh_paths[0], meta_path=fresh_paths[1])
+
+    queries = np.random.default_rng(7).standard_normal((5, 16)).astype("float32")
+    texts = ["revenue margin", "hopper data center", "dividend shares cash"]
+    expected = _results(*fresh_paths, queries, texts)
+    assert _results(*seg_paths, queries, texts) == expected
+    assert fi.compact_index(*seg_paths, full=False) == "deltas"
+    assert _results(*seg_paths, queries, texts) == expected
+    assert fi.compact_index(*seg_paths, full=True) == "full"
+    assert _results(*seg_paths, queries, texts) == expected
+    info = fi.MetaStore(seg_paths[1]).info
+    assert not info["segments"] and not info.get("tomb")
+    sparse = SparseIndex(seg_paths[1] + ".bm25")
+    assert len(sparse.segments) == 1
+
+
+def test_compaction_becomes_due(tmp_path, monkeypatch):
+    monkeypatch.setattr(fi, "INDEX_MERGE_RATIO", 1e9)
+    monkeypatch.setattr(fi, "INDEX_MAX_SEGMENTS", 2)
+    index_path, meta_path = _paths(tmp_path, "due")
+    for i in range(4):
+        fi.add_document(*_doc(f"d{i}", 5, i), f"d{i}", index_path=index_path, meta_path=meta_path)
+    for t in threading.enumerate():
+        if t.name == "mmr-compact":
+            t.join()
+    info = fi.MetaStore(meta_path).info
+    assert len(info["segments"]) <= 2
+    assert len(fi.MetaStore(meta_path)) == 20
+
+
+def test_flushes_never_read_the_base_index(tmp_path, monkeypatch, no_auto_merge):
+    index_path, meta_path = _paths(tmp_path, "stream")
+    fi.add_document(*_doc("d0", 20, 0), "d0", index_path=index_path, meta_path=meta_path)
+    read_index = fi.faiss.read_index
+
+    def guarded(path, *args):
+        assert path != index_path, "an append loaded the base index"
+        return read_index(path, *args)
+
+    monkeypatch.setattr(fi.faiss, "read_index", guarded)
+    # streaming ingest: remove, then append the document flush by flush
+    fi.remove_document("d1", index_path=index_path, meta_path=meta_path)
+    vecs, chunks = _doc("d1", 30, 1)
+    for i in range(0, 30, 10):
+        fi.add_document(vecs[i:i + 10], chunks[i:i + 10], "d1", index_path=index_path,
+                        meta_path=meta_path, replace=False)
+    info = fi.MetaStore(meta_path).info
+    assert [s["n"] for s in info["segments"]] == [10, 10, 10]
+    assert len(fi.MetaStore(meta_path)) == 50
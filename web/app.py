@@ -1,19 +1,30 @@
 # web/app.py
-import os, io, pickle
+import os, json
 from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
 from starlette.middleware.cors import CORSMiddleware
-from ingest.pdf_ingest import ingest_pdf
-from chunking.chunker import chunk_text, chunk_table
-from embeddings.embedder import embed_texts
-from index.faiss_index import build_faiss_index, load_index, search_index
+from chunking.store import remove_document_chunks, list_documents
+from index.builder import sync_index
+from index.faiss_index import remove_document, manifest_documents
+from index.image_index import remove_document_images
+from index.collections import get_collection, get_registry, list_collections
+from qa.facts import get_facts_store, facts_path, TEXT_FEATURES
+from pipeline.ingest import ingest_to_store
+from pipeline.streaming import stream_pdf_to_index
+from web.jobs import JobManager
+from web.warmup import Warmup
 # from qa.generator import retrieve, assemble_prompt, generate_answer
-from config import RAW_DIR, CHUNKS_PATH, FAISS_INDEX_PATH, META_PATH, INDEX_DIR
-from qa.generator import answer_query
-import numpy as np
+from config import QUERY_TOP_K
+from qa.generator import answer_query, prepare_answer, remember_answer, cache_stats
+from qa.generation import get_generation_worker
+from embeddings.embedder import text_backend
+from qa.batcher import get_query_batcher
+from serving.client import get_model_client
+import metrics
+from functools import partial
 
 app = FastAPI(title="Multi-Modal RAG QA")
 
@@ -30,115 +41,283 @@ TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 os.makedirs(TEMPLATES_DIR, exist_ok=True)
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
+# ingestion / index builds run here, never on the event loop
+jobs = JobManager()
+# index + models are loaded in the background after boot; /ready reports when done
+warmup = Warmup()
+
+@app.on_event("startup")
+def start_warmup():
+    warmup.start()
+
+def _collection(name):
+    """The request's collection, or a 400 response for an invalid name."""
+    try:
+        return get_collection(name or None), None
+    except ValueError as e:
+        return None, JSONResponse({"status": "error", "message": str(e)}, status_code=400)
+
+def _accounted(coll, fn):
+    """
+    Wrap a job so the indexes it loaded are counted against the collection memory budget,
+    or, behind a model server (which holds the indexes), released again.
+    """
+    def run(*args, **kwargs):
+        res = fn(*args, **kwargs)
+        if get_model_client() is not None:
+            coll.unload()
+        else:
+            get_registry().acquire(coll.name)
+        return res
+    return run
+
 # Simple index page (will render template below)
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-# Upload PDF
+# Upload PDF: the file is saved here, ingestion runs as a background job
 @app.post("/upload")
-async def upload(file: UploadFile = File(...)):
+async def upload(file: UploadFile = File(...), stream: bool = Form(False), collection: str = Form(None)):
+    coll, err = _collection(collection)
+    if err:
+        return err
     contents = await file.read()
-    save_path = os.path.join(RAW_DIR, file.filename)
-    os.makedirs(RAW_DIR, exist_ok=True)
+    save_path = os.path.join(coll.raw_dir, os.path.basename(file.filename))
+    os.makedirs(coll.raw_dir, exist_ok=True)
     with open(save_path, "wb") as f:
         f.write(contents)
-    # run ingest immediately
-    docs = ingest_pdf(save_path)
-    # docs = ingest_pdf(save_path, save_page_images=True, ocr_every_page=True, dpi=150, max_pages=50) # this is for all pages set as 50 
-    # chunk and save chunks
-    chunks = []
-    for p in docs:
-        chunks.extend(chunk_text(p['text'], p['page'], p['doc_id']))
-        for t in p['tables']:
-            chunks.extend(chunk_table(t, p['page'], p['doc_id']))
-        for img in p['images']:
-            chunks.append({"doc_id": p['doc_id'], "page": p['page'], "chunk_id": f"p{p['page']}_img", "type":"image", "text": f"[Image: {img}]", "image_path": img})
-    with open(CHUNKS_PATH, "wb") as f:
-        pickle.dump(chunks, f)
-    return JSONResponse({"status":"ok", "message": f"Saved {len(chunks)} chunks", "file": file.filename})
-
-# Build index
+    params = {"file": file.filename, "collection": coll.name}
+    if stream:
+        # ingest + embed + index in one pass; pages become searchable as they are indexed
+        job = jobs.submit("stream_ingest", _accounted(coll, stream_pdf_to_index), save_path, params=params,
+                          image_dir=coll.raw_dir, **coll.index_paths())
+    else:
+        # chunk and store this document's chunks (other documents are kept)
+        job = jobs.submit("ingest", ingest_to_store, save_path, params=params,
+                          chunks_dir=coll.chunks_dir, image_dir=coll.raw_dir)
+    return JSONResponse({"status":"queued", "message": f"Ingesting {file.filename}", "file": file.filename,
+                         "collection": coll.name, "job_id": job.id})
+
+# Build index (background job)
 @app.post("/build_index")
-async def build_index():
-    if not os.path.exists(CHUNKS_PATH):
-        return JSONResponse({"status":"error","message":"No chunks found. Upload a PDF first."})
-    with open(CHUNKS_PATH, "rb") as f:
-        chunks = pickle.load(f)
-    texts = [c.get("text","") for c in chunks]
-    vecs = embed_texts(texts)
-    vecs = np.array(vecs).astype("float32")
-    build_faiss_index(vecs, chunks)
-    return JSONResponse({"status":"ok","message":"Index built"})
-
-from fastapi import Form
-from fastapi.responses import JSONResponse
+async def build_index(collection: str = Form(None)):
+    coll, err = _collection(collection)
+    if err:
+        return err
+    if not list_documents(coll.chunks_dir, coll.legacy_chunks):
+        return JSONResponse({"status":"error","message":f"No chunks found in collection {coll.name}. Upload a PDF first."})
+    # embeds only documents that are new or changed since the last build
+    job = jobs.submit("build_index", _accounted(coll, sync_index), params={"collection": coll.name}, **coll.index_paths())
+    return JSONResponse({"status":"queued","message":"Index build started","collection":coll.name,"job_id":job.id})
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"status":"error","message":f"Unknown job {job_id}"}, status_code=404)
+    return JSONResponse(job)
+
+@app.get("/jobs")
+def job_list():
+    return JSONResponse({"jobs": jobs.list()})
+
+# Remove a document from the chunk store and the index
+@app.delete("/documents/{doc_id}")
+def delete_document(doc_id: str, collection: str = None):
+    coll, err = _collection(collection)
+    if err:
+        return err
+    n = remove_document(doc_id, coll.index_path, coll.meta_path, features=TEXT_FEATURES)
+    n_images = remove_document_images(doc_id, coll.image_index_path, coll.image_meta_path)
+    stored = remove_document_chunks(doc_id, coll.chunks_dir)
+    if not n and not n_images and not stored:
+        return JSONResponse({"status":"error","message":f"Unknown document {doc_id}"})
+    return JSONResponse({"status":"ok","message":f"Removed {n} chunks and {n_images} images","doc_id":doc_id})
+
+# Facts extracted at index time, by label (e.g. /facts?label=total revenue)
+@app.get("/facts")
+def facts(label: str, doc_id: str = None, collection: str = None):
+    coll, err = _collection(collection)
+    if err:
+        return err
+    path = facts_path(coll.meta_path)
+    if not os.path.exists(path):
+        return JSONResponse({"status":"error","message":"Index not built yet."})
+    return JSONResponse({"label": label, "facts": get_facts_store(path).find(label, doc_id)})
+
 SNIPPET_CHARS = 600
 
+def _response_payload(q, resp):
+    """Canonical /query payload: answer, method, citations and short retrieved snippets."""
+    # canonicalize fields
+    method = resp.get("method", "unknown")
+    answer = resp.get("answer", "")
+    prompt = resp.get("prompt", None)
+
+    # Build compact citation objects for UI
+    citations = resp.get("citations", [])
+    # citations may be already in different shapes (extraction returned 'citation' single item)
+    if not isinstance(citations, list):
+        # try to wrap single citation
+        citations = [citations] if citations else []
+    if not citations and resp.get("citation"):
+        citations = [resp["citation"]]
+
+    # Build retrieved snippet list (for debugging): include doc_id, page, chunk_id, short text
+    retrieved = []
+    raw_retrieved = resp.get("retrieved", [])  # list of chunk dicts
+    for c in raw_retrieved:
+        if not c:
+            continue
+        txt = c.get("text", "")
+        snippet = txt.strip()
+        if len(snippet) > SNIPPET_CHARS:
+            snippet = snippet[:SNIPPET_CHARS].rsplit(" ", 1)[0] + "..."
+        retrieved.append({
+            "doc_id": c.get("doc_id"),
+            "page": c.get("page"),
+            "chunk_id": c.get("chunk_id"),
+            "type": c.get("type"),
+            "score": c.get("score"),   # optional, may be None
+            "snippet": snippet
+        })
+
+    # figure / page-image hits from the CLIP image index
+    images = [{
+        "doc_id": c.get("doc_id"),
+        "page": c.get("page"),
+        "chunk_id": c.get("chunk_id"),
+        "type": c.get("type"),
+        "image_path": c.get("image_path"),
+        "score": c.get("score"),
+    } for c in resp.get("images", []) if c]
+
+    response_payload = {
+        "query": q,
+        "answer": answer,
+        "method": method,
+        "citations": citations,
+        "retrieved": retrieved,
+        "images": images,
+    }
+    # include prompt only when present (mainly for generation debugging)
+    if prompt:
+        response_payload["prompt"] = prompt
+    return response_payload
+
 @app.post("/query")
-async def query(q: str = Form(...)):
+def query(q: str = Form(...), debug: bool = Form(False), collection: str = Form(None)):
     """
-    Query endpoint:
-     - calls answer_query(...)
+    Query endpoint (plain def: FastAPI runs it in its threadpool, off the event loop):
+     - calls answer_query(...); repeated questions are served from its answer cache
+     - retrieval goes through the micro-batcher (concurrent queries share one embed + search)
      - returns answer, method, citations, and a short list of retrieved chunk snippets
      - includes the prompt when generation is used (for debugging)
+     - debug=true adds "timings": per-stage ms for this request (spans nest; see /metrics)
+     - collection picks the corpus (default: MMR_COLLECTION)
     """
+    coll, err = _collection(collection)
+    if err:
+        return err
     try:
-        resp = answer_query(q, top_k=20, use_openai=False, openai_client=None)
-
-        # canonicalize fields
-        method = resp.get("method", "unknown")
-        answer = resp.get("answer", "")
-        prompt = resp.get("prompt", None)
-
-        # Build compact citation objects for UI
-        citations = resp.get("citations", [])
-        # citations may be already in different shapes (extraction returned 'citation' single item)
-        if not isinstance(citations, list):
-            # try to wrap single citation
-            citations = [citations] if citations else []
-
-        # Build retrieved snippet list (for debugging): include doc_id, page, chunk_id, short text
-        retrieved = []
-        raw_retrieved = resp.get("retrieved", [])  # list of chunk dicts
-        for c in raw_retrieved:
-            if not c:
-                continue
-            txt = c.get("text", "")
-            snippet = txt.strip()
-            if len(snippet) > SNIPPET_CHARS:
-                snippet = snippet[:SNIPPET_CHARS].rsplit(" ", 1)[0] + "..."
-            retrieved.append({
-                "doc_id": c.get("doc_id"),
-                "page": c.get("page"),
-                "chunk_id": c.get("chunk_id"),
-                "type": c.get("type"),
-                "score": c.get("score"),   # optional, may be None
-                "snippet": snippet
-            })
-
-        response_payload = {
-            "query": q,
-            "answer": answer,
-            "method": method,
-            "citations": citations,
-            "retrieved": retrieved,
-        }
-        # include prompt only when present (mainly for generation debugging)
-        if prompt:
-            response_payload["prompt"] = prompt
-
-        return JSONResponse(response_payload)
+        with metrics.trace() as spans, metrics.span("query.total"):
+            resp = answer_query(q, top_k=QUERY_TOP_K, use_openai=False, openai_client=None, collection=coll.name,
+                                retriever=partial(get_query_batcher().retrieve, collection=coll.name))
+        payload = _response_payload(q, resp)
+        if debug:
+            total = next((sec for stage, sec in reversed(spans) if stage == "query.total"), None)
+            payload["timings"] = metrics.breakdown(spans, total_s=total)
+        return JSONResponse(payload)
 
     except Exception as e:
         # keep error messages concise but informative for debugging
         return JSONResponse({"status": "error", "message": str(e)})
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@app.post("/query/stream")
+def query_stream(q: str = Form(...), collection: str = Form(None)):
+    """
+    Server-sent events version of /query:
+     - "meta": method, citations, retrieved snippets (answer included for extractions / cache hits)
+     - "token": {"text": delta} while a generated answer is decoded
+     - "done": the final payload, plus finish_reason for generations
+     - "error": {"message"}
+    """
+    coll, err = _collection(collection)
+    if err:
+        return err
+
+    def events():
+        try:
+            key, resp = prepare_answer(q, top_k=QUERY_TOP_K, collection=coll.name,
+                                       retriever=partial(get_query_batcher().retrieve, collection=coll.name))
+        except Exception as e:
+            yield _sse("error", {"message": str(e)})
+            return
+        yield _sse("meta", _response_payload(q, resp))
+        if resp.get("answer") is not None:
+            yield _sse("done", _response_payload(q, resp))
+            return
+        req = get_generation_worker().submit(resp["prompt"])
+        try:
+            for delta in req.stream():
+                yield _sse("token", {"text": delta})
+        except Exception as e:
+            yield _sse("error", {"message": f"Generation failed: {e}"})
+            return
+        finally:
+            # client disconnects close this generator: stop decoding for it
+            req.cancel()
+        resp = dict(resp, answer=req.text.strip(), finish_reason=req.finish_reason)
+        remember_answer(key, resp)
+        yield _sse("done", dict(_response_payload(q, resp), finish_reason=req.finish_reason))
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 
 # simple health
 @app.get("/status")
-def status():
-    idx_exists = os.path.exists(FAISS_INDEX_PATH)
-    chunks_exists = os.path.exists(CHUNKS_PATH)
-    return {"index": idx_exists, "chunks": chunks_exists}
+def status(collection: str = None):
+    coll, err = _collection(collection)
+    if err:
+        return err
+    idx_exists = os.path.exists(coll.index_path)
+    # a liveness check: nothing is loaded, evicted or written for it (a legacy chunks.pkl
+    # is migrated by the next ingest / build, not here)
+    stored = list_documents(coll.chunks_dir, legacy_path=None)
+    legacy = bool(coll.legacy_chunks) and os.path.exists(coll.legacy_chunks)
+    out = {"collection": coll.name, "index": idx_exists, "chunks": bool(stored) or legacy, "documents": sorted(stored),
+           "indexed": sorted(manifest_documents(coll.meta_path)), "ready": warmup.ready}
+    client = get_model_client()
+    if client is not None:
+        # models, indexes and their caches live in the model server
+        try:
+            server = client.call("status")
+        except (ConnectionError, TimeoutError) as e:
+            return dict(out, model_server={"address": client.address, "error": str(e)})
+        return dict(out, model_server={"address": client.address, "pid": server["pid"]},
+                    **{k: server[k] for k in ("collections", "query_batching", "query_cache", "embed_backend", "generation")})
+    return dict(out, collections=get_registry().stats(), query_batching=get_query_batcher().stats(), query_cache=cache_stats(),
+                embed_backend=text_backend(), generation=get_generation_worker().stats())
+
+@app.get("/collections")
+def collections():
+    client = get_model_client()
+    resident = set(client.call("status")["collections"]["resident"] if client is not None else get_registry().resident())
+    return {"collections": [{"name": name, "resident": name in resident} for name in list_collections()]}
+
+# Prometheus scrape target: per-stage latency histograms (metrics.py)
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# readiness for load balancers / orchestrators: 503 until warm-up has loaded the index and models
+@app.get("/ready")
+def ready():
+    state = warmup.to_dict()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
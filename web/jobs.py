@@ -0,0 +1,166 @@
+# web/jobs.py
+import os, json, sqlite3, threading, time, uuid, traceback
+from concurrent.futures import ThreadPoolExecutor
+from config import JOB_WORKERS, JOB_HISTORY, JOBS_DB_PATH
+
+_PROGRESS_SAVE_S = 0.5  # progress is written to the job table at most this often
+
+_FIELDS = ("job_id", "kind", "params", "status", "progress", "result", "error", "created", "started", "finished", "pid")
+_JSON_FIELDS = ("params", "progress", "result")
+
+
+class Job:
+    def __init__(self, kind, params=None, save=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params or {}
+        self.status = "queued"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._save = save
+        self._saved = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, **progress):
+        """Progress callback handed to the ingest / index functions."""
+        with self._lock:
+            self.progress.update(progress)
+            due = time.time() - self._saved >= _PROGRESS_SAVE_S
+        if due:
+            self.save()
+
+    def save(self):
+        if self._save is not None:
+            self._saved = time.time()
+            self._save(self.to_dict())
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "params": self.params,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "result": self.result,
+                "error": self.error,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+            }
+
+
+class JobStore:
+    """
+    Job state in sqlite under DATA_DIR, so /jobs/{id} answers on every web worker,
+    not only on the one running the job.
+    """
+
+    def __init__(self, path=JOBS_DB_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT,"
+            " progress TEXT, result TEXT, error TEXT, created REAL, started REAL, finished REAL, pid INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def save(self, job):
+        row = dict(job, pid=os.getpid())
+        for k in _JSON_FIELDS:
+            row[k] = json.dumps(row[k], default=str)
+        with self._lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO jobs VALUES ({','.join('?' * len(_FIELDS))})",
+                               [row[k] for k in _FIELDS])
+            self._conn.commit()
+
+    def trim(self, history):
+        # keep the most recent finished jobs only
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'error') AND job_id NOT IN"
+                " (SELECT job_id FROM jobs WHERE status IN ('done', 'error') ORDER BY created DESC LIMIT ?)",
+                (history,))
+            self._conn.commit()
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(zip(_FIELDS, row))
+        for k in _JSON_FIELDS:
+            job[k] = json.loads(job[k]) if job[k] is not None else None
+        pid = job.pop("pid")
+        if job["status"] in ("queued", "running") and not _alive(pid):
+            # the worker running it exited before the job finished
+            job["status"] = "error"
+            job["error"] = f"Worker {pid} exited before the job finished"
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {','.join(_FIELDS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, limit):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {','.join(_FIELDS)} FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, owned by another user
+    return True
+
+
+class JobManager:
+    """
+    Runs ingestion / indexing work on a small thread pool, off the event loop.
+    Endpoints enqueue and return the job id immediately; /jobs/{id} reports status
+    and progress from the shared JobStore, on any worker. Queries keep using the
+    current index until a build publishes a new version (see
+    index.faiss_index.IndexManager).
+    """
+
+    def __init__(self, workers=JOB_WORKERS, history=JOB_HISTORY, store=None):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mmr-job")
+        self._store = store or JobStore()
+        self._history = history
+
+    def submit(self, kind, fn, *args, params=None, **kwargs):
+        """fn is called as fn(*args, progress=job.update, **kwargs); its return value becomes job.result."""
+        job = Job(kind, params, save=self._store.save)
+        job.save()
+        self._store.trim(self._history)
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.started = time.time()
+        job.save()
+        try:
+            job.result = fn(*args, progress=job.update, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "error"
+            traceback.print_exc()
+        finally:
+            job.finished = time.time()
+            job.save()
+
+    def get(self, job_id):
+        """The job as a dict, whichever worker runs it (None when unknown)."""
+        return self._store.get(job_id)
+
+    def list(self):
+        return self._store.list(self._history)
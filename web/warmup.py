@@ -0,0 +1,116 @@
+# web/warmup.py
+import threading, time
+from config import WARMUP_STAGES
+
+# heavy modules are imported inside the stages, never when this module is loaded
+
+def _warm_index():
+    # the default collection; others are loaded by the registry on first use
+    from index.collections import get_registry
+    coll = get_registry().acquire()
+    mgr = coll.managers()[0]
+    if mgr.version is None:
+        return "no index yet"
+    index, _ = mgr.get()
+    return f"{index.ntotal} vectors ({coll.name})"
+
+def _warm_embedder():
+    from embeddings.embedder import embed_texts, text_backend
+    # loads the weights and runs one forward pass (first-call kernel setup included)
+    embed_texts(["warm-up query"], use_cache=False)
+    return text_backend()
+
+def _warm_clip():
+    from index.image_index import image_index_exists
+    from index.collections import get_registry
+    coll = get_registry().acquire()
+    if not image_index_exists(coll.image_index_path, coll.image_meta_path):
+        return "no image index"
+    from embeddings.embedder import embed_clip_texts
+    embed_clip_texts(["warm-up query"])
+    return "image index loaded"
+
+def _warm_generator():
+    from qa.generation import get_generation_worker
+    worker = get_generation_worker()
+    worker.generate("Answer the question. QUESTION: warm-up Answer:", max_new_tokens=1)
+    return worker.backend
+
+def _warm_model_server(poll_s=1.0):
+    # behind a model server the worker loads nothing itself: wait until the server is up and warm
+    from serving.client import get_model_client
+    client = get_model_client()
+    if client is None:
+        raise RuntimeError("MMR_MODEL_SERVER is not set")
+    while True:
+        try:
+            state = client.call("status")
+        except ConnectionError:
+            state = None
+        if state is not None:
+            failed = [n for n, st in state["warmup"]["stages"].items() if st["status"] == "failed"]
+            if failed:
+                raise RuntimeError(f"model server warm-up failed: {', '.join(failed)}")
+            if state["warmup"]["ready"]:
+                return f"pid {state['pid']} at {client.address}"
+        time.sleep(poll_s)
+
+STAGES = {"index": _warm_index, "embedder": _warm_embedder, "clip": _warm_clip, "generator": _warm_generator,
+          "model_server": _warm_model_server}
+
+
+class Warmup:
+    """
+    Loads the index and models on a background thread after boot, so the first
+    query does not pay for them. ready is True once every stage has finished;
+    a failed stage keeps the worker unready and is reported with its error.
+    """
+
+    def __init__(self, stages=WARMUP_STAGES):
+        unknown = [s for s in stages if s not in STAGES]
+        if unknown:
+            raise ValueError(f"Unknown warm-up stage(s) {unknown}; expected {list(STAGES)}")
+        self.stages = list(stages)
+        self.state = {s: {"status": "pending"} for s in self.stages}
+        self.started = None
+        self.finished = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self.started = time.time()
+                self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+                self._thread.start()
+        return self
+
+    def run(self):
+        """Run every stage in order (start() calls this on the warm-up thread)."""
+        for name in self.stages:
+            self._set(name, status="running")
+            t0 = time.perf_counter()
+            try:
+                detail = STAGES[name]()
+                self._set(name, status="done", seconds=round(time.perf_counter() - t0, 3), detail=detail)
+            except Exception as e:
+                self._set(name, status="failed", seconds=round(time.perf_counter() - t0, 3), error=str(e))
+        self.finished = time.time()
+
+    def _set(self, name, **fields):
+        with self._lock:
+            self.state[name] = fields
+
+    @property
+    def ready(self):
+        with self._lock:
+            return all(s["status"] == "done" for s in self.state.values())
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "ready": all(s["status"] == "done" for s in self.state.values()),
+                "stages": {k: dict(v) for k, v in self.state.items()},
+                "started": self.started,
+                "finished": self.finished,
+            }